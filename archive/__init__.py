@@ -0,0 +1,13 @@
+from .archive_raw_store import RawPayloadStore
+from .archive_match_log import MatchLog
+from .archive_stats_store import SeasonStatsStore
+from .archive_match_index import MatchIndex
+from .archive_trace_store import TraceStore
+
+raw_payload_store = RawPayloadStore()
+match_log = MatchLog()
+season_stats_store = SeasonStatsStore()
+match_index = MatchIndex()
+trace_store = TraceStore()
+
+__all__ = ["raw_payload_store", "match_log", "season_stats_store", "match_index", "trace_store", "RawPayloadStore", "MatchLog", "SeasonStatsStore", "MatchIndex", "TraceStore"]
@@ -0,0 +1,165 @@
+import os
+import time
+import sqlite3
+import threading
+
+MATCH_COLUMNS = [
+    "match_id", "fotmob_id", "season", "match_week_number", "datetime", "home_team_fotmob_id", "home_team_name",
+    "away_team_fotmob_id", "away_team_name", "elapsed", "status", "path", "updated_at"
+]
+
+
+class MatchIndex:
+    """
+    Persistent inverted index from player, team and match ids to match log archive entries. The index is a set of
+    SQLite B-tree indexes so lookups and date or match week range queries stay O(log n) over multiple seasons.
+    """
+
+    def __init__(self):
+        self.path = os.getenv('ARCHIVE_MATCH_INDEX', 'data/match_index.sqlite')
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Gets the index database connection, creating the database if it doesn't exist.
+        """
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS matches (
+                    match_id INTEGER PRIMARY KEY,
+                    fotmob_id INTEGER,
+                    season TEXT NOT NULL,
+                    match_week_number INTEGER NOT NULL,
+                    datetime TEXT,
+                    home_team_fotmob_id INTEGER,
+                    home_team_name TEXT,
+                    away_team_fotmob_id INTEGER,
+                    away_team_name TEXT,
+                    elapsed TEXT,
+                    status TEXT,
+                    path TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS matches_home_team ON matches (home_team_fotmob_id, datetime);
+                CREATE INDEX IF NOT EXISTS matches_away_team ON matches (away_team_fotmob_id, datetime);
+                CREATE INDEX IF NOT EXISTS matches_season ON matches (season, match_week_number);
+                CREATE INDEX IF NOT EXISTS matches_datetime ON matches (datetime);
+
+                CREATE TABLE IF NOT EXISTS match_players (
+                    player_fotmob_id INTEGER NOT NULL,
+                    datetime TEXT NOT NULL,
+                    match_id INTEGER NOT NULL,
+                    season TEXT NOT NULL,
+                    match_week_number INTEGER NOT NULL,
+                    team_fotmob_id INTEGER,
+                    lineup TEXT,
+                    goals INTEGER NOT NULL,
+                    PRIMARY KEY (player_fotmob_id, datetime, match_id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS match_players_match ON match_players (match_id);
+                CREATE INDEX IF NOT EXISTS match_players_match_week ON match_players (player_fotmob_id, season, match_week_number);
+            """)
+        return self.connection
+
+    def update(self, season, match_week_number, path, match_data):
+        """
+        Indexes a match and the players in it. Earlier entries for the match are replaced.
+        """
+        match_id = match_data["matchId"]
+
+        with self.lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO matches ({', '.join(MATCH_COLUMNS)}) VALUES ({', '.join('?' * len(MATCH_COLUMNS))})",
+                    (match_id, match_data["whoscoredId"], season, match_week_number, match_data["datetime"],
+                     match_data["homeTeamWhoscoredId"], match_data["homeTeamName"], match_data["awayTeamWhoscoredId"],
+                     match_data["awayTeamName"], match_data["elapsed"], match_data["status"], path, time.time())
+                )
+                connection.execute("DELETE FROM match_players WHERE match_id = ?", (match_id,))
+                connection.executemany(
+                    "INSERT OR REPLACE INTO match_players VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(player["playerWhoscoredId"], match_data["datetime"] or "", match_id, season, match_week_number,
+                      player["teamWhoscoredId"], player["lineup"], player["goals"]) for player in match_data["players"]]
+                )
+
+    def _query(self, query, parameters):
+        with self.lock:
+            return [dict(row) for row in self._get_connection().execute(query, parameters).fetchall()]
+
+    def get_match(self, match_id):
+        """
+        Gets the index entry for a match, or None if it isn't indexed.
+        """
+        rows = self._query("SELECT * FROM matches WHERE match_id = ?", (match_id,))
+        return rows[0] if rows else None
+
+    def _range_conditions(self, prefix, date_from, date_to, season, match_week_from, match_week_to):
+        conditions = []
+        parameters = []
+
+        for condition, value in [(f"{prefix}datetime >= ?", date_from), (f"{prefix}datetime <= ?", date_to),
+                                 (f"{prefix}season = ?", season),
+                                 (f"{prefix}match_week_number >= ?", match_week_from),
+                                 (f"{prefix}match_week_number <= ?", match_week_to)]:
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+
+        return "".join(f" AND {condition}" for condition in conditions), parameters
+
+    def get_player_matches(self, player_fotmob_id, date_from=None, date_to=None, season=None, match_week_from=None, match_week_to=None):
+        """
+        Gets index entries for all matches a player has been in the squad for, optionally within a date range
+        ("YYYY-MM-DD HH:MM" prefixes) or a season and match week range, newest first.
+        """
+        conditions, parameters = self._range_conditions("p.", date_from, date_to, season, match_week_from, match_week_to)
+
+        return self._query(f"""
+            SELECT m.*, p.team_fotmob_id, p.lineup, p.goals FROM match_players p JOIN matches m ON m.match_id = p.match_id
+            WHERE p.player_fotmob_id = ?{conditions}
+            ORDER BY p.datetime DESC
+        """, [player_fotmob_id] + parameters)
+
+    def get_team_matches(self, team_fotmob_id, date_from=None, date_to=None, season=None, match_week_from=None, match_week_to=None):
+        """
+        Gets index entries for all matches of a team, optionally within a date range or a season and match week
+        range, newest first.
+        """
+        conditions, parameters = self._range_conditions("", date_from, date_to, season, match_week_from, match_week_to)
+
+        return self._query(f"""
+            SELECT * FROM (
+                SELECT * FROM matches WHERE home_team_fotmob_id = ?{conditions}
+                UNION ALL
+                SELECT * FROM matches WHERE away_team_fotmob_id = ?{conditions}
+            ) ORDER BY datetime DESC
+        """, [team_fotmob_id] + parameters + [team_fotmob_id] + parameters)
+
+    def get_last_start(self, player_fotmob_id):
+        """
+        Gets the index entry for the last match a player started, or None.
+        """
+        rows = self._query("""
+            SELECT m.*, p.lineup, p.goals FROM match_players p JOIN matches m ON m.match_id = p.match_id
+            WHERE p.player_fotmob_id = ? AND p.lineup = 'STARTING_LINEUP'
+            ORDER BY p.datetime DESC LIMIT 1
+        """, (player_fotmob_id,))
+        return rows[0] if rows else None
+
+    def get_last_goal(self, player_fotmob_id):
+        """
+        Gets the index entry for the last match a player scored in, or None.
+        """
+        rows = self._query("""
+            SELECT m.*, p.lineup, p.goals FROM match_players p JOIN matches m ON m.match_id = p.match_id
+            WHERE p.player_fotmob_id = ? AND p.goals > 0
+            ORDER BY p.datetime DESC LIMIT 1
+        """, (player_fotmob_id,))
+        return rows[0] if rows else None
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import time
+import zlib
+import fcntl
+import struct
+import logging
+import sqlite3
+import threading
+
+FRAME_HEADER = struct.Struct(">I")
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+# Matches the file names of the old per-minute match files, e.g. "Arsenal vs Chelsea (57).json"
+MATCH_FILE_PATTERN = re.compile(r"^(?P<teams>.+) \((?P<elapsed>[^()]*)\)\.json$")
+
+
+def diff(old, new, path=None):
+    """
+    Returns a list of operations that turn old into new. An operation is [path, value] to set a value or [path] to
+    remove one, where path is a list of dict keys and list indices. Lists are only diffed element by element when
+    their length is unchanged, otherwise they are replaced.
+    """
+    path = path or []
+
+    if old == new:
+        return []
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = []
+        for key in old:
+            if key not in new:
+                operations.append([path + [key]])
+        for key, value in new.items():
+            if key in old:
+                operations.extend(diff(old[key], value, path + [key]))
+            else:
+                operations.append([path + [key], value])
+        return operations
+
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        operations = []
+        for index, (old_value, new_value) in enumerate(zip(old, new)):
+            operations.extend(diff(old_value, new_value, path + [index]))
+        return operations
+
+    return [[path, new]]
+
+
+def patch(state, operations):
+    """
+    Applies operations created by diff to a state and returns the new state.
+    """
+    for operation in operations:
+        path = operation[0]
+
+        if not path:
+            state = operation[1]
+            continue
+
+        target = state
+        for key in path[:-1]:
+            target = target[key]
+
+        if len(operation) == 1:
+            del target[path[-1]]
+        else:
+            target[path[-1]] = operation[1]
+
+    return state
+
+
+class MatchLog:
+    """
+    Stores every update of a match in one append-only compressed log file. Each update is a frame holding either a
+    full snapshot or a delta against the previous update, with a snapshot every ARCHIVE_MATCH_LOG_SNAPSHOT_INTERVAL
+    frames. Frames are indexed by match, sequence number, elapsed time and write time.
+    """
+
+    def __init__(self):
+        self.index_path = os.getenv('ARCHIVE_MATCH_LOG_INDEX', 'data/match_log_index.sqlite')
+        self.snapshot_interval = int(os.getenv('ARCHIVE_MATCH_LOG_SNAPSHOT_INTERVAL', 15))
+        self.connection = None
+        self.lock = threading.Lock()
+        # Latest state per match id as (sequence, frames since snapshot, state) so deltas don't need a log read
+        self.latest = {}
+
+    def _get_connection(self):
+        """
+        Gets the index database connection, creating the database if it doesn't exist.
+        """
+        if self.connection is None:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS frames (
+                    match_id INTEGER NOT NULL,
+                    sequence INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    elapsed TEXT,
+                    written_at REAL NOT NULL,
+                    path TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (match_id, sequence)
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS frames_elapsed ON frames (match_id, elapsed)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS frames_written_at ON frames (match_id, written_at)")
+            self.connection.commit()
+        return self.connection
+
+    def append(self, match_id, path, elapsed, state, written_at=None):
+        """
+        Appends a match state to the log file at path and indexes it.
+        """
+        written_at = written_at or time.time()
+
+        with self.lock:
+            connection = self._get_connection()
+            # Holds the index write lock from reading the last sequence number until the frame is indexed, so another
+            # process appending to the same match can't take the same sequence number in between
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                last = connection.execute(
+                    "SELECT sequence FROM frames WHERE match_id = ? ORDER BY sequence DESC LIMIT 1", (match_id,)
+                ).fetchone()
+                last_sequence = last[0] if last else -1
+
+                cached = self.latest.get(match_id)
+                if last_sequence >= 0 and (cached is None or cached[0] != last_sequence):
+                    # Another process has written to the log or we have restarted, so rebuild the latest state
+                    cached = (last_sequence, self._frames_since_snapshot(match_id, last_sequence), self._read_state(match_id, last_sequence))
+
+                sequence = last_sequence + 1
+
+                if cached is None or cached[1] + 1 >= self.snapshot_interval:
+                    kind, data, frames_since_snapshot = SNAPSHOT, state, 0
+                else:
+                    kind, data, frames_since_snapshot = DELTA, diff(cached[2], state), cached[1] + 1
+
+                frame = zlib.compress(json.dumps({"elapsed": elapsed, "writtenAt": written_at, "data": data},
+                                                 ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "ab") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                    try:
+                        offset = f.seek(0, os.SEEK_END)
+                        f.write(FRAME_HEADER.pack(len(frame)) + frame)
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+                connection.execute(
+                    "INSERT INTO frames (match_id, sequence, kind, elapsed, written_at, path, offset, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (match_id, sequence, kind, elapsed, written_at, path, offset, FRAME_HEADER.size + len(frame))
+                )
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+            self.latest[match_id] = (sequence, frames_since_snapshot, json.loads(json.dumps(state)))
+
+        return sequence
+
+    def _frames_since_snapshot(self, match_id, sequence):
+        snapshot = self._get_connection().execute(
+            "SELECT MAX(sequence) FROM frames WHERE match_id = ? AND sequence <= ? AND kind = ?", (match_id, sequence, SNAPSHOT)
+        ).fetchone()
+        return sequence - snapshot[0]
+
+    def _read_frame(self, f, offset, length):
+        f.seek(offset)
+        frame = f.read(length)
+        return json.loads(zlib.decompress(frame[FRAME_HEADER.size:]))
+
+    def _read_state(self, match_id, sequence):
+        """
+        Reconstructs the state of a match at a sequence number from the closest snapshot and the deltas after it.
+        """
+        connection = self._get_connection()
+        rows = connection.execute("""
+            SELECT kind, path, offset, length FROM frames
+            WHERE match_id = ? AND sequence <= ? AND sequence >= (
+                SELECT MAX(sequence) FROM frames WHERE match_id = ? AND sequence <= ? AND kind = ?
+            )
+            ORDER BY sequence
+        """, (match_id, sequence, match_id, sequence, SNAPSHOT)).fetchall()
+
+        state = None
+        open_files = {}
+        try:
+            for kind, path, offset, length in rows:
+                if path not in open_files:
+                    open_files[path] = open(path, "rb")
+                frame = self._read_frame(open_files[path], offset, length)
+                state = frame["data"] if kind == SNAPSHOT else patch(state, frame["data"])
+        finally:
+            for f in open_files.values():
+                f.close()
+
+        return state
+
+    def get_state(self, match_id, elapsed=None, at=None):
+        """
+        Gets the state of a match at a point in time: the last update with a given elapsed time (e.g. "57", "HT" or
+        "FT"), the last update written at or before a given timestamp, or the latest update. Returns None if there is
+        no such update.
+        """
+        with self.lock:
+            connection = self._get_connection()
+            if elapsed is not None:
+                row = connection.execute(
+                    "SELECT MAX(sequence) FROM frames WHERE match_id = ? AND elapsed = ?", (match_id, elapsed)
+                ).fetchone()
+            elif at is not None:
+                row = connection.execute(
+                    "SELECT MAX(sequence) FROM frames WHERE match_id = ? AND written_at <= ?", (match_id, at)
+                ).fetchone()
+            else:
+                row = connection.execute("SELECT MAX(sequence) FROM frames WHERE match_id = ?", (match_id,)).fetchone()
+
+            if row is None or row[0] is None:
+                return None
+
+            return self._read_state(match_id, row[0])
+
+    def get_states(self, match_id):
+        """
+        Yields (elapsed, written at, state) for every update of a match in the order they were written.
+        """
+        with self.lock:
+            rows = self._get_connection().execute(
+                "SELECT kind, path, offset, length FROM frames WHERE match_id = ? ORDER BY sequence", (match_id,)
+            ).fetchall()
+
+        state = None
+        open_files = {}
+        try:
+            for kind, path, offset, length in rows:
+                if path not in open_files:
+                    open_files[path] = open(path, "rb")
+                frame = self._read_frame(open_files[path], offset, length)
+                state = frame["data"] if kind == SNAPSHOT else patch(state, frame["data"])
+                yield frame["elapsed"], frame["writtenAt"], json.loads(json.dumps(state))
+        finally:
+            for f in open_files.values():
+                f.close()
+
+    def list_entries(self, match_id):
+        """
+        Lists (sequence, elapsed, written at) for every update of a match.
+        """
+        with self.lock:
+            return self._get_connection().execute(
+                "SELECT sequence, elapsed, written_at FROM frames WHERE match_id = ? ORDER BY sequence", (match_id,)
+            ).fetchall()
+
+    def list_matches(self):
+        """
+        Lists the ids of all matches in the log.
+        """
+        with self.lock:
+            return [row[0] for row in self._get_connection().execute("SELECT DISTINCT match_id FROM frames ORDER BY match_id")]
+
+    def migrate(self, directory, delete=False):
+        """
+        Imports old per-minute match files ("Home vs Away (57).json") from a directory tree into match logs next to
+        them. Files are imported in modification time order so the log order matches the original update order.
+        Files whose match already has a frame written at their modification time are skipped, so an interrupted
+        migration can be run again.
+        """
+        match_files = []
+
+        for root, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                match = MATCH_FILE_PATTERN.match(file_name)
+                if match:
+                    full_path = os.path.join(root, file_name)
+                    match_files.append((os.path.getmtime(full_path), full_path, match.group("teams"), match.group("elapsed")))
+
+        match_files.sort()
+        imported = 0
+        skipped = 0
+
+        for modified, full_path, teams, elapsed in match_files:
+            try:
+                with open(full_path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+
+                match_id = state["matchData"]["matchId"]
+                if self._is_indexed(match_id, modified):
+                    skipped += 1
+                else:
+                    log_path = os.path.join(os.path.dirname(full_path), f"{teams}.log")
+                    self.append(match_id, log_path, state["matchData"].get("elapsed", elapsed), state, written_at=modified)
+                    imported += 1
+
+                if delete:
+                    os.remove(full_path)
+            except Exception as e:
+                logging.error(f"Could not import match file {full_path}: {e}")
+
+        logging.info(f"Imported {imported} of {len(match_files)} match files from {directory}, {skipped} already imported")
+
+    def _is_indexed(self, match_id, written_at):
+        with self.lock:
+            return self._get_connection().execute(
+                "SELECT 1 FROM frames WHERE match_id = ? AND written_at = ? LIMIT 1", (match_id, written_at)
+            ).fetchone() is not None
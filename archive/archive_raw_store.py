@@ -0,0 +1,177 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+
+class RawPayloadStore:
+    """
+    Stores raw upstream API responses in a compressed, content-addressed local store. Identical payloads are only
+    stored once and every fetch is indexed by source, resource id and fetch time.
+    """
+
+    def __init__(self):
+        self.directory = os.getenv('ARCHIVE_RAW_DIRECTORY', 'data/raw')
+        self.enabled = os.getenv('ARCHIVE_RAW_ENABLED', 'true').lower() == 'true'
+        self.retention_days = int(os.getenv('ARCHIVE_RAW_RETENTION_DAYS', 0))
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Gets the index database connection, creating the database if it doesn't exist.
+        """
+        if self.connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.connection = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), check_same_thread=False)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS payloads (
+                    id INTEGER PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    resource_id TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS payloads_resource ON payloads (source, resource_id, fetched_at)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS payloads_fetched_at ON payloads (fetched_at)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS payloads_digest ON payloads (digest)")
+            self.connection.commit()
+        return self.connection
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], f"{digest}.gz")
+
+    def _write_temp(self, object_path, content):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, 'wb') as f:
+            f.write(content)
+        return temp_path
+
+    def store(self, source, resource_id, content):
+        """
+        Stores a raw payload and indexes the fetch. Returns the content digest. Failures are logged and never raised
+        since archiving must not break the fetch itself.
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            digest = hashlib.sha256(content).hexdigest()
+            object_path = self._object_path(digest)
+            # Compressed outside the lock, it is only moved into place under it
+            temp_path = self._write_temp(object_path, content) if not os.path.exists(object_path) else None
+
+            with self.lock:
+                connection = self._get_connection()
+                # prune deletes unreferenced objects under the same write lock, so the object can't be deleted
+                # between checking that it exists and indexing the fetch that references it
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    if not os.path.exists(object_path):
+                        os.replace(temp_path or self._write_temp(object_path, content), object_path)
+                        temp_path = None
+                    connection.execute(
+                        "INSERT INTO payloads (source, resource_id, fetched_at, digest, size) VALUES (?, ?, ?, ?, ?)",
+                        (source, resource_id, time.time(), digest, len(content))
+                    )
+                    connection.commit()
+                except BaseException:
+                    connection.rollback()
+                    raise
+                finally:
+                    if temp_path is not None:
+                        # Another writer stored the same payload first
+                        os.remove(temp_path)
+
+            return digest
+        except Exception as e:
+            logging.error("Error archiving %s payload %s: %s", source, resource_id, e)
+            return None
+
+    def get(self, digest):
+        """
+        Gets the raw content for a digest.
+        """
+        with gzip.open(self._object_path(digest), 'rb') as f:
+            return f.read()
+
+    def get_latest(self, source, resource_id, before=None):
+        """
+        Gets the raw content of the latest fetch of a resource, optionally fetched before a given time, or None
+        if it has never been fetched.
+        """
+        with self.lock:
+            row = self._get_connection().execute(
+                "SELECT digest FROM payloads WHERE source = ? AND resource_id = ? AND fetched_at < ? ORDER BY fetched_at DESC LIMIT 1",
+                (source, resource_id, before if before is not None else float('inf'))
+            ).fetchone()
+
+        return self.get(row[0]) if row else None
+
+    def get_latest_json(self, source, resource_id, before=None):
+        """
+        Gets the parsed JSON of the latest fetch of a resource, or None if it has never been fetched.
+        """
+        content = self.get_latest(source, resource_id, before)
+        return json.loads(content) if content is not None else None
+
+    def list(self, source=None, resource_id=None, since=None, until=None):
+        """
+        Lists indexed fetches as (source, resource id, fetch time, digest, size) tuples in fetch order.
+        """
+        query = "SELECT source, resource_id, fetched_at, digest, size FROM payloads WHERE fetched_at >= ? AND fetched_at < ?"
+        parameters = [since or 0, until or float('inf')]
+
+        if source is not None:
+            query += " AND source = ?"
+            parameters.append(source)
+        if resource_id is not None:
+            query += " AND resource_id = ?"
+            parameters.append(resource_id)
+
+        with self.lock:
+            return self._get_connection().execute(query + " ORDER BY fetched_at", parameters).fetchall()
+
+    def prune(self, retention_days=None):
+        """
+        Removes index entries older than the retention period and deletes objects that are no longer referenced.
+        A retention period of 0 days keeps everything.
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+
+        if retention_days <= 0:
+            return
+
+        cutoff = time.time() - retention_days * 24 * 60 * 60
+
+        with self.lock:
+            connection = self._get_connection()
+            # Objects are deleted before committing, so store can't reference one in between
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                expired = connection.execute(
+                    "SELECT DISTINCT digest FROM payloads WHERE fetched_at < ?", (cutoff,)
+                ).fetchall()
+                connection.execute("DELETE FROM payloads WHERE fetched_at < ?", (cutoff,))
+
+                removed = 0
+                for (digest,) in expired:
+                    if connection.execute("SELECT 1 FROM payloads WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                        try:
+                            os.remove(self._object_path(digest))
+                            removed += 1
+                        except FileNotFoundError:
+                            pass
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+        logging.info("Raw payload archive pruned: %d objects older than %s days removed", removed, retention_days)
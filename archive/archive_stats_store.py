@@ -0,0 +1,215 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+
+LINEUP_CODES = {"STARTING_LINEUP": 1, "SUBSTITUTE": 2}
+FULL_TIME_MINUTES = 90
+
+# Integer columns of the per-player-per-match rows
+COLUMNS = [
+    "match_id", "match_week_number", "player_fotmob_id", "team_fotmob_id", "lineup", "minutes_played",
+    "rating", "goals", "goal_assists", "own_goals", "goals_conceded", "yellow_card_time", "red_card_time",
+    "substitution_on_time", "substitution_off_time", "man_of_the_match", "shared_man_of_the_match"
+]
+
+# Columns that make sense to sum per player or team
+SUM_COLUMNS = [
+    "minutes_played", "goals", "goal_assists", "own_goals", "goals_conceded", "man_of_the_match", "shared_man_of_the_match"
+]
+
+
+def elapsed_minutes(elapsed):
+    """
+    Converts a Fotmob elapsed time like "57", "45+2", "HT" or "FT" to minutes.
+    """
+    if elapsed == "FT":
+        return FULL_TIME_MINUTES
+    if elapsed == "HT":
+        return 45
+    try:
+        return sum(int(part) for part in str(elapsed).split("+"))
+    except ValueError:
+        return 0
+
+
+class SeasonStatsStore:
+    """
+    Stores per-player-per-match statistics in a columnar format, one compressed numpy partition per match, so
+    season-wide rollups are vectorized array operations instead of walks over match JSON.
+    """
+
+    def __init__(self):
+        self.directory = os.getenv('ARCHIVE_STATS_DIRECTORY', 'data/stats')
+        self.lock = threading.Lock()
+        # Loaded partitions per season as {match id: {column: array}}
+        self.partitions = {}
+        self.names = {}
+
+    def _season_directory(self, season):
+        return os.path.join(self.directory, season)
+
+    def update(self, season, match_week_number, match_data):
+        """
+        Replaces the rows for a match with the players in the given match data.
+        """
+        players = match_data["players"]
+        minutes = elapsed_minutes(match_data["elapsed"])
+
+        def column(key, default=0):
+            return np.array([player[key] or default for player in players], dtype=np.int64)
+
+        lineup = np.array([LINEUP_CODES.get(player["lineup"], 0) for player in players], dtype=np.int64)
+        on_time = column("substitutionOnTime")
+        off_time = column("substitutionOffTime")
+        red_card_time = column("redCardTime")
+
+        # Starters play from kick off and subs from when they come on, until they're subbed off, sent off or the
+        # match (so far) ends
+        start = np.where(lineup == 1, 0, np.where(on_time > 0, on_time, minutes))
+        end = np.full(len(players), minutes, dtype=np.int64)
+        end = np.where((off_time > 0) & (off_time < end), off_time, end)
+        end = np.where((red_card_time > 0) & (red_card_time < end), red_card_time, end)
+
+        partition = {
+            "match_id": np.full(len(players), match_data["matchId"], dtype=np.int64),
+            "match_week_number": np.full(len(players), match_week_number, dtype=np.int64),
+            "player_fotmob_id": column("playerWhoscoredId"),
+            "team_fotmob_id": column("teamWhoscoredId"),
+            "lineup": lineup,
+            "minutes_played": np.maximum(end - start, 0),
+            "rating": column("rating"),
+            "goals": column("goals"),
+            "goal_assists": column("goalAssists"),
+            "own_goals": column("ownGoals"),
+            "goals_conceded": column("goalsConceded"),
+            "yellow_card_time": column("yellowCardTime"),
+            "red_card_time": red_card_time,
+            "substitution_on_time": on_time,
+            "substitution_off_time": off_time,
+            "man_of_the_match": column("manOfTheMatch"),
+            "shared_man_of_the_match": column("sharedManOfTheMatch"),
+        }
+
+        directory = self._season_directory(season)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{match_data['matchId']}.npz")
+        temp_path = f"{path}.tmp"
+
+        with self.lock:
+            with open(temp_path, "wb") as f:
+                np.savez_compressed(f, **partition)
+            os.replace(temp_path, path)
+
+            names = self._load_names(season)
+            names.update({str(player["playerWhoscoredId"]): player["playerName"] for player in players})
+            names.update({str(player["teamWhoscoredId"]): player["teamName"] for player in players})
+            with open(os.path.join(directory, "names.json"), "w", encoding="utf-8") as f:
+                json.dump(names, f, ensure_ascii=False)
+
+            if season in self.partitions:
+                self.partitions[season][match_data["matchId"]] = partition
+
+    def _load_names(self, season):
+        if season not in self.names:
+            path = os.path.join(self._season_directory(season), "names.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self.names[season] = json.load(f)
+            else:
+                self.names[season] = {}
+        return self.names[season]
+
+    def load(self, season):
+        """
+        Gets all rows for a season as a dict of column arrays.
+        """
+        with self.lock:
+            if season not in self.partitions:
+                partitions = {}
+                directory = self._season_directory(season)
+                if os.path.isdir(directory):
+                    for file_name in os.listdir(directory):
+                        if file_name.endswith(".npz"):
+                            with np.load(os.path.join(directory, file_name)) as data:
+                                partitions[int(file_name[:-4])] = {name: data[name] for name in COLUMNS}
+                self.partitions[season] = partitions
+                logging.debug('Loaded %d match partitions for season %s', len(partitions), season)
+
+            partitions = list(self.partitions[season].values())
+
+        if not partitions:
+            return {name: np.empty(0, dtype=np.int64) for name in COLUMNS}
+
+        return {name: np.concatenate([partition[name] for partition in partitions]) for name in COLUMNS}
+
+    def totals(self, season, group_by="player_fotmob_id", match_week_from=None, match_week_to=None):
+        """
+        Aggregates a season per player or team: match count, starts, sums of SUM_COLUMNS, card counts and average
+        rating. Every player of a team has goals conceded while they were on the pitch, so for a team the most any
+        of its players conceded in a match is summed instead. Returns one dict per group sorted by id.
+        """
+        rows = self.load(season)
+
+        mask = np.ones(len(rows["match_id"]), dtype=bool)
+        if match_week_from is not None:
+            mask &= rows["match_week_number"] >= match_week_from
+        if match_week_to is not None:
+            mask &= rows["match_week_number"] <= match_week_to
+
+        # Only count players that have actually been on the pitch
+        mask &= rows["minutes_played"] > 0
+        rows = {name: values[mask] for name, values in rows.items()}
+
+        ids, groups = np.unique(rows[group_by], return_inverse=True)
+        group_count = len(ids)
+
+        def group_sum(values):
+            return np.bincount(groups, weights=values, minlength=group_count)
+
+        # A team has many rows per match so count distinct (group, match) pairs
+        group_match_pairs, pair_index = np.unique(np.stack([groups, rows["match_id"]]), axis=1, return_inverse=True)
+        group_matches = group_match_pairs[0]
+
+        result = {
+            "matches": np.bincount(group_matches, minlength=group_count),
+            "starts": group_sum(rows["lineup"] == 1),
+            "yellow_cards": group_sum(rows["yellow_card_time"] > 0),
+            "red_cards": group_sum(rows["red_card_time"] > 0),
+        }
+        for name in SUM_COLUMNS:
+            result[name] = group_sum(rows[name])
+
+        if group_by != "player_fotmob_id":
+            match_goals_conceded = np.zeros(len(group_matches))
+            np.maximum.at(match_goals_conceded, pair_index.reshape(-1), rows["goals_conceded"])
+            result["goals_conceded"] = np.bincount(group_matches, weights=match_goals_conceded, minlength=group_count)
+
+        rated = rows["rating"] > 0
+        rating_count = np.bincount(groups[rated], minlength=group_count)
+        rating_sum = np.bincount(groups[rated], weights=rows["rating"][rated], minlength=group_count)
+        average_rating = np.divide(rating_sum, rating_count, out=np.zeros(group_count), where=rating_count > 0) / 100
+
+        names = self._load_names(season)
+
+        return [
+            {
+                "id": int(group_id),
+                "name": names.get(str(group_id)),
+                **{name: int(values[index]) for name, values in result.items()},
+                "average_rating": round(float(average_rating[index]), 2),
+            }
+            for index, group_id in enumerate(ids)
+        ]
+
+    def player_matches(self, season, player_fotmob_id):
+        """
+        Gets all rows for a player in a season as a list of dicts ordered by match week.
+        """
+        rows = self.load(season)
+        indices = np.flatnonzero(rows["player_fotmob_id"] == player_fotmob_id)
+        indices = indices[np.argsort(rows["match_week_number"][indices], kind="stable")]
+
+        return [{name: int(rows[name][index]) for name in COLUMNS} for index in indices]
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+
+class TraceStore:
+    """
+    Persistent store of match update traces, one row per update with its timed spans, indexed by match and
+    correlation id so per-match latency breakdowns can be looked up after the fact. The correlation ids of messages
+    coalesced into an update are indexed in a side table, so the update is found by any of them.
+    """
+
+    def __init__(self):
+        self.path = os.getenv('ARCHIVE_TRACE_STORE', 'data/traces.sqlite')
+        self.retention_days = int(os.getenv('ARCHIVE_TRACE_RETENTION_DAYS', 30))
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Gets the trace database connection, creating the database if it doesn't exist.
+        """
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            has_coalesced_ids = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'coalesced_ids'"
+            ).fetchone() is not None
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS traces (
+                    trace_id TEXT NOT NULL,
+                    match_id INTEGER,
+                    finish INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    duration REAL NOT NULL,
+                    coalesced TEXT NOT NULL,
+                    spans TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS traces_match ON traces (match_id, started_at);
+                CREATE INDEX IF NOT EXISTS traces_trace_id ON traces (trace_id);
+                CREATE INDEX IF NOT EXISTS traces_started_at ON traces (started_at);
+                CREATE TABLE IF NOT EXISTS coalesced_ids (
+                    correlation_id TEXT NOT NULL,
+                    trace_rowid INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS coalesced_ids_correlation_id ON coalesced_ids (correlation_id);
+                CREATE INDEX IF NOT EXISTS coalesced_ids_trace_rowid ON coalesced_ids (trace_rowid);
+            """)
+            if not has_coalesced_ids:
+                # Index the coalesced ids of traces recorded before the side table existed
+                with self.connection:
+                    self.connection.execute("""
+                        INSERT INTO coalesced_ids (correlation_id, trace_rowid)
+                        SELECT coalesced.value, traces.rowid FROM traces, json_each(traces.coalesced) AS coalesced
+                    """)
+        return self.connection
+
+    def record(self, trace):
+        """
+        Stores a finished trace.
+        """
+        with self.lock:
+            connection = self._get_connection()
+            with connection:
+                trace_rowid = connection.execute(
+                    "INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (trace.trace_id, trace.match_id, int(bool(trace.finish)), trace.status, trace.started_at,
+                     trace.duration, json.dumps(trace.coalesced), json.dumps(trace.spans))
+                ).lastrowid
+                connection.executemany("INSERT INTO coalesced_ids (correlation_id, trace_rowid) VALUES (?, ?)",
+                                       [(correlation_id, trace_rowid) for correlation_id in trace.coalesced])
+
+    def _query(self, query, parameters):
+        with self.lock:
+            rows = self._get_connection().execute(query, parameters).fetchall()
+        traces = []
+        for row in rows:
+            trace = dict(row)
+            trace["finish"] = bool(trace["finish"])
+            trace["coalesced"] = json.loads(trace["coalesced"])
+            trace["spans"] = json.loads(trace["spans"])
+            traces.append(trace)
+        return traces
+
+    def get_trace(self, trace_id):
+        """
+        Gets the traces of the updates that handled the message with a correlation id, either as the message that
+        queued the update or as one coalesced into it, oldest first. There is more than one if the update was
+        retried.
+        """
+        return self._query("""
+            SELECT * FROM traces
+            WHERE trace_id = ? OR rowid IN (SELECT trace_rowid FROM coalesced_ids WHERE correlation_id = ?)
+            ORDER BY started_at
+        """, (trace_id, trace_id))
+
+    def get_match_traces(self, match_id, limit=None):
+        """
+        Gets the traces of the updates of a match, newest first.
+        """
+        return self._query("SELECT * FROM traces WHERE match_id = ? ORDER BY started_at DESC LIMIT ?",
+                           (match_id, limit if limit is not None else -1))
+
+    def prune(self, retention_days=None):
+        """
+        Removes traces older than the retention period. A retention period of 0 days keeps everything.
+        """
+        retention_days = self.retention_days if retention_days is None else retention_days
+
+        if retention_days <= 0:
+            return
+
+        cutoff = time.time() - retention_days * 24 * 60 * 60
+
+        with self.lock:
+            connection = self._get_connection()
+            with connection:
+                connection.execute("DELETE FROM coalesced_ids WHERE trace_rowid IN (SELECT rowid FROM traces WHERE started_at < ?)", (cutoff,))
+                removed = connection.execute("DELETE FROM traces WHERE started_at < ?", (cutoff,)).rowcount
+
+        logging.info("Trace store pruned: %d traces older than %s days removed", removed, retention_days)
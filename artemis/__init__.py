@@ -1,8 +1,9 @@
 from .artemis_connection_manager import ArtemisConnectionManager
 from .artemis_listener import ArtemisListener
+from .artemis_stub_broker import ArtemisStubBroker
 from .artemis_sender import ArtemisSender
 
 artemis_connection_manager = ArtemisConnectionManager()
 artemis_sender = ArtemisSender(artemis_connection_manager=artemis_connection_manager)
 
-__all__ = ["artemis_connection_manager", "artemis_sender", "ArtemisConnectionManager", "ArtemisListener", "ArtemisSender"]
+__all__ = ["artemis_connection_manager", "artemis_sender", "ArtemisConnectionManager", "ArtemisListener", "ArtemisSender", "ArtemisStubBroker"]
@@ -1,11 +1,62 @@
 import os
 import stomp
 import logging
+import threading
+import itertools
+
+
+class ArtemisProducerListener(stomp.ConnectionListener):
+    """
+    Logs errors and disconnections on a producer connection and keeps track of receipts. Producer connections are
+    reconnected on next use.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.condition = threading.Condition()
+        self.receipts = set()
+        self.errors = {}
+
+    def on_error(self, frame):
+        logging.error('Artemis MQ error on %s: %s %s', self.name, frame.headers.get('message', ''), frame.body)
+        receipt_id = frame.headers.get('receipt-id')
+        if receipt_id is not None:
+            with self.condition:
+                self.errors[receipt_id] = frame.headers.get('message', frame.body)
+                self.condition.notify_all()
+
+    def on_receipt(self, frame):
+        with self.condition:
+            self.receipts.add(frame.headers.get('receipt-id'))
+            self.condition.notify_all()
+
+    def on_disconnected(self):
+        logging.warning('Disconnected from Artemis MQ on %s -- reconnecting on next send', self.name)
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for_receipt(self, receipt_id, connection, timeout):
+        """
+        Waits up to timeout seconds for the broker to confirm a frame sent with a receipt header. Raises an exception
+        if the broker returns an error for it, the connection goes down or it times out.
+        """
+        with self.condition:
+            done = self.condition.wait_for(lambda: receipt_id in self.receipts or receipt_id in self.errors
+                                           or not connection.is_connected(), timeout)
+            if receipt_id in self.errors:
+                raise Exception(f"Artemis MQ error on {self.name}: {self.errors.pop(receipt_id)}")
+            if receipt_id in self.receipts:
+                self.receipts.discard(receipt_id)
+                return
+            if not done:
+                raise TimeoutError(f"No receipt {receipt_id} from Artemis MQ on {self.name} after {timeout}s")
+            raise ConnectionError(f"Disconnected from Artemis MQ on {self.name} while waiting for receipt {receipt_id}")
 
 
 class ArtemisConnectionManager:
     """
-    Manages singleton connection to Artemis MQ.    
+    Manages connections to Artemis MQ. Consuming and producing use separate connections, a consumer connection and
+    a small pool of producer connections, each with its own heartbeats and reconnect handling, so large sends and
+    reconnects on one side don't stall the other.
     """
 
     def __init__(self):
@@ -15,51 +66,169 @@ class ArtemisConnectionManager:
         self.user = os.getenv('D11_MQ_USER', 'user')
         self.password = os.getenv('D11_MQ_PASSWORD', 'password')
         self.listener = None
+        # 'auto' or 'client-individual'. With client-individual, messages are only acked when they have been handled
+        self.ack_mode = os.getenv('D11_MQ_ACK_MODE', 'auto')
+        # Max number of unacked messages the broker may push to a subscription. 0 means broker default
+        self.prefetch = int(os.getenv('D11_MQ_PREFETCH', 0))
+        # Artemis STOMP flow control window in bytes. Unset means broker default
+        self.consumer_window_size = os.getenv('D11_MQ_CONSUMER_WINDOW_SIZE')
+        # Incremented on every new consumer connection so acks for messages from an old connection can be skipped
+        self.generation = 0
+
+        self.consumer_heartbeat = int(os.getenv('D11_MQ_CONSUMER_HEARTBEAT_MS', 30000))
+        self.producer_heartbeat = int(os.getenv('D11_MQ_PRODUCER_HEARTBEAT_MS', 30000))
+        self.producer_connections = [None] * int(os.getenv('D11_MQ_PRODUCER_CONNECTIONS', 1))
+        self.producer_locks = [threading.Lock() for _ in self.producer_connections]
+        self.producer_counter = itertools.count()
+        self.consumer_lock = threading.RLock()
+        # Set when disconnected on purpose so the disconnect notification doesn't trigger a reconnect
+        self.closed = False
+
+    def _open_connection(self, heartbeat):
+        connection = stomp.Connection([(self.host, self.port)], heartbeats=(heartbeat, heartbeat))
+        connection.connect(login=self.user, passcode=self.password, wait=True)
+        return connection
 
     def connect(self):
         """
-        Connects to Artemis MQ, if not already connected.
+        Connects the consumer connection to Artemis MQ, if not already connected.
         """
-        if self.connection is None or not self.connection.is_connected():
-            self.connection = stomp.Connection([(self.host, self.port)], heartbeats=(30000, 30000))
-            self.connection.connect(login=self.user, passcode=self.password, wait=True)
-            logging.info('Connected to Artemis MQ on %s:%s', self.host, self.port)
+        with self.consumer_lock:
+            self.closed = False
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = self._open_connection(self.consumer_heartbeat)
+                self.generation += 1
+                logging.info('Connected consumer to Artemis MQ on %s:%s', self.host, self.port)
 
     def disconnect(self):
         """
-        Disconnects from Artemis MQ.
+        Disconnects all connections from Artemis MQ.
         """
-        if self.connection and self.connection.is_connected():
-            self.connection.disconnect()
+        with self.consumer_lock:
+            self.closed = True
+            self._disconnect_consumer()
+
+        for index, lock in enumerate(self.producer_locks):
+            with lock:
+                connection = self.producer_connections[index]
+                self.producer_connections[index] = None
+                if connection and connection.is_connected():
+                    connection.disconnect()
+                    logging.info('Disconnected producer %d from Artemis MQ', index)
+
+    def _disconnect_consumer(self):
+        with self.consumer_lock:
+            if self.connection and self.connection.is_connected():
+                self.connection.disconnect()
+                logging.info('Disconnected consumer from Artemis MQ')
             self.connection = None
-            logging.info('Disconnected from Artemis MQ')
-    
+
     def reconnect(self):
         """
-        Reconnects to Artemis MQ and resets the listener, if there is one.
+        Reconnects the consumer connection to Artemis MQ and resets the listener, if there is one. Does nothing if
+        the consumer connection is up, e.g. when notified of an old connection going down, or if the manager has
+        been disconnected on purpose. Producer connections are not affected.
         """
-        self.disconnect()
-        self.connect()
-        self.set_listener(self.listener)
+        with self.consumer_lock:
+            if self.closed or (self.connection is not None and self.connection.is_connected()):
+                return
+            self._disconnect_consumer()
+            self.connect()
+            if self.listener is not None:
+                self.set_listener(self.listener)
 
     def get_connection(self):
         """
-        Gets a singleton Artemis MQ connection.
+        Gets a producer connection from the pool, connecting it if needed.
         """
-        self.connect()
-        return self.connection
+        index = next(self.producer_counter) % len(self.producer_connections)
+
+        with self.producer_locks[index]:
+            connection = self.producer_connections[index]
+            if connection is None or not connection.is_connected():
+                connection = self._open_connection(self.producer_heartbeat)
+                connection.set_listener('ArtemisProducerListener', ArtemisProducerListener(f"producer {index}"))
+                self.producer_connections[index] = connection
+                logging.info('Connected producer %d to Artemis MQ on %s:%s', index, self.host, self.port)
+            return connection
+
+    def get_producer_listener(self, connection):
+        """
+        Gets the producer listener of a producer connection.
+        """
+        return connection.get_listener('ArtemisProducerListener')
 
     def set_listener(self, listener):
         """
-        Sets a listener and subscribes to all queues the listener wants to listen to.
+        Sets a listener on the consumer connection and subscribes to all queues the listener wants to listen to.
+        """
+        with self.consumer_lock:
+            self.connect()
+            self.listener = listener
+            if self.connection and self.connection.is_connected():
+                listener_name = listener.__class__.__name__
+                self.connection.set_listener(listener_name, listener)
+                logging.debug('Listener %s set for Artemis MQ', listener_name)
+
+                for queue in self.listener.queues:
+                    self.connection.subscribe(destination=queue, id=queue, ack=self.ack_mode, headers=self.get_subscription_headers())
+                    logging.info('Subscribed to queue: %s (ack: %s)', queue, self.ack_mode)
+
+                for topic in getattr(self.listener, 'topics', []):
+                    self.connection.subscribe(destination=topic, id=topic, ack='auto', headers={'subscription-type': 'MULTICAST'})
+                    logging.info('Subscribed to topic: %s', topic)
+
+    def subscribe(self, queue):
+        """
+        Subscribes the consumer connection to another queue. The queue must also be added to the listener's queues
+        so it is subscribed to again after a reconnect.
+        """
+        with self.consumer_lock:
+            if self.connection and self.connection.is_connected():
+                self.connection.subscribe(destination=queue, id=queue, ack=self.ack_mode, headers=self.get_subscription_headers())
+                logging.info('Subscribed to queue: %s (ack: %s)', queue, self.ack_mode)
+
+    def unsubscribe(self, queue):
+        """
+        Unsubscribes the consumer connection from a queue.
         """
-        self.connect()
-        self.listener = listener
-        if self.connection and self.connection.is_connected():
-            listener_name = listener.__class__.__name__
-            self.connection.set_listener(listener_name, listener)
-            logging.debug('Listener %s set for Artemis MQ', listener_name)
+        with self.consumer_lock:
+            if self.connection and self.connection.is_connected():
+                self.connection.unsubscribe(id=queue)
+                logging.info('Unsubscribed from queue: %s', queue)
 
-            for queue in self.listener.queues:
-                self.connection.subscribe(destination=queue, id=queue, ack='auto')
-                logging.info('Subscribed to queue: %s', queue)
+    def get_subscription_headers(self):
+        """
+        Gets the flow control headers for a subscription. Artemis uses consumer-window-size (bytes), ActiveMQ
+        Classic uses activemq.prefetchSize (messages). Brokers ignore headers they don't know.
+        """
+        headers = {}
+        if self.ack_mode != 'auto' and self.prefetch > 0:
+            headers['activemq.prefetchSize'] = self.prefetch
+        if self.consumer_window_size is not None:
+            headers['consumer-window-size'] = self.consumer_window_size
+        return headers
+
+    def ack(self, frame, generation):
+        """
+        Acknowledges a message received on the consumer connection with the given generation. Does nothing in auto
+        ack mode. Messages from an earlier connection can't be acked and will be redelivered by the broker.
+        """
+        if self.ack_mode == 'auto':
+            return
+        connection = self.connection
+        if generation != self.generation or connection is None or not connection.is_connected():
+            logging.debug('Not acking message %s from a previous connection', frame.headers.get('message-id'))
+            return
+        connection.ack(frame.headers.get('message-id'), frame.headers.get('subscription'))
+
+    def nack(self, frame, generation):
+        """
+        Negatively acknowledges a message so the broker redelivers it. Does nothing in auto ack mode.
+        """
+        if self.ack_mode == 'auto':
+            return
+        connection = self.connection
+        if generation != self.generation or connection is None or not connection.is_connected():
+            return
+        connection.nack(frame.headers.get('message-id'), frame.headers.get('subscription'))
@@ -10,10 +10,14 @@ class ArtemisListener(stomp.ConnectionListener):
     active_match_queue = os.getenv('D11_MQ_ACTIVE_MATCH_QUEUE', 'D11::ACTIVE_MATCH')
     ping_queue = os.getenv('D11_PING_QUEUE', 'D11::PING')
 
-    def __init__(self, artemis_connection_manager, queues, on_active_match):
+    def __init__(self, artemis_connection_manager, queues, on_active_match, topics=None, handlers=None):
         self.queues = queues
         self.on_active_match = on_active_match
         self.artemis_connection_manager = artemis_connection_manager
+        # Multicast addresses to subscribe to, and handlers for destinations other than the active match and ping
+        # queues. Handlers are responsible for acking
+        self.topics = topics or []
+        self.handlers = handlers or {}
 
     def on_error(self, frame):
         """
@@ -38,12 +42,17 @@ class ArtemisListener(stomp.ConnectionListener):
         destination = frame.headers.get('destination', '')
         subscription = frame.headers.get('subscription', '')
 
-        if destination == self.active_match_queue or self.active_match_queue in subscription:
+        if destination in self.handlers:
+            self.handlers[destination](frame)
+        elif destination == self.active_match_queue or self.active_match_queue in subscription:
+            # Acked by the active match handler once the message has been handled
             self.on_active_match(frame)
         elif destination == self.ping_queue:
             self.on_ping(frame)
+            self.artemis_connection_manager.ack(frame, self.artemis_connection_manager.generation)
         else:
             logging.warning('Unknown message destination/subscription: %s / %s', destination, subscription)
+            self.artemis_connection_manager.ack(frame, self.artemis_connection_manager.generation)
 
     def on_ping(self, frame):
         """
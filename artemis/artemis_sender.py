@@ -1,18 +1,134 @@
+import os
+import uuid
+import atexit
 import logging
 
+from metrics import metrics_registry
+
+from .artemis_spool import ArtemisSpool
+
 
 class ArtemisSender:
     """
-    Sends messages to Artemis MQ.
+    Sends messages to Artemis MQ. With D11_MQ_ASYNC_PUBLISH enabled, messages are written to a disk spool and
+    published by a background thread so callers don't block on the broker. If another process is using the spool
+    directory, messages are sent synchronously instead. Spooled messages are only deleted after a broker receipt
+    confirms them. Batches of messages are sent in a single STOMP transaction so either all or none of them are
+    delivered.
     """
 
     def __init__(self, artemis_connection_manager):
         self.artemis_connection_manager = artemis_connection_manager
+        self.async_publish = os.getenv('D11_MQ_ASYNC_PUBLISH', 'false').lower() == 'true'
+        self.flush_timeout = float(os.getenv('D11_MQ_SPOOL_FLUSH_TIMEOUT', 10))
+        self.receipt_timeout = float(os.getenv('D11_MQ_RECEIPT_TIMEOUT', 10))
+        self.spool = ArtemisSpool(self._send_confirmed, self._send_batch) if self.async_publish else None
+
+        if self.spool is not None:
+            atexit.register(self.stop)
+
+    def start(self):
+        """
+        Starts the background publisher, replaying messages spooled by an earlier run. Does nothing unless
+        publishing is asynchronous.
+        """
+        self._get_spool()
+
+    def _get_spool(self):
+        """
+        Gets the spool, starting it if it isn't running. Returns None if publishing is synchronous.
+        """
+        if self.spool is not None and self.spool.thread is None:
+            try:
+                self.spool.start()
+            except RuntimeError as e:
+                logging.warning(f"{e}, publishing synchronously")
+                self.spool = None
+        return self.spool
+
+    def stop(self):
+        """
+        Gives the background publisher a chance to drain the spool before stopping it.
+        """
+        if self.spool is not None and self.spool.thread is not None:
+            if not self.spool.flush(self.flush_timeout):
+                logging.warning('%d MQ messages left in spool', self.spool.depth)
+            self.spool.stop(0)
 
-    def send_message(self, destination, body):
+    def send_message(self, destination, body, headers=None):
         """
         Sends a message to a specific destination on Artemis MQ.
         """
-        connection = self.artemis_connection_manager.get_connection()
-        connection.send(destination=destination, body=body, headers={'content-type': 'application/json'})
+        headers = {'content-type': 'application/json', **(headers or {})}
+
+        spool = self._get_spool()
+        if spool is not None:
+            spool.enqueue(destination, body, headers)
+            logging.debug('Message spooled for destination: %s', destination)
+        else:
+            self._send(destination, body, headers)
+
+    def send_batch(self, messages):
+        """
+        Sends a list of (destination, body, headers) messages in one transaction. The frames are pipelined and the
+        commit waits for a broker receipt, so when this returns every message has been delivered. If anything fails
+        the transaction is aborted, nothing is delivered and the exception is raised.
+        """
+        messages = [(destination, body, {'content-type': 'application/json', **(headers or {})})
+                    for destination, body, headers in messages]
+
+        if not messages:
+            return
+
+        spool = self._get_spool()
+        if spool is not None:
+            spool.enqueue_batch(messages)
+            logging.debug('Batch of %d messages spooled', len(messages))
+        else:
+            self._send_batch(messages)
+
+    def _send(self, destination, body, headers):
+        with metrics_registry.timer("mq_send_seconds", destination=destination):
+            connection = self.artemis_connection_manager.get_connection()
+            connection.send(destination=destination, body=body, headers=headers)
         logging.debug('Message sent to destination: %s', destination)
+
+    def _send_confirmed(self, destination, body, headers):
+        with metrics_registry.timer("mq_send_seconds", destination=destination):
+            connection = self.artemis_connection_manager.get_connection()
+            receipt_id = f"send-{uuid.uuid4()}"
+            connection.send(destination=destination, body=body, headers={**headers, 'receipt': receipt_id})
+            self.artemis_connection_manager.get_producer_listener(connection).wait_for_receipt(receipt_id, connection, self.receipt_timeout)
+        logging.debug('Message sent to destination: %s', destination)
+
+    def _send_batch(self, messages):
+        with metrics_registry.timer("mq_send_batch_seconds"):
+            self._send_transaction(messages)
+        metrics_registry.increment("mq_batch_messages_total", len(messages))
+
+    def _send_transaction(self, messages):
+        connection = self.artemis_connection_manager.get_connection()
+        transaction = connection.begin(str(uuid.uuid4()))
+
+        try:
+            for destination, body, headers in messages:
+                connection.send(destination=destination, body=body, headers={**headers, 'transaction': transaction})
+
+            receipt_id = f"commit-{transaction}"
+            connection.commit(transaction, headers={'receipt': receipt_id})
+            self.artemis_connection_manager.get_producer_listener(connection).wait_for_receipt(receipt_id, connection, self.receipt_timeout)
+        except Exception:
+            if connection.is_connected():
+                try:
+                    connection.abort(transaction)
+                except Exception as e:
+                    logging.warning('Error aborting MQ transaction %s: %s', transaction, e)
+            raise
+
+        logging.debug('Batch of %d messages sent in transaction %s', len(messages), transaction)
+
+    def get_metrics(self):
+        """
+        Gets spool metrics when publishing is asynchronous.
+        """
+        return self.spool.get_metrics() if self.spool is not None else {}
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+
+from collections import deque
+
+SPOOL_FILE_SUFFIX = ".msg"
+SPOOL_LOCK_FILE = ".lock"
+MIN_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+
+class SpoolEntry:
+    """
+    A spooled outbound message, or a batch of (destination, body, headers) messages that are sent in one
+    transaction.
+    """
+    def __init__(self, sequence, destination, headers, body, enqueued_at, batch=None):
+        self.sequence = sequence
+        self.destination = destination
+        self.headers = headers
+        self.body = body
+        self.enqueued_at = enqueued_at
+        self.batch = batch
+
+
+class ArtemisSpool:
+    """
+    Publishes messages asynchronously from a bounded in-memory queue backed by a disk spool. Every message is
+    written to the spool before enqueue returns and deleted when it has been sent, so messages survive broker
+    outages and restarts. A background publisher sends messages in order and retries the head of the queue with
+    exponential backoff until it succeeds. A running spool holds an exclusive lock on its directory, so two
+    processes never share one.
+    """
+
+    def __init__(self, send, send_batch=None):
+        self.send = send
+        self.send_batch = send_batch
+        self.directory = os.getenv('D11_MQ_SPOOL_DIRECTORY', 'data/spool')
+        self.memory_size = int(os.getenv('D11_MQ_SPOOL_MEMORY_SIZE', 1000))
+
+        self.condition = threading.Condition()
+        self.queue = deque()
+        # Set when the in-memory queue overflowed, after which new messages only go to disk until it has caught up
+        self.disk_only = False
+        self.last_loaded_sequence = -1
+        self.next_sequence = 0
+        self.depth = 0
+        self.oldest_enqueued_at = None
+        self.thread = None
+        self.lock_file = None
+        self.stopped = False
+
+        self.sent = 0
+        self.retries = 0
+
+    def _path(self, sequence):
+        return os.path.join(self.directory, f"{sequence:012d}{SPOOL_FILE_SUFFIX}")
+
+    def _spooled_sequences(self):
+        return sorted(int(file_name[:-len(SPOOL_FILE_SUFFIX)]) for file_name in os.listdir(self.directory)
+                      if file_name.endswith(SPOOL_FILE_SUFFIX))
+
+    def _read(self, sequence):
+        with open(self._path(sequence), "rb") as f:
+            header, body = f.read().split(b"\n", 1)
+        header = json.loads(header)
+
+        batch = None
+        if "batch" in header:
+            batch = []
+            offset = 0
+            for message in header["batch"]:
+                batch.append((message["destination"], body[offset:offset + message["size"]], message["headers"]))
+                offset += message["size"]
+
+        return SpoolEntry(sequence, header.get("destination"), header.get("headers"), body, header["enqueuedAt"], batch)
+
+    def _lock(self):
+        if self.lock_file is not None:
+            return
+        lock_file = open(os.path.join(self.directory, SPOOL_LOCK_FILE), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(f"MQ spool directory {self.directory} is in use by another process")
+        self.lock_file = lock_file
+
+    def _unlock(self):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+
+    def start(self):
+        """
+        Starts the publisher. Messages left in the spool by an earlier run are replayed first. Raises a
+        RuntimeError if another process is using the spool directory.
+        """
+        with self.condition:
+            if self.thread is not None:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock()
+            sequences = self._spooled_sequences()
+            self.depth = len(sequences)
+            self.next_sequence = sequences[-1] + 1 if sequences else 0
+
+            if sequences:
+                logging.info('Replaying %d spooled MQ messages', len(sequences))
+                self.oldest_enqueued_at = self._read(sequences[0]).enqueued_at
+                self.disk_only = True
+
+            self.stopped = False
+            self.thread = threading.Thread(target=self._publish, name="mq-publisher", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Waits up to timeout seconds for the spool to drain and stops the publisher. Messages that haven't been sent
+        stay in the spool for the next run.
+        """
+        self.flush(timeout)
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            thread = self.thread
+
+        if thread is not None:
+            thread.join(timeout)
+        self.thread = None
+        # A publisher that is still sending keeps the lock until the process exits
+        if thread is None or not thread.is_alive():
+            self._unlock()
+
+    def flush(self, timeout=None):
+        """
+        Waits up to timeout seconds for all spooled messages to be sent. Returns True if the spool is empty.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self.condition:
+            while self.depth > 0 and self.thread is not None:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.depth == 0
+
+    def enqueue(self, destination, body, headers):
+        """
+        Writes a message to the spool and queues it for publishing.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self._enqueue({"destination": destination, "headers": headers}, body,
+                      lambda sequence, enqueued_at: SpoolEntry(sequence, destination, headers, body, enqueued_at))
+
+    def enqueue_batch(self, messages):
+        """
+        Writes a batch of (destination, body, headers) messages to the spool as one entry and queues it for
+        publishing in one transaction.
+        """
+        if self.send_batch is None:
+            raise ValueError("This spool can't publish batches")
+
+        batch = [(destination, body.encode("utf-8") if isinstance(body, str) else body, headers)
+                 for destination, body, headers in messages]
+        header = {"batch": [{"destination": destination, "headers": headers, "size": len(body)}
+                            for destination, body, headers in batch]}
+
+        self._enqueue(header, b"".join(body for _, body, _ in batch),
+                      lambda sequence, enqueued_at: SpoolEntry(sequence, None, None, None, enqueued_at, batch))
+
+    def _enqueue(self, header, body, create_entry):
+        if self.thread is None:
+            self.start()
+
+        with self.condition:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            enqueued_at = time.time()
+
+            temp_path = self._path(sequence) + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps({**header, "enqueuedAt": enqueued_at}).encode("utf-8"))
+                f.write(b"\n")
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self._path(sequence))
+
+            self.depth += 1
+            if self.oldest_enqueued_at is None:
+                self.oldest_enqueued_at = enqueued_at
+
+            if not self.disk_only and len(self.queue) < self.memory_size:
+                self.queue.append(create_entry(sequence, enqueued_at))
+                self.last_loaded_sequence = sequence
+            else:
+                self.disk_only = True
+
+            self.condition.notify_all()
+
+    def _load_from_disk(self):
+        """
+        Loads the oldest spooled messages that aren't in memory yet. Must be called with the condition held.
+        """
+        sequences = [sequence for sequence in self._spooled_sequences() if sequence > self.last_loaded_sequence]
+
+        for sequence in sequences[:self.memory_size]:
+            self.queue.append(self._read(sequence))
+            self.last_loaded_sequence = sequence
+
+        if len(sequences) <= self.memory_size:
+            self.disk_only = False
+        if self.queue:
+            self.oldest_enqueued_at = self.queue[0].enqueued_at
+
+    def _publish(self):
+        retry_delay = MIN_RETRY_DELAY
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    if self.disk_only:
+                        self._load_from_disk()
+                    if not self.queue:
+                        self.condition.wait()
+                if self.stopped:
+                    return
+                entry = self.queue[0]
+
+            try:
+                if entry.batch is not None:
+                    self.send_batch(entry.batch)
+                else:
+                    self.send(entry.destination, entry.body, entry.headers)
+            except Exception as e:
+                self.retries += 1
+                logging.warning('Error publishing spooled message %d to %s, retrying in %ds: %s', entry.sequence,
+                                entry.destination or f"{len(entry.batch)} destinations", retry_delay, e)
+                with self.condition:
+                    self.condition.wait_for(lambda: self.stopped, retry_delay)
+                retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                continue
+
+            retry_delay = MIN_RETRY_DELAY
+            os.remove(self._path(entry.sequence))
+
+            with self.condition:
+                self.queue.popleft()
+                self.sent += 1
+                self.depth -= 1
+                if self.queue:
+                    self.oldest_enqueued_at = self.queue[0].enqueued_at
+                elif self.depth == 0:
+                    self.oldest_enqueued_at = None
+                # Otherwise the next messages are on disk and the age is updated when they are loaded
+                self.condition.notify_all()
+
+    def get_metrics(self):
+        """
+        Gets spool depth, age of the oldest message and publish counters.
+        """
+        with self.condition:
+            return {
+                "depth": self.depth,
+                "in_memory": len(self.queue),
+                "oldest_age_seconds": time.time() - self.oldest_enqueued_at if self.oldest_enqueued_at else 0.0,
+                "sent": self.sent,
+                "retries": self.retries,
+            }
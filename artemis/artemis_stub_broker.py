@@ -0,0 +1,415 @@
+import time
+import queue
+import socket
+import logging
+import itertools
+import threading
+
+from collections import deque
+
+MULTICAST = "MULTICAST"
+ANYCAST = "ANYCAST"
+
+# Headers the broker sets on MESSAGE frames itself
+BROKER_HEADERS = {"destination", "message-id", "subscription", "ack", "receipt", "transaction", "content-length"}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\r", "\\r").replace("\n", "\\n").replace(":", "\\c")
+
+
+def _unescape(value):
+    result = []
+    characters = iter(value)
+    for character in characters:
+        if character == "\\":
+            character = {"\\": "\\", "r": "\r", "n": "\n", "c": ":"}.get(next(characters, ""), "")
+        result.append(character)
+    return "".join(result)
+
+
+def encode_frame(command, headers, body=b""):
+    """
+    Encodes a STOMP frame.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    lines = [command] + [f"{_escape(key)}:{_escape(value)}" for key, value in headers.items()]
+    if body:
+        lines.append(f"content-length:{len(body)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8") + body + b"\x00"
+
+
+def read_frames(buffer):
+    """
+    Takes complete STOMP frames from the start of a bytearray. Yields (command, headers, body) and leaves any
+    incomplete frame in the buffer. Heartbeat EOLs are skipped.
+    """
+    while True:
+        while buffer[:1] in (b"\n", b"\r"):
+            del buffer[:1]
+
+        header_end = buffer.find(b"\n\n")
+        if header_end < 0:
+            return
+        lines = buffer[:header_end].decode("utf-8").replace("\r", "").split("\n")
+        command = lines[0]
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            # Repeated headers: the first one wins
+            headers.setdefault(_unescape(key), value if command in ("CONNECT", "CONNECTED") else _unescape(value))
+
+        body_start = header_end + 2
+        if "content-length" in headers:
+            body_end = body_start + int(headers["content-length"])
+            if len(buffer) < body_end + 1:
+                return
+        else:
+            body_end = buffer.find(b"\x00", body_start)
+            if body_end < 0:
+                return
+
+        body = bytes(buffer[body_start:body_end])
+        del buffer[:body_end + 1]
+        yield command, headers, body
+
+
+class StubMessage:
+    """
+    A message held by the stub broker.
+    """
+    def __init__(self, message_id, destination, headers, body):
+        self.message_id = message_id
+        self.destination = destination
+        self.headers = headers
+        self.body = body
+        self.redelivered = False
+
+
+class StubSubscription:
+    """
+    A subscription of a session to a destination.
+    """
+    def __init__(self, session, subscription_id, destination, ack_mode, prefetch):
+        self.session = session
+        self.subscription_id = subscription_id
+        self.destination = destination
+        self.ack_mode = ack_mode
+        self.prefetch = prefetch
+        self.unacked = {}
+
+    def has_capacity(self):
+        return self.ack_mode == "auto" or not self.prefetch or len(self.unacked) < self.prefetch
+
+
+class StubDestination:
+    """
+    A queue (anycast) or topic (multicast) on the stub broker.
+    """
+    def __init__(self, name, routing_type):
+        self.name = name
+        self.routing_type = routing_type
+        self.messages = deque()
+        self.subscriptions = []
+        self.next_subscription = 0
+
+
+class StubSession:
+    """
+    A client connection to the stub broker. Frames are written by a separate thread so a client that stops
+    reading never blocks the broker.
+    """
+    def __init__(self, broker, client_socket, address):
+        self.broker = broker
+        self.socket = client_socket
+        self.address = address
+        self.subscriptions = {}
+        self.transactions = {}
+        self.outbox = queue.Queue()
+        self.closed = False
+
+    def send(self, frame, delay=0.0):
+        self.outbox.put((time.monotonic() + delay, frame))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.outbox.put((0, None))
+
+    def write(self):
+        while True:
+            due, frame = self.outbox.get()
+            if frame is None:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.socket.sendall(frame)
+            except OSError:
+                break
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def read(self):
+        buffer = bytearray()
+        try:
+            while not self.closed:
+                data = self.socket.recv(65536)
+                if not data:
+                    break
+                buffer.extend(data)
+                for command, headers, body in read_frames(buffer):
+                    self.broker.handle(self, command, headers, body)
+                    if self.closed:
+                        break
+        except OSError:
+            pass
+        finally:
+            self.broker.remove_session(self)
+
+
+class ArtemisStubBroker:
+    """
+    A minimal in-memory STOMP 1.1/1.2 broker that stands in for Artemis MQ in local end-to-end tests and
+    benchmarks. It supports anycast queues (round-robin over subscribers, client-individual acks with prefetch and
+    redelivery on NACK or disconnect), multicast topics (Artemis destination-type and subscription-type
+    headers), transactions and receipts. latency (seconds) delays every message delivery.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.destinations = {}
+        self.sessions = set()
+        self.message_ids = itertools.count(1)
+        self.server_socket = None
+        self.thread = None
+        self.stopped = False
+
+        self.received = 0
+        self.delivered = 0
+        self.acked = 0
+        self.nacked = 0
+        self.redelivered = 0
+
+    def start(self):
+        """
+        Starts listening. Returns the port, which is picked by the OS if port is 0.
+        """
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen()
+        self.port = self.server_socket.getsockname()[1]
+        self.stopped = False
+        self.thread = threading.Thread(target=self._accept, name="stub-broker", daemon=True)
+        self.thread.start()
+        logging.info('STOMP stub broker listening on %s:%d', self.host, self.port)
+        return self.port
+
+    def stop(self):
+        """
+        Closes all connections and stops listening.
+        """
+        self.stopped = True
+        if self.server_socket is not None:
+            # Closing alone doesn't wake up a blocked accept on Linux
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
+        with self.lock:
+            for session in list(self.sessions):
+                session.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _accept(self):
+        while not self.stopped:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except OSError:
+                break
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = StubSession(self, client_socket, address)
+            with self.lock:
+                self.sessions.add(session)
+            threading.Thread(target=session.write, name="stub-broker-writer", daemon=True).start()
+            threading.Thread(target=session.read, name="stub-broker-reader", daemon=True).start()
+
+    def _destination(self, name, routing_type=None):
+        destination = self.destinations.get(name)
+        if destination is None:
+            destination = StubDestination(name, routing_type or ANYCAST)
+            self.destinations[name] = destination
+        return destination
+
+    def handle(self, session, command, headers, body):
+        """
+        Handles a frame from a client.
+        """
+        with self.lock:
+            transaction = headers.get("transaction")
+            if command in ("SEND", "ACK", "NACK") and transaction is not None:
+                if transaction not in session.transactions:
+                    return self._error(session, headers, f"Unknown transaction {transaction}")
+                session.transactions[transaction].append((command, headers, body))
+            elif command in ("CONNECT", "STOMP"):
+                version = "1.2" if "1.2" in headers.get("accept-version", "1.0").split(",") else "1.1"
+                session.send(encode_frame("CONNECTED", {"version": version, "heart-beat": "0,0", "server": "stub"}))
+            elif command == "SEND":
+                self._send(headers, body)
+            elif command == "SUBSCRIBE":
+                self._subscribe(session, headers)
+            elif command == "UNSUBSCRIBE":
+                subscription = session.subscriptions.pop(headers.get("id"), None)
+                if subscription is not None:
+                    self._unsubscribe(subscription)
+            elif command in ("ACK", "NACK"):
+                self._ack(session, command, headers)
+            elif command == "BEGIN":
+                session.transactions[transaction] = []
+            elif command in ("COMMIT", "ABORT"):
+                frames = session.transactions.pop(transaction, None)
+                if frames is None:
+                    return self._error(session, headers, f"Unknown transaction {transaction}")
+                if command == "COMMIT":
+                    for frame_command, frame_headers, frame_body in frames:
+                        if frame_command == "SEND":
+                            self._send(frame_headers, frame_body)
+                        else:
+                            self._ack(session, frame_command, frame_headers)
+            elif command == "DISCONNECT":
+                self._receipt(session, headers)
+                session.close()
+                return
+            else:
+                return self._error(session, headers, f"Unknown command {command}")
+
+            self._receipt(session, headers)
+
+    def _receipt(self, session, headers):
+        if "receipt" in headers:
+            session.send(encode_frame("RECEIPT", {"receipt-id": headers["receipt"]}))
+
+    def _error(self, session, headers, message):
+        error_headers = {"message": message}
+        if "receipt" in headers:
+            error_headers["receipt-id"] = headers["receipt"]
+        session.send(encode_frame("ERROR", error_headers, message))
+
+    def _send(self, headers, body):
+        routing_type = MULTICAST if headers.get("destination-type") == MULTICAST else None
+        destination = self._destination(headers["destination"], routing_type)
+        message_headers = {key: value for key, value in headers.items() if key not in BROKER_HEADERS}
+        message = StubMessage(str(next(self.message_ids)), destination.name, message_headers, body)
+        self.received += 1
+
+        if destination.routing_type == MULTICAST:
+            for subscription in destination.subscriptions:
+                self._deliver(subscription, message)
+        else:
+            destination.messages.append(message)
+            self._dispatch(destination)
+
+    def _subscribe(self, session, headers):
+        routing_type = MULTICAST if headers.get("subscription-type") == MULTICAST else None
+        destination = self._destination(headers["destination"], routing_type)
+        subscription = StubSubscription(session, headers.get("id", headers["destination"]), destination,
+                                        headers.get("ack", "auto"), int(headers.get("activemq.prefetchSize", 0)))
+        session.subscriptions[subscription.subscription_id] = subscription
+        destination.subscriptions.append(subscription)
+        self._dispatch(destination)
+
+    def _unsubscribe(self, subscription):
+        destination = subscription.destination
+        if subscription in destination.subscriptions:
+            destination.subscriptions.remove(subscription)
+        if destination.routing_type == ANYCAST:
+            # Unacked messages go back to the head of the queue for the next consumer
+            for message in reversed(list(subscription.unacked.values())):
+                message.redelivered = True
+                self.redelivered += 1
+                destination.messages.appendleft(message)
+        subscription.unacked.clear()
+        self._dispatch(destination)
+
+    def _ack(self, session, command, headers):
+        # STOMP 1.2 acks by the ack header id, 1.1 by message-id and subscription
+        message_id = headers.get("id") or headers.get("message-id")
+        subscriptions = [session.subscriptions[headers["subscription"]]] if headers.get("subscription") in session.subscriptions \
+            else list(session.subscriptions.values())
+
+        for subscription in subscriptions:
+            message = subscription.unacked.pop(message_id, None)
+            if message is None:
+                continue
+            if command == "ACK":
+                self.acked += 1
+            else:
+                self.nacked += 1
+                if subscription.destination.routing_type == ANYCAST:
+                    message.redelivered = True
+                    self.redelivered += 1
+                    subscription.destination.messages.appendleft(message)
+            self._dispatch(subscription.destination)
+            return
+
+    def _dispatch(self, destination):
+        """
+        Delivers queued messages of an anycast destination round-robin to subscriptions with capacity.
+        """
+        while destination.messages and destination.subscriptions:
+            count = len(destination.subscriptions)
+            for offset in range(count):
+                subscription = destination.subscriptions[(destination.next_subscription + offset) % count]
+                if subscription.has_capacity():
+                    destination.next_subscription = (destination.next_subscription + offset + 1) % count
+                    self._deliver(subscription, destination.messages.popleft())
+                    break
+            else:
+                return
+
+    def _deliver(self, subscription, message):
+        headers = {**message.headers, "destination": message.destination, "message-id": message.message_id,
+                   "subscription": subscription.subscription_id, "ack": message.message_id}
+        if message.redelivered:
+            headers["redelivered"] = "true"
+        if subscription.ack_mode != "auto":
+            subscription.unacked[message.message_id] = message
+        self.delivered += 1
+        subscription.session.send(encode_frame("MESSAGE", headers, message.body), self.latency)
+
+    def remove_session(self, session):
+        """
+        Removes a closed session, returning its unacked messages to their queues.
+        """
+        with self.lock:
+            self.sessions.discard(session)
+            for subscription in session.subscriptions.values():
+                self._unsubscribe(subscription)
+            session.subscriptions.clear()
+        session.close()
+
+    def get_metrics(self):
+        """
+        Gets message counters and queue depths.
+        """
+        with self.lock:
+            return {
+                "connections": len(self.sessions),
+                "received": self.received,
+                "delivered": self.delivered,
+                "acked": self.acked,
+                "nacked": self.nacked,
+                "redelivered": self.redelivered,
+                "queues": {name: len(destination.messages) for name, destination in self.destinations.items()
+                           if destination.routing_type == ANYCAST},
+            }
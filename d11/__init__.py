@@ -1,11 +1,40 @@
 # d11/__init__.py
-from .d11_api import D11Api
-from .d11_service import D11Service
-from .d11_models import ActiveMatch, TeamSquadData, TeamSquadPlayerData
-from .d11_mq_listener import D11MqListener
-from .d11_mq_sender import D11MqSender
-from .d11_mq_models import UpdateSquadMessage, UpdateMatchMessage
-from .d11_schedule import D11Schedule
-from .d11_daemon import D11Daemon
-
-__all__ = ["D11Api", "D11Service", "ActiveMatch", "TeamSquadData", "TeamSquadPlayerData", "D11MqListener", "D11MqSender", "UpdateSquadMessage", "UpdateMatchMessage", "D11Schedule", "D11Daemon"]
+import importlib
+
+# Classes are imported from their modules on first use, so using one of them, e.g. the control client, doesn't load
+# the Fotmob, Selenium and MQ stacks that the others need
+_modules = {
+    "D11Api": ".d11_api",
+    "D11Service": ".d11_service",
+    "ActiveMatch": ".d11_models",
+    "TeamSquadData": ".d11_models",
+    "TeamSquadPlayerData": ".d11_models",
+    "D11MatchWorkerPool": ".d11_match_worker_pool",
+    "D11MqListener": ".d11_mq_listener",
+    "D11MqSender": ".d11_mq_sender",
+    "UpdateSquadMessage": ".d11_mq_models",
+    "UpdateMatchMessage": ".d11_mq_models",
+    "D11Schedule": ".d11_schedule",
+    "D11Cluster": ".d11_cluster",
+    "D11MqProbe": ".d11_mq_probe",
+    "D11StateSnapshot": ".d11_state_snapshot",
+    "D11ControlServer": ".d11_control",
+    "D11ControlClient": ".d11_control",
+    "D11Daemon": ".d11_daemon",
+    "D11AsyncDaemon": ".d11_async_daemon",
+    "D11Backfill": ".d11_backfill",
+    "D11StubApi": ".d11_stub_api",
+    "D11Pipeline": ".d11_benchmark",
+    "D11Benchmark": ".d11_benchmark",
+    "D11MatchdaySimulator": ".d11_matchday",
+}
+
+__all__ = list(_modules)
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_modules[name], __name__), name)
+    globals()[name] = value
+    return value
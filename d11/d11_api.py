@@ -2,6 +2,9 @@ import os
 import requests
 import logging
 
+from archive import raw_payload_store
+from metrics import metrics_registry
+
 class D11Api:
     """
     Provides methods to interact with the D11 API.
@@ -12,7 +15,7 @@ class D11Api:
         Gets all teams.
         """
         url = os.getenv("D11_API_BASE_URL") + os.getenv("D11_API_TEAMS_ENDPOINT")
-        return self._call_api(url)
+        return self._call_api(url, "teams")
 
     def get_match(self, match_id):
         """
@@ -20,7 +23,15 @@ class D11Api:
         """
         url_template = os.getenv("D11_API_BASE_URL") + os.getenv("D11_API_MATCH_ENDPOINT")
         url = url_template.format(match_id=match_id)
-        return self._call_api(url)
+        return self._call_api(url, f"match/{match_id}")
+
+    def get_matches_by_season(self, season_id):
+        """
+        Gets all matches for a given season ID.
+        """
+        url_template = os.getenv("D11_API_BASE_URL") + os.getenv("D11_API_MATCHES_BY_SEASON_ENDPOINT")
+        url = url_template.format(season_id=season_id)
+        return self._call_api(url, f"matches/season/{season_id}")
 
     def get_player_by_premier_league_id(self, premier_league_id):
         """
@@ -28,16 +39,18 @@ class D11Api:
         """
         url_template = os.getenv("D11_API_BASE_URL") + os.getenv("D11_API_PLAYER_BY_PREMIER_LEAGUE_ID_ENDPOINT")
         url = url_template.format(premier_league_id=premier_league_id)
-        return self._call_api(url)
+        return self._call_api(url, f"player/premierLeagueId/{premier_league_id}")
     
-    def _call_api(self, url):
+    def _call_api(self, url, resource_id):
         """        
-        Makes a GET request to the D11 API and returns the JSON response.
+        Makes a GET request to the D11 API, archives the raw response and returns the JSON response.
         If an error occurs, it logs the error and returns None.
         """
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            with metrics_registry.timer("api_request_seconds", api="d11", endpoint=resource_id.split("/")[0]):
+                response = requests.get(url)
+                response.raise_for_status()
+            raw_payload_store.store("d11", resource_id, response.content)
             return response.json()
         except Exception as e:
             logging.error(f"Error fetching D11 data from {url}: {e}")
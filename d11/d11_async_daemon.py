@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import itertools
+import multiprocessing
+
+from types import SimpleNamespace
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from artemis import artemis_connection_manager, artemis_sender
+from fotmob import FotmobService
+from metrics import metrics_registry, MetricsServer, in_context
+
+from .d11_mq_listener import create_artemis_listener, get_correlation_id_header
+from .d11_match_worker_pool import PendingMatch, SEEN_MESSAGE_IDS, get_pending_state
+from .d11_schedule import D11Schedule
+from .d11_cluster import D11Cluster
+from .d11_mq_probe import D11MqProbe
+from .d11_state_snapshot import D11StateSnapshot
+from .d11_control import D11ControlServer
+
+FINISH_PRIORITY = 0
+UPDATE_PRIORITY = 1
+
+
+class D11AsyncDaemon:
+    """
+    Runs the D11 scheduler, MQ consumption, match updates and publishing as tasks on one asyncio event loop.
+    Blocking HTTP and MQ calls run on a bounded thread pool, match details are parsed in a process pool and the
+    MQ receiver thread hands messages to the loop, blocking while the maximum number of matches are pending so
+    the broker holds back further messages. Match updates are coalesced per match and finish updates run first.
+    SIGINT and SIGTERM stop intake and wait for running updates before shutting down. Control socket commands run
+    on their own threads, like with D11Daemon.
+    """
+    def __init__(self, run_command=None):
+        self.d11_cluster = D11Cluster() if os.getenv('D11_CLUSTER_ENABLED', 'false').lower() == 'true' else None
+        self.d11_mq_probe = D11MqProbe() if os.getenv('D11_MQ_PROBE_ENABLED', 'false').lower() == 'true' else None
+        self.d11_schedule = D11Schedule(self.d11_cluster)
+        self.d11_service = self.d11_schedule.d11_service
+        self.artemis_connection_manager = artemis_connection_manager
+
+        self.d11_state_snapshot = D11StateSnapshot()
+        self.d11_state_snapshot.register("scheduler", self.d11_schedule.scheduler)
+        self.d11_state_snapshot.register("match_updates", self)
+        self.d11_state_snapshot.register("fotmob_session", self.d11_service.fotmob_service.api)
+
+        self.d11_control_server = D11ControlServer(
+            lambda args, output: run_command(args, output, self.d11_service, self.d11_service.fotmob_service)
+        ) if run_command is not None else None
+
+        self.metrics_server = MetricsServer(metrics_registry, self.get_health)
+        metrics_registry.register_collector("d11", self.get_metrics)
+
+        self.workers = int(os.getenv('D11_ASYNC_WORKERS', 32))
+        self.max_pending = int(os.getenv('D11_ASYNC_MAX_PENDING', 100))
+        self.io_threads = int(os.getenv('D11_ASYNC_IO_THREADS', 16))
+        self.processes = int(os.getenv('D11_ASYNC_PROCESSES', 0)) or None
+        self.shutdown_timeout = float(os.getenv('D11_ASYNC_SHUTDOWN_TIMEOUT', 30))
+
+        self.loop = None
+        # Set on shutdown, after which the MQ receiver thread leaves new messages unacked for redelivery
+        self.stopping = False
+        self.io_executor = None
+        self.process_executor = None
+        self.stop_event = None
+        self.capacity = None
+        self.ready = None
+        self.pending = {}
+        # Match id to the update being run for it
+        self.running = {}
+        self.completed_message_ids = OrderedDict()
+        self.counter = itertools.count()
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def start(self):
+        """
+        Runs the daemon until it is interrupted.
+        """
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            pass
+        logging.info("D11 async daemon stopped")
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.io_executor = ThreadPoolExecutor(self.io_threads, thread_name_prefix="io")
+        # Forking a process with MQ, HTTP and executor threads running can deadlock the child
+        self.process_executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        self.stop_event = asyncio.Event()
+        self.capacity = asyncio.Condition()
+        self.ready = asyncio.PriorityQueue()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signal_number, self.stop_event.set)
+
+        await self.loop.run_in_executor(self.io_executor, artemis_sender.start)
+
+        self.d11_schedule.add_jobs()
+        self.d11_state_snapshot.restore()
+        tasks = [asyncio.create_task(self.d11_schedule.scheduler.run_async(self.io_executor), name="scheduler")]
+        tasks += [asyncio.create_task(self._work(), name=f"match-worker-{index}") for index in range(self.workers)]
+
+        artemis_listener = create_artemis_listener(self.on_active_match, self.d11_cluster, self.d11_mq_probe)
+        await self.loop.run_in_executor(self.io_executor, self.artemis_connection_manager.set_listener, artemis_listener)
+        if self.d11_cluster is not None:
+            self.d11_cluster.start()
+        if self.d11_mq_probe is not None:
+            self.d11_mq_probe.start()
+        self.d11_state_snapshot.start()
+        if self.d11_control_server is not None:
+            self.d11_control_server.start()
+        self.metrics_server.start()
+
+        logging.info("D11 async daemon started...")
+        await self.stop_event.wait()
+        logging.info("Stopping D11 async daemon...")
+
+        # Stop intake first. Unacked messages are redelivered by the broker to whoever consumes next
+        self.stopping = True
+        if self.d11_control_server is not None:
+            await self.loop.run_in_executor(self.io_executor, self.d11_control_server.stop)
+        if self.d11_mq_probe is not None:
+            await self.loop.run_in_executor(self.io_executor, self.d11_mq_probe.stop)
+        if self.d11_cluster is not None:
+            await self.loop.run_in_executor(self.io_executor, self.d11_cluster.stop)
+        tasks[0].cancel()
+
+        # Stay connected until the updates have finished so their messages can still be acked
+        deadline = time.monotonic() + self.shutdown_timeout
+        while (self.pending or self.running) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending or self.running:
+            logging.warning('%d match updates pending and %d running at shutdown', len(self.pending), len(self.running))
+        await self.loop.run_in_executor(self.io_executor, self.artemis_connection_manager.disconnect)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await self.loop.run_in_executor(self.io_executor, self.d11_state_snapshot.stop)
+        await self.loop.run_in_executor(self.io_executor, self.metrics_server.stop)
+        await self.loop.run_in_executor(self.io_executor, artemis_sender.stop)
+        self.io_executor.shutdown(wait=False, cancel_futures=True)
+        self.process_executor.shutdown(wait=False, cancel_futures=True)
+
+    def on_active_match(self, frame):
+        """
+        Handles an active match message on the MQ receiver thread by handing it to the event loop. Blocks while the
+        maximum number of matches are pending. Once the daemon is stopping, messages are left unacked.
+        """
+        if self.stopping:
+            return
+
+        active_match = json.loads(frame.body, object_hook=lambda d: SimpleNamespace(**d))
+        logging.info('on_active_match: match_id %s, finish: %s', active_match.matchId, active_match.finish)
+
+        generation = self.artemis_connection_manager.generation
+        if self.d11_cluster is not None and self.d11_cluster.route(frame, active_match.matchId, generation):
+            return
+
+        future = asyncio.run_coroutine_threadsafe(
+            self.submit(active_match.matchId, active_match.finish, frame.headers.get('message-id'),
+                        ack=lambda: self.artemis_connection_manager.ack(frame, generation),
+                        nack=lambda: self.artemis_connection_manager.nack(frame, generation),
+                        correlation_id=get_correlation_id_header(frame)),
+            self.loop)
+        future.result()
+
+    async def submit(self, match_id, finish, message_id=None, ack=None, nack=None, correlation_id=None):
+        """
+        Queues a match update traced with the correlation id, coalescing it with a pending update for the same
+        match. Returns False if the message is a redelivery of one that has already been handled, in which case it
+        is acked right away.
+        """
+        if message_id is not None and message_id in self.completed_message_ids:
+            self.duplicates += 1
+            if ack is not None:
+                ack()
+            return False
+
+        self.submitted += 1
+
+        async with self.capacity:
+            await self.capacity.wait_for(lambda: match_id in self.pending or len(self.pending) < self.max_pending)
+
+            pending_match = self.pending.get(match_id)
+            if pending_match is not None:
+                self.coalesced += 1
+                pending_match.coalesce(message_id, ack, nack, correlation_id)
+                if finish and not pending_match.finish:
+                    pending_match.finish = True
+                    # The earlier queue entry is skipped as stale by whichever worker gets the match first
+                    self._enqueue(match_id, finish)
+                return True
+
+            pending_match = PendingMatch(match_id, finish, time.monotonic(), correlation_id)
+            pending_match.messages.append((message_id, ack, nack))
+            self.pending[match_id] = pending_match
+            if match_id not in self.running:
+                self._enqueue(match_id, finish)
+            return True
+
+    def _enqueue(self, match_id, finish):
+        self.ready.put_nowait((FINISH_PRIORITY if finish else UPDATE_PRIORITY, next(self.counter), match_id))
+
+    async def _work(self):
+        while True:
+            _, _, match_id = await self.ready.get()
+            if match_id in self.running or match_id not in self.pending:
+                continue
+
+            pending_match = self.pending.pop(match_id)
+            self.running[match_id] = pending_match
+            async with self.capacity:
+                self.capacity.notify_all()
+
+            wait = time.monotonic() - pending_match.enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            trace = pending_match.trace
+            trace.add_span("queue_wait", trace.started_at, wait)
+
+            start = time.monotonic()
+            try:
+                with trace.activate():
+                    await self.update_match(match_id, pending_match.finish)
+                succeeded = True
+            except asyncio.CancelledError:
+                self.running.pop(match_id, None)
+                raise
+            except Exception as e:
+                logging.exception(f"Error updating match {match_id}: {e}")
+                succeeded = False
+
+            self.running.pop(match_id, None)
+            if succeeded:
+                self.completed += 1
+                for message_id, _, _ in pending_match.messages:
+                    if message_id is not None:
+                        self.completed_message_ids[message_id] = True
+                while len(self.completed_message_ids) > SEEN_MESSAGE_IDS:
+                    self.completed_message_ids.popitem(last=False)
+            else:
+                self.failed += 1
+
+            # A newer update for this match may have been queued while it was running
+            if match_id in self.pending:
+                self._enqueue(match_id, self.pending[match_id].finish)
+
+            with trace.span("ack"):
+                for _, ack, nack in pending_match.messages:
+                    callback = ack if succeeded else nack
+                    if callback is not None:
+                        try:
+                            callback()
+                        except Exception as e:
+                            logging.error(f"Error acknowledging message for match {match_id}: {e}")
+            await self.loop.run_in_executor(self.io_executor, pending_match.record_trace, succeeded)
+
+            logging.info('Match %s %s in %.2fs after waiting %.2fs (queue depth %d, correlation id %s)', match_id,
+                         'updated' if succeeded else 'failed', time.monotonic() - start, wait, len(self.pending), trace.trace_id)
+
+    async def update_match(self, match_id, finish):
+        """
+        Updates a match with D11Service.update_match on an I/O thread, in the context of the current trace, with
+        the Fotmob match details parsed in the process pool.
+        """
+        await self.loop.run_in_executor(self.io_executor, in_context(self.d11_service.update_match), match_id, finish,
+                                        self.parse_match_details)
+
+    def parse_match_details(self, match_details):
+        """
+        Parses Fotmob match details in the process pool. Called on an I/O thread, which waits for the result.
+        """
+        return self.process_executor.submit(FotmobService.parse_match_details, match_details).result()
+
+    def get_state(self):
+        """
+        Gets pending and running matches with the ids of the messages they cover, and the ids of completed messages,
+        for a state snapshot.
+        """
+        return {
+            "pending": get_pending_state(self.pending, self.running),
+            "completed_message_ids": list(self.completed_message_ids),
+        }
+
+    def restore_state(self, state):
+        """
+        Restores completed message ids and requeues the matches that were pending or running from a state snapshot
+        along with the ids of the messages they covered. Must be called on the event loop before MQ consumption
+        starts.
+        """
+        for message_id in state["completed_message_ids"]:
+            self.completed_message_ids[message_id] = True
+        for match_id, finish, message_ids in state["pending"]:
+            if match_id not in self.pending:
+                self.pending[match_id] = PendingMatch(match_id, finish, time.monotonic())
+                self.pending[match_id].restore_message_ids(message_ids)
+                self._enqueue(match_id, finish)
+        logging.info('Restored %d pending match updates', len(state["pending"]))
+
+    def get_metrics(self):
+        """
+        Gets metrics from all parts of the daemon.
+        """
+        return {
+            "match_updates": self.get_match_update_metrics(),
+            "publisher": artemis_sender.get_metrics(),
+            "scheduler": self.d11_schedule.get_metrics(),
+            "cluster": self.d11_cluster.get_metrics() if self.d11_cluster is not None else None,
+            "mq_probe": self.d11_mq_probe.get_metrics() if self.d11_mq_probe is not None else None,
+            "control": self.d11_control_server.get_metrics() if self.d11_control_server is not None else None,
+        }
+
+    def get_health(self):
+        """
+        Gets the health of the daemon, which is the MQ health as seen by the probe.
+        """
+        if self.d11_mq_probe is None:
+            return {"status": "unknown"}
+        return self.d11_mq_probe.get_health()
+
+    def get_match_update_metrics(self):
+        """
+        Gets match update queue metrics.
+        """
+        started = self.completed + self.failed + len(self.running)
+        return {
+            "queue_depth": len(self.pending),
+            "running": len(self.running),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "duplicates": self.duplicates,
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_wait_seconds": self.max_wait,
+            "average_wait_seconds": self.total_wait / started if started else 0.0,
+        }
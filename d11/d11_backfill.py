@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import logging
+import threading
+import multiprocessing
+
+from types import SimpleNamespace
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from archive import raw_payload_store
+from fotmob import FotmobService
+from metrics import in_context
+
+from .d11_service import D11Service
+
+checkpoint_file_template = os.getenv('D11_BACKFILL_CHECKPOINT_FILE', '.d11_backfill_{season_id}')
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE_LIMIT = 2.0
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that no more than a given number of calls per second are made across threads.
+    """
+    def __init__(self, calls_per_second):
+        self.interval = 1.0 / calls_per_second if calls_per_second else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until the next call is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class D11Backfill:
+    """
+    Regenerates archived match data for all matches in a season.
+    """
+    def __init__(self):
+        self.d11_service = D11Service()
+
+    def run(self, season_id, concurrency=None, rate_limit=None, processes=None, publish=False, restart=False, from_archive=False):
+        """
+        Fetches Fotmob match details for every match in a season with bounded concurrency, parses them in a process
+        pool and writes the results through the normal archive path. Progress is checkpointed after each match so an
+        interrupted run continues where it stopped. With from_archive, D11 and Fotmob data is read from the raw
+        payload archive instead of being fetched.
+        """
+        concurrency = concurrency or DEFAULT_CONCURRENCY
+        rate_limit = rate_limit or DEFAULT_RATE_LIMIT
+
+        checkpoint_file = checkpoint_file_template.format(season_id=season_id)
+        completed = set() if restart else self.read_checkpoint(checkpoint_file)
+
+        if from_archive:
+            matches = raw_payload_store.get_latest_json("d11", f"matches/season/{season_id}")
+        else:
+            matches = self.d11_service.api.get_matches_by_season(season_id)
+
+        if matches is None:
+            logging.error("Could not get matches for season %s", season_id)
+            return
+
+        match_ids = [match["id"] for match in matches if match["id"] not in completed]
+        total = len(match_ids)
+
+        logging.info("Backfilling %d matches for season %s (%d already done)", total, season_id, len(completed))
+
+        rate_limiter = RateLimiter(rate_limit)
+        progress = BackfillProgress(total)
+        failed = []
+
+        # Spawned, as the backfill also runs in the daemon through the control socket, where forking with MQ, HTTP
+        # and scheduler threads running can deadlock the child
+        parse_context = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(max_workers=concurrency) as fetch_executor, ProcessPoolExecutor(max_workers=processes, mp_context=parse_context) as parse_executor:
+            tasks = {}
+
+            for match_id in match_ids:
+                # In the caller's context, so a control client running the backfill gets the fetch logs
+                future = fetch_executor.submit(in_context(self.fetch_match), match_id, rate_limiter, from_archive)
+                tasks[future] = ("fetch", match_id, None)
+
+            pending = set(tasks)
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, match_id, match = tasks.pop(future)
+
+                    try:
+                        if stage == "fetch":
+                            match, match_details = future.result()
+                            parse_future = parse_executor.submit(FotmobService.parse_match_details, match_details)
+                            tasks[parse_future] = ("parse", match_id, match)
+                            pending.add(parse_future)
+                        else:
+                            fotmob_match = future.result()
+                            finish = fotmob_match.status == "FULL_TIME"
+                            match_data = self.d11_service.archive_match(match, fotmob_match, finish)
+
+                            if publish:
+                                self.d11_service.d11_mq_sender.send_update_match_message(match_data, finish)
+
+                            completed.add(match_id)
+                            self.write_checkpoint(checkpoint_file, season_id, completed)
+                            progress.advance()
+                    except Exception as e:
+                        logging.error("Backfill of match %s failed in %s stage: %s", match_id, stage, e)
+                        failed.append(match_id)
+                        progress.advance()
+
+        logging.info("Backfill of season %s finished: %d matches updated, %d failed in %.1fs", season_id, total - len(failed), len(failed), progress.elapsed())
+
+        if failed:
+            logging.warning("Failed match ids (run again to retry): %s", sorted(failed))
+
+    def fetch_match(self, match_id, rate_limiter, from_archive):
+        """
+        Gets a D11 match and the raw Fotmob match details for it.
+        """
+        if from_archive:
+            match_json = raw_payload_store.get_latest_json("d11", f"match/{match_id}")
+            if match_json is None:
+                raise RuntimeError(f"No archived D11 match {match_id}")
+            match = json.loads(json.dumps(match_json), object_hook=lambda dictionary: SimpleNamespace(**dictionary))
+            match_details = raw_payload_store.get_latest_json("fotmob", f"matchDetails/{match.whoscoredId}")
+        else:
+            match = self.d11_service.get_match(match_id)
+
+            rate_limiter.acquire()
+            match_details = self.d11_service.fotmob_service.api.get_match_details(match.whoscoredId)
+
+        if match_details is None:
+            raise RuntimeError(f"No Fotmob match details for {match.whoscoredId}")
+
+        return match, match_details
+
+    def read_checkpoint(self, checkpoint_file):
+        """
+        Reads the ids of already completed matches from a checkpoint file.
+        """
+        if not os.path.exists(checkpoint_file):
+            return set()
+
+        with open(checkpoint_file, "r") as f:
+            return set(json.load(f)["completed"])
+
+    def write_checkpoint(self, checkpoint_file, season_id, completed):
+        """
+        Writes the ids of completed matches to a checkpoint file. The file is replaced atomically so an interrupted
+        write can't corrupt it.
+        """
+        temp_file = checkpoint_file + ".tmp"
+
+        with open(temp_file, "w") as f:
+            json.dump({"seasonId": season_id, "completed": sorted(completed)}, f)
+
+        os.replace(temp_file, checkpoint_file)
+
+
+class BackfillProgress:
+    """
+    Keeps track of and logs backfill progress, throughput and ETA.
+    """
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.start_time = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    def advance(self):
+        """
+        Counts a processed match and logs the current progress.
+        """
+        self.count += 1
+        elapsed = self.elapsed()
+        throughput = self.count / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.count) / throughput if throughput > 0 else 0
+
+        logging.info("Backfill %d/%d (%.1f%%) - %.2f matches/s - ETA %dm%02ds",
+                     self.count, self.total, 100 * self.count / self.total, throughput, eta // 60, eta % 60)
@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import resource
+import tempfile
+import threading
+import multiprocessing
+
+import stomp
+
+from artemis import ArtemisStubBroker
+from metrics import CORRELATION_ID_HEADER
+
+from .d11_stub_api import D11StubApi
+from .d11_mq_encoding import decode
+from .d11_mq_probe import percentile
+
+
+def _peak_memory_mb():
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_pipeline(connection):
+    """
+    Child process main. Runs the daemon's MQ listener and match update workers, which are configured by the
+    environment the parent started the process with, until the parent says stop. Then sends back resource usage
+    and metrics.
+    """
+    # Imported here so they read the environment of the child, and are only loaded in the child
+    from artemis import artemis_sender
+    from metrics import metrics_registry
+    from metrics.metrics_logging import configure_logging
+    from .d11_mq_listener import D11MqListener
+
+    configure_logging()
+
+    os.chdir(os.environ["D11_PIPELINE_DIRECTORY"])
+    with open(".fotmob_cookies", "w") as f:
+        f.write("{}")
+
+    d11_mq_listener = D11MqListener()
+    # The stub Fotmob API has no session to refresh
+    d11_mq_listener.d11_service.fotmob_service.api.last_refresh = time.time()
+    artemis_sender.start()
+    d11_mq_listener.start()
+    connection.send("ready")
+
+    connection.recv()
+    d11_mq_listener.stop()
+    artemis_sender.stop()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    connection.send({
+        "cpu_user_seconds": usage.ru_utime,
+        "cpu_system_seconds": usage.ru_stime,
+        "max_rss_mb": round(_peak_memory_mb(), 1),
+        "match_updates": d11_mq_listener.get_metrics(),
+        "stages": metrics_registry.summary(),
+    })
+
+
+class D11PipelineListener(stomp.ConnectionListener):
+    """
+    Receives the UPDATE_MATCH messages the pipeline publishes.
+    """
+    def __init__(self, on_update):
+        self.on_update = on_update
+
+    def on_message(self, frame):
+        received_at = time.monotonic()
+        try:
+            update_match = decode(frame.body, frame.headers)
+        except Exception as e:
+            logging.error(f"Error decoding UPDATE_MATCH message: {e}")
+            return
+        self.on_update(frame.headers.get(CORRELATION_ID_HEADER), update_match, received_at)
+
+
+class D11Pipeline:
+    """
+    Runs the real match update path of the daemon, ArtemisListener to D11MqListener to D11Service.update_match to
+    D11MqSender, in a child process against a stub STOMP broker and stub D11 and Fotmob APIs serving payloads from
+    get_payload(source, resource id). ACTIVE_MATCH messages are published with correlation ids and the latency of
+    every UPDATE_MATCH message that comes back is measured from when the message it carries the correlation id
+    of was published. Archive writes go to a temporary directory.
+    """
+    def __init__(self, get_payload, workers=4, http_latency=0.0, http_jitter=0.0, error_rate=0.0, broker_latency=0.0, on_update=None):
+        self.workers = workers
+        self.on_update = on_update
+        self.stub_api = D11StubApi(get_payload, latency=http_latency, jitter=http_jitter, error_rate=error_rate)
+        self.stub_broker = ArtemisStubBroker("127.0.0.1", latency=broker_latency)
+        self.active_match_queue = os.getenv('D11_MQ_ACTIVE_MATCH_QUEUE', 'D11::ACTIVE_MATCH')
+        self.update_match_queue = os.getenv('D11_MQ_MATCH_DATA_QUEUE', 'D11::UPDATE_MATCH')
+
+        self.directory = None
+        self.process = None
+        self.connection = None
+        self.stomp_connection = None
+
+        self.lock = threading.Lock()
+        self.published = {}
+        self.latencies = []
+        self.updates = 0
+        self.started_at = None
+
+    def start(self):
+        """
+        Starts the stubs and the pipeline process and connects the publisher.
+        """
+        self.stub_api.start()
+        broker_port = self.stub_broker.start()
+        self.directory = tempfile.mkdtemp(prefix="d11-pipeline-")
+
+        environment = {
+            **self.stub_api.get_environment(),
+            "D11_PIPELINE_DIRECTORY": self.directory,
+            "D11_MQ_HOST": "127.0.0.1",
+            "D11_MQ_PORT": str(broker_port),
+            "D11_MQ_ACK_MODE": "client-individual",
+            "D11_MQ_PREFETCH": str(self.workers * 2),
+            "D11_MQ_ASYNC_PUBLISH": "false",
+            "D11_MQ_WORKERS": str(self.workers),
+            "ARCHIVE_RAW_DIRECTORY": os.path.join(self.directory, "raw"),
+            "ARCHIVE_STATS_DIRECTORY": os.path.join(self.directory, "stats"),
+            "ARCHIVE_MATCH_INDEX": os.path.join(self.directory, "match_index.sqlite"),
+            "ARCHIVE_MATCH_LOG_INDEX": os.path.join(self.directory, "match_log_index.sqlite"),
+            "ARCHIVE_TRACE_STORE": os.path.join(self.directory, "traces.sqlite"),
+            "D11_MQ_SPOOL_DIRECTORY": os.path.join(self.directory, "spool"),
+            # Required by the Fotmob API but not used by the stub
+            "FOTMOB_API_TOKEN_FOO": os.getenv('FOTMOB_API_TOKEN_FOO', 'stub'),
+            "LOG_LEVEL": os.getenv('D11_PIPELINE_LOG_LEVEL', 'WARNING'),
+        }
+
+        # A spawned process gets the environment at the time it is started
+        saved_environment = os.environ.copy()
+        os.environ.update(environment)
+        try:
+            context = multiprocessing.get_context("spawn")
+            self.connection, child_connection = context.Pipe()
+            self.process = context.Process(target=run_pipeline, args=(child_connection,), name="d11-pipeline", daemon=True)
+            self.process.start()
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environment)
+
+        if not self.connection.poll(60) or self.connection.recv() != "ready":
+            self.stop()
+            raise RuntimeError("Pipeline process didn't start")
+
+        self.stomp_connection = stomp.Connection([("127.0.0.1", broker_port)], auto_decode=False)
+        self.stomp_connection.set_listener("pipeline", D11PipelineListener(self._on_update))
+        self.stomp_connection.connect(wait=True)
+        self.stomp_connection.subscribe(destination=self.update_match_queue, id="pipeline", ack="auto")
+        self.started_at = time.monotonic()
+
+    def publish(self, match_id, finish=False, correlation_id=None):
+        """
+        Publishes an ACTIVE_MATCH message. Returns its correlation id.
+        """
+        correlation_id = correlation_id or uuid.uuid4().hex
+        with self.lock:
+            self.published[correlation_id] = time.monotonic()
+        self.stomp_connection.send(destination=self.active_match_queue,
+                                   body=json.dumps({"matchId": match_id, "finish": finish}),
+                                   headers={"content-type": "application/json", CORRELATION_ID_HEADER: correlation_id})
+        return correlation_id
+
+    def _on_update(self, correlation_id, update_match, received_at):
+        with self.lock:
+            self.updates += 1
+            published_at = self.published.get(correlation_id)
+            if published_at is not None:
+                self.latencies.append(received_at - published_at)
+        if self.on_update is not None:
+            self.on_update(correlation_id, update_match, received_at)
+
+    def wait_until_handled(self, count, timeout):
+        """
+        Waits until the pipeline has acked count ACTIVE_MATCH messages. Returns False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.stub_broker.get_metrics()["acked"] >= count:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def stop(self):
+        """
+        Stops the pipeline process and the stubs. Returns the resource usage and metrics of the pipeline process.
+        """
+        report = None
+        if self.process is not None:
+            if self.process.is_alive():
+                self.connection.send("stop")
+                if self.connection.poll(60):
+                    report = self.connection.recv()
+            self.process.join(10)
+            if self.process.is_alive():
+                self.process.kill()
+            self.process = None
+
+        if self.stomp_connection is not None and self.stomp_connection.is_connected():
+            self.stomp_connection.disconnect()
+        self.stub_broker.stop()
+        self.stub_api.stop()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        return report
+
+    def get_latency_metrics(self):
+        """
+        Gets end-to-end latency percentiles in milliseconds.
+        """
+        with self.lock:
+            latencies = sorted(round(latency * 1000, 1) for latency in self.latencies)
+        return {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 0.5),
+            "p90_ms": percentile(latencies, 0.9),
+            "p99_ms": percentile(latencies, 0.99),
+            "max_ms": latencies[-1] if latencies else None,
+        }
+
+
+class D11Benchmark:
+    """
+    Benchmarks the match update pipeline on payloads stored in the raw payload archive. Publishes ACTIVE_MATCH
+    messages for the stored matches round robin at a fixed rate and reports throughput, end-to-end latency and the
+    resource use of the pipeline process.
+    """
+    def __init__(self, matches=10, messages=200, rate=20.0, workers=4, http_latency=0.05, http_jitter=0.0, error_rate=0.0, broker_latency=0.0, timeout=120):
+        self.matches = matches
+        self.messages = messages
+        self.rate = rate
+        self.workers = workers
+        self.http_latency = http_latency
+        self.http_jitter = http_jitter
+        self.error_rate = error_rate
+        self.broker_latency = broker_latency
+        self.timeout = timeout
+        self.payloads = {}
+
+    def load_payloads(self):
+        """
+        Loads the latest stored D11 match and Fotmob match details payloads of the most recently fetched matches
+        that have both. Returns the D11 match ids.
+        """
+        from archive import raw_payload_store
+
+        match_ids = []
+        resource_ids = []
+        for _, resource_id, _, _, _ in reversed(raw_payload_store.list(source="d11")):
+            if resource_id.startswith("match/") and resource_id not in resource_ids:
+                resource_ids.append(resource_id)
+
+        for resource_id in resource_ids:
+            if len(match_ids) >= self.matches:
+                break
+            match = raw_payload_store.get_latest("d11", resource_id)
+            whoscored_id = json.loads(match).get("whoscoredId")
+            match_details = raw_payload_store.get_latest("fotmob", f"matchDetails/{whoscored_id}")
+            if match_details is None:
+                continue
+            self.payloads[("d11", resource_id)] = match
+            self.payloads[("fotmob", f"matchDetails/{whoscored_id}")] = match_details
+            match_ids.append(int(resource_id.split("/")[1]))
+
+        return match_ids
+
+    def run(self):
+        """
+        Runs the benchmark. Returns the report, or None if there are no stored payloads to run it on.
+        """
+        match_ids = self.load_payloads()
+        if not match_ids:
+            logging.error("No stored D11 match and Fotmob match details payloads to benchmark with")
+            return None
+        logging.info('Benchmarking %d messages for %d matches at %.1f/s', self.messages, len(match_ids), self.rate)
+
+        pipeline = D11Pipeline(lambda source, resource_id: self.payloads.get((source, resource_id)), workers=self.workers,
+                               http_latency=self.http_latency, http_jitter=self.http_jitter, error_rate=self.error_rate,
+                               broker_latency=self.broker_latency)
+        pipeline.start()
+        try:
+            start = time.monotonic()
+            for index in range(self.messages):
+                delay = start + index / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pipeline.publish(match_ids[index % len(match_ids)])
+            published_in = time.monotonic() - start
+
+            completed = pipeline.wait_until_handled(self.messages, self.timeout)
+            duration = time.monotonic() - start
+            # Give the last UPDATE_MATCH messages time to arrive
+            time.sleep(0.5)
+        finally:
+            pipeline_report = pipeline.stop()
+
+        return {
+            "completed": completed,
+            "messages": self.messages,
+            "matches": len(match_ids),
+            "updates": pipeline.updates,
+            "published_in_seconds": round(published_in, 2),
+            "duration_seconds": round(duration, 2),
+            "updates_per_second": round(pipeline.updates / duration, 2) if duration else None,
+            "latency": pipeline.get_latency_metrics(),
+            "pipeline": pipeline_report,
+            "stub_api": pipeline.stub_api.get_metrics(),
+            "broker": pipeline.stub_broker.get_metrics(),
+        }
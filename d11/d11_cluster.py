@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from artemis import artemis_connection_manager, artemis_sender
+from metrics import CORRELATION_ID_HEADER
+
+FORWARDED_HEADER = "d11-forwarded-by"
+
+
+def get_instance_id():
+    """
+    Gets the id of this daemon instance from D11_INSTANCE_ID. It has to stay the same across restarts, since the
+    instance queue is named after it.
+    """
+    instance_id = os.getenv('D11_INSTANCE_ID')
+    if not instance_id:
+        raise RuntimeError("Environment variable D11_INSTANCE_ID is required when D11_CLUSTER_ENABLED is true.")
+    return instance_id
+
+
+def rendezvous_owner(key, members):
+    """
+    Picks the member that owns a key with rendezvous (highest random weight) hashing. Only the keys of a member
+    that leaves move, and a member that joins takes an even share from every other member.
+    """
+    return max(members, key=lambda member: hashlib.blake2b(f"{member}:{key}".encode("utf-8"), digest_size=8).digest(),
+               default=None)
+
+
+class D11Cluster:
+    """
+    Lets several daemon instances share the match updates. Instances announce themselves with heartbeats on a
+    multicast topic and drop members they haven't heard from within the member timeout. Each match is owned by
+    one live instance, picked by rendezvous hashing on the match id. An instance that receives an ACTIVE_MATCH
+    message for a match it doesn't own forwards it to the owner's instance queue, so ownership follows
+    membership changes without any coordination. Forwarded messages are acked on the original queue, so when an
+    instance leaves or times out the others subscribe to its instance queue and handle what is left there until it
+    comes back. The live instance with the lowest id is the leader and runs the singleton scheduled jobs.
+    """
+    def __init__(self, artemis_connection_manager=artemis_connection_manager, artemis_sender=artemis_sender):
+        self.instance_id = get_instance_id()
+        self.topic = os.getenv('D11_CLUSTER_TOPIC', 'D11::CLUSTER')
+        self.heartbeat_interval = float(os.getenv('D11_CLUSTER_HEARTBEAT_SECONDS', 5))
+        self.member_timeout = float(os.getenv('D11_CLUSTER_MEMBER_TIMEOUT_SECONDS', 15))
+        self.active_match_queue = os.getenv('D11_MQ_ACTIVE_MATCH_QUEUE', 'D11::ACTIVE_MATCH')
+        self.instance_queue = self.get_instance_queue(self.instance_id)
+        self.artemis_connection_manager = artemis_connection_manager
+        self.artemis_sender = artemis_sender
+        self.listener = None
+        self.on_active_match = None
+
+        self.lock = threading.Lock()
+        self.members = {self.instance_id: time.monotonic()}
+        # Instance queues of members that are gone, which this instance drains
+        self.drained = set()
+        self.started_at = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        self.forwarded = 0
+
+    def get_instance_queue(self, instance_id):
+        """
+        Gets the queue an instance receives forwarded ACTIVE_MATCH messages on.
+        """
+        return f"{self.active_match_queue}.{instance_id}"
+
+    def attach(self, listener, on_active_match):
+        """
+        Sets the MQ listener that instance queues of members that are gone are added to, and the handler for the
+        messages on them.
+        """
+        self.listener = listener
+        self.on_active_match = on_active_match
+
+    def start(self):
+        """
+        Starts sending heartbeats. The listener must already be subscribed to the cluster topic.
+        """
+        self.stop_event.clear()
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._heartbeat, name="cluster-heartbeat", daemon=True)
+        self.thread.start()
+        logging.info('Cluster instance %s started', self.instance_id)
+
+    def stop(self):
+        """
+        Stops sending heartbeats and tells the other instances this one is leaving so they take over its matches
+        right away.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        try:
+            self._publish(leaving=True)
+        except Exception as e:
+            logging.warning(f"Could not announce leaving the cluster: {e}")
+
+    def _publish(self, leaving=False):
+        body = json.dumps({"instance": self.instance_id, "leaving": leaving})
+        # Sent directly rather than through the spool, a heartbeat that is late is worse than none
+        self.artemis_connection_manager.get_connection().send(destination=self.topic, body=body,
+                                                              headers={"destination-type": "MULTICAST"})
+
+    def _heartbeat(self):
+        while not self.stop_event.is_set():
+            try:
+                self._publish()
+            except Exception as e:
+                logging.warning(f"Error sending cluster heartbeat: {e}")
+            self._expire()
+            self.stop_event.wait(self.heartbeat_interval)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.lock:
+            self.members[self.instance_id] = now
+            expired = [member for member, last_seen in self.members.items() if now - last_seen > self.member_timeout]
+            for member in expired:
+                del self.members[member]
+        for member in expired:
+            logging.warning('Cluster instance %s timed out', member)
+            self._drain(member)
+
+    def _drain(self, member):
+        """
+        Subscribes to the instance queue of a member that is gone, so messages forwarded to it are not stranded.
+        The messages have been forwarded once already, so they are handled here rather than forwarded again.
+        """
+        queue = self.get_instance_queue(member)
+        if self.listener is None or queue in self.drained:
+            return
+        self.drained.add(queue)
+        self.listener.queues.append(queue)
+        self.listener.handlers[queue] = self.on_active_match
+        self.artemis_connection_manager.subscribe(queue)
+        logging.info('Draining the queue of cluster instance %s', member)
+
+    def _undrain(self, member):
+        """
+        Stops draining the instance queue of a member that is back.
+        """
+        queue = self.get_instance_queue(member)
+        if queue not in self.drained:
+            return
+        self.drained.discard(queue)
+        self.listener.queues.remove(queue)
+        # The handler stays, messages that were delivered before unsubscribing may still arrive
+        self.artemis_connection_manager.unsubscribe(queue)
+        logging.info('Stopped draining the queue of cluster instance %s', member)
+
+    def on_message(self, frame):
+        """
+        Handles a heartbeat from an instance.
+        """
+        heartbeat = json.loads(frame.body)
+        member = heartbeat["instance"]
+        if member == self.instance_id:
+            return
+
+        with self.lock:
+            known = member in self.members
+            if heartbeat.get("leaving"):
+                self.members.pop(member, None)
+            else:
+                self.members[member] = time.monotonic()
+
+        if heartbeat.get("leaving"):
+            logging.info('Cluster instance %s left', member)
+            self._drain(member)
+        elif not known:
+            logging.info('Cluster instance %s joined', member)
+            self._undrain(member)
+
+    def get_members(self):
+        """
+        Gets the ids of the live instances, sorted.
+        """
+        with self.lock:
+            return sorted(self.members)
+
+    def get_owner(self, match_id):
+        """
+        Gets the id of the instance that owns a match.
+        """
+        return rendezvous_owner(match_id, self.get_members())
+
+    def is_leader(self):
+        """
+        Tells if this instance is the leader.
+        """
+        return self.get_members()[0] == self.instance_id
+
+    def wait_until_settled(self):
+        """
+        Waits until the instance has been up for two heartbeat intervals, by which time it has heard from every
+        live instance. Until then it would take itself for the leader.
+        """
+        started_at = self.started_at if self.started_at is not None else time.monotonic()
+        remaining = started_at + 2 * self.heartbeat_interval - time.monotonic()
+        if remaining > 0:
+            self.stop_event.wait(remaining)
+
+    def run_if_leader(self, function):
+        """
+        Wraps a scheduled job so it only runs on the leader.
+        """
+        def run():
+            self.wait_until_settled()
+            if self.is_leader():
+                function()
+            else:
+                logging.debug('Not the cluster leader, skipping %s', function.__name__)
+        run.__name__ = function.__name__
+        return run
+
+    def route(self, frame, match_id, generation):
+        """
+        Forwards an ACTIVE_MATCH message to the instance that owns the match, unless that is this instance or the
+        message has already been forwarded once. Returns True if the message was forwarded, in which case it has
+        been acked and needs no further handling.
+        """
+        owner = self.get_owner(match_id)
+        if owner == self.instance_id or FORWARDED_HEADER in frame.headers:
+            return False
+
+        headers = {key: value for key, value in frame.headers.items() if key in ("content-type", "content-encoding")}
+        headers[FORWARDED_HEADER] = self.instance_id
+        # The owner traces the update with the id of the original message
+        headers[CORRELATION_ID_HEADER] = frame.headers.get(CORRELATION_ID_HEADER) or frame.headers.get('message-id')
+        self.artemis_sender.send_message(self.get_instance_queue(owner), frame.body, headers)
+        self.artemis_connection_manager.ack(frame, generation)
+        self.forwarded += 1
+        logging.debug('Match %s forwarded to cluster instance %s', match_id, owner)
+        return True
+
+    def get_metrics(self):
+        """
+        Gets the cluster view of this instance.
+        """
+        members = self.get_members()
+        return {
+            "instance": self.instance_id,
+            "leader": members[0],
+            "members": members,
+            "forwarded": self.forwarded,
+            "draining": sorted(self.drained),
+        }
@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+
+from types import SimpleNamespace
+
+from metrics import SamplingProfiler, track_threads
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def get_control_socket_path():
+    """
+    Gets the path of the daemon control socket, D11_CONTROL_SOCKET.
+    """
+    return os.getenv('D11_CONTROL_SOCKET', 'data/d11_control.sock')
+
+
+class D11ControlLogHandler(logging.Handler):
+    """
+    Streams log records emitted by the threads working on a command to a control client. thread_ids is the set
+    tracked by track_threads, which includes thread pool workers while they run tasks of the command.
+    """
+    def __init__(self, thread_ids, send):
+        super().__init__()
+        self.thread_ids = thread_ids
+        self.send = send
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record):
+        if record.thread not in self.thread_ids:
+            return
+        try:
+            self.send({"log": self.format(record)})
+        except Exception:
+            # The client went away, the command keeps running
+            pass
+
+
+class D11ControlServer:
+    """
+    Lets a running daemon run main.py commands on its warm services. Listens on a local Unix socket for one JSON
+    request line per connection, {"command": ..., "arguments": {...}}, runs the command on its own thread and
+    streams back JSON lines with the log records the command emits and the lines it outputs, ending with
+    {"exitCode": ...}. A command sent with a true profile argument is profiled.
+    """
+    def __init__(self, run_command):
+        self.path = get_control_socket_path()
+        self.run_command = run_command
+        self.server_socket = None
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.failed = 0
+        self.running = 0
+
+    def start(self):
+        """
+        Starts accepting control connections. A socket file left behind by a daemon that didn't shut down cleanly
+        is replaced. Raises a RuntimeError if another daemon is listening on the socket.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+                try:
+                    client_socket.connect(self.path)
+                except ConnectionRefusedError:
+                    # Nobody is listening, the socket is stale
+                    os.unlink(self.path)
+                else:
+                    raise RuntimeError(f"Another daemon is listening on the control socket {self.path}")
+
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.server_socket.listen()
+        self.thread = threading.Thread(target=self._accept, name="control-server", daemon=True)
+        self.thread.start()
+        logging.info('Control socket listening on %s', self.path)
+
+    def stop(self):
+        """
+        Stops accepting control connections. Commands that are running are left to finish.
+        """
+        if self.server_socket is None:
+            return
+        try:
+            self.server_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server_socket.close()
+        self.server_socket = None
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server_socket.accept()
+            except OSError:
+                # Closed by stop()
+                return
+            threading.Thread(target=self._handle, args=(connection,), name="control-command", daemon=True).start()
+
+    def _handle(self, connection):
+        with connection, connection.makefile("rwb") as stream:
+            lock = threading.Lock()
+
+            def send(message):
+                with lock:
+                    stream.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+                    stream.flush()
+
+            line = stream.readline()
+            if not line:
+                # A client checking if the daemon is available
+                return
+
+            try:
+                request = json.loads(line)
+                command = request["command"]
+                arguments = request.get("arguments", {})
+            except Exception as e:
+                logging.warning(f"Invalid control request: {e}")
+                send({"log": f"Invalid control request: {e}"})
+                send({"exitCode": 2})
+                return
+
+            with track_threads() as thread_ids:
+                handler = D11ControlLogHandler(thread_ids, send)
+                logging.getLogger().addHandler(handler)
+                with self.lock:
+                    self.commands += 1
+                    self.running += 1
+                logging.info('Running control command %s %s', command, arguments)
+                profiler = SamplingProfiler(command, thread_ids) if arguments.get("profile") else None
+                if profiler is not None:
+                    profiler.start()
+                try:
+                    exit_code = self.run_command(SimpleNamespace(command=command, **arguments),
+                                                 lambda line: send({"output": str(line)}))
+                except SystemExit as e:
+                    exit_code = e.code if isinstance(e.code, int) else 1
+                except Exception as e:
+                    logging.exception(f"Error running control command {command}: {e}")
+                    exit_code = 1
+                finally:
+                    if profiler is not None:
+                        profiler.stop()
+                    with self.lock:
+                        self.running -= 1
+                    logging.getLogger().removeHandler(handler)
+
+            if exit_code:
+                with self.lock:
+                    self.failed += 1
+            try:
+                send({"exitCode": exit_code or 0})
+            except OSError:
+                logging.debug('Control client for %s went away', command)
+
+    def get_metrics(self):
+        """
+        Gets control command counters.
+        """
+        with self.lock:
+            return {
+                "commands": self.commands,
+                "failed": self.failed,
+                "running": self.running,
+            }
+
+
+class D11ControlClient:
+    """
+    Forwards a command to a running daemon over its control socket and prints what it streams back.
+    """
+    def __init__(self):
+        self.path = get_control_socket_path()
+
+    def is_available(self):
+        """
+        Tells if there is a daemon listening on the control socket.
+        """
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+                client_socket.connect(self.path)
+            return True
+        except OSError:
+            return False
+
+    def run(self, command, arguments):
+        """
+        Runs a command on the daemon. Log records are written to stderr and output lines to stdout as they arrive.
+        Returns the exit code, or None if no daemon is listening.
+        """
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client_socket.connect(self.path)
+        except OSError:
+            client_socket.close()
+            return None
+
+        with client_socket, client_socket.makefile("rwb") as stream:
+            stream.write(json.dumps({"command": command, "arguments": arguments}).encode("utf-8") + b"\n")
+            stream.flush()
+
+            for line in stream:
+                message = json.loads(line)
+                if "log" in message:
+                    print(message["log"], file=sys.stderr, flush=True)
+                elif "output" in message:
+                    print(message["output"], flush=True)
+                elif "exitCode" in message:
+                    return message["exitCode"]
+
+        logging.error("Daemon closed the control connection before the command finished")
+        return 1
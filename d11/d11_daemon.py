@@ -1,20 +1,89 @@
+import os
+
+from artemis import artemis_sender
+from metrics import metrics_registry, MetricsServer
+
 from .d11_schedule import D11Schedule
 from .d11_mq_listener import D11MqListener
+from .d11_cluster import D11Cluster
+from .d11_mq_probe import D11MqProbe
+from .d11_state_snapshot import D11StateSnapshot
+from .d11_control import D11ControlServer
 
 class D11Daemon:
     """
-    Runs the D11 scheduler and MQ listener.
+    Runs the D11 scheduler and MQ listener. With D11_CLUSTER_ENABLED, match updates are shared with other
+    instances and singleton jobs only run on the leader. With D11_MQ_PROBE_ENABLED, MQ round-trip latency is
+    probed continuously. Given a run_command(args, output, d11_service, fotmob_service) function,
+    commands sent to the control socket are run on the daemon's services.
     """
-    def __init__(self):
-        self.d11_mq_listener = D11MqListener()
-        self.d11_schedule = D11Schedule()        
+    def __init__(self, run_command=None):
+        self.d11_cluster = D11Cluster() if os.getenv('D11_CLUSTER_ENABLED', 'false').lower() == 'true' else None
+        self.d11_mq_probe = D11MqProbe() if os.getenv('D11_MQ_PROBE_ENABLED', 'false').lower() == 'true' else None
+        self.d11_mq_listener = D11MqListener(self.d11_cluster, self.d11_mq_probe)
+        self.d11_schedule = D11Schedule(self.d11_cluster)
+
+        self.d11_state_snapshot = D11StateSnapshot()
+        self.d11_state_snapshot.register("scheduler", self.d11_schedule.scheduler)
+        self.d11_state_snapshot.register("match_updates", self.d11_mq_listener.worker_pool)
+        self.d11_state_snapshot.register("fotmob_session", self.d11_mq_listener.d11_service.fotmob_service.api)
+
+        d11_service = self.d11_mq_listener.d11_service
+        self.d11_control_server = D11ControlServer(
+            lambda args, output: run_command(args, output, d11_service, d11_service.fotmob_service)
+        ) if run_command is not None else None
+
+        self.metrics_server = MetricsServer(metrics_registry, self.get_health)
+        metrics_registry.register_collector("d11", self.get_metrics)
 
     def start(self):
         """
-        Starts the D11 scheduler and MQ listener.
+        Starts the D11 scheduler and MQ listener, restoring the state saved by the previous run.
         """
+        self.d11_schedule.add_jobs()
+        self.d11_state_snapshot.restore()
+
+        artemis_sender.start()
         self.d11_mq_listener.start()
+        if self.d11_cluster is not None:
+            self.d11_cluster.start()
+        if self.d11_mq_probe is not None:
+            self.d11_mq_probe.start()
+        self.d11_state_snapshot.start()
+        if self.d11_control_server is not None:
+            self.d11_control_server.start()
+        self.metrics_server.start()
         self.d11_schedule.start()
 
         # Scheduler will block. We'll get here when it is interrupted
+        if self.d11_control_server is not None:
+            self.d11_control_server.stop()
+        if self.d11_mq_probe is not None:
+            self.d11_mq_probe.stop()
+        if self.d11_cluster is not None:
+            self.d11_cluster.stop()
         self.d11_mq_listener.stop()
+        self.d11_state_snapshot.stop()
+        self.metrics_server.stop()
+        artemis_sender.stop()
+
+    def get_metrics(self):
+        """
+        Gets metrics from all parts of the daemon.
+        """
+        return {
+            "match_updates": self.d11_mq_listener.get_metrics(),
+            "publisher": artemis_sender.get_metrics(),
+            "scheduler": self.d11_schedule.get_metrics(),
+            "cluster": self.d11_cluster.get_metrics() if self.d11_cluster is not None else None,
+            "mq_probe": self.d11_mq_probe.get_metrics() if self.d11_mq_probe is not None else None,
+            "control": self.d11_control_server.get_metrics() if self.d11_control_server is not None else None,
+        }
+
+    def get_health(self):
+        """
+        Gets the health of the daemon, which is the MQ health as seen by the probe.
+        """
+        if self.d11_mq_probe is None:
+            return {"status": "unknown"}
+        return self.d11_mq_probe.get_health()
@@ -0,0 +1,285 @@
+import os
+import time
+import logging
+import threading
+
+from collections import deque, OrderedDict
+
+from archive import trace_store
+from metrics import Trace
+
+DEFAULT_WORKERS = int(os.getenv('D11_MQ_WORKERS', 4))
+DEFAULT_MAX_PENDING = int(os.getenv('D11_MQ_MAX_PENDING', 100))
+SEEN_MESSAGE_IDS = 1000
+
+
+class PendingMatch:
+    """
+    A match update waiting for a worker, traced with the correlation id of the message that queued it.
+    """
+    def __init__(self, match_id, finish, enqueued_at, correlation_id=None):
+        self.match_id = match_id
+        self.finish = finish
+        self.enqueued_at = enqueued_at
+        # (message id, ack, nack) for every message coalesced into this update
+        self.messages = []
+        self.trace = Trace(correlation_id, match_id, finish)
+
+    def coalesce(self, message_id, ack, nack, correlation_id):
+        """
+        Adds a message for the same match to this update.
+        """
+        self.messages.append((message_id, ack, nack))
+        if correlation_id is not None:
+            self.trace.coalesced.append(correlation_id)
+
+    def get_message_ids(self):
+        """
+        Gets the ids of the messages covered by this update.
+        """
+        return [message_id for message_id, _, _ in self.messages if message_id is not None]
+
+    def restore_message_ids(self, message_ids):
+        """
+        Adds the ids of messages covered by this update before a restart. Their redeliveries are coalesced into
+        the update while it is pending and recognized as duplicates once it has completed.
+        """
+        self.messages.extend((message_id, None, None) for message_id in message_ids)
+
+    def record_trace(self, succeeded):
+        """
+        Ends the trace of the update and stores it.
+        """
+        self.trace.finish = self.finish
+        self.trace.end("ok" if succeeded else "error")
+        try:
+            trace_store.record(self.trace)
+        except Exception as e:
+            logging.error(f"Error recording trace {self.trace.trace_id} for match {self.match_id}: {e}")
+
+
+def get_pending_state(pending, running):
+    """
+    Gets [match id, finish, message ids] for the pending and running updates of a match worker pool or the async
+    daemon. A match that is both running and pending is listed once with the message ids of both updates.
+    """
+    state = {}
+    for match_id, pending_match in [*running.items(), *pending.items()]:
+        finish, message_ids = state.get(match_id, (False, []))
+        state[match_id] = (finish or pending_match.finish, message_ids + pending_match.get_message_ids())
+    return [[match_id, finish, message_ids] for match_id, (finish, message_ids) in state.items()]
+
+
+class D11MatchWorkerPool:
+    """
+    Runs match updates on a bounded pool of worker threads. Pending updates for the same match are coalesced so
+    only the latest one runs, finish updates run before intermediate ones and a match is never updated by two
+    workers at once. Messages are acked when the update that covers them has finished and nacked if it failed.
+    """
+    def __init__(self, update_match, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.update_match = update_match
+        self.workers = workers
+        self.max_pending = max_pending
+
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.finish_queue = deque()
+        self.update_queue = deque()
+        # Match id to the update being run for it
+        self.running = {}
+        self.completed_message_ids = OrderedDict()
+        self.threads = []
+        self.stopped = False
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    def start(self):
+        """
+        Starts the worker threads.
+        """
+        self.stopped = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"match-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stops the worker threads after the updates that are currently running have finished. Pending updates are
+        dropped.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def submit(self, match_id, finish, message_id=None, ack=None, nack=None, correlation_id=None):
+        """
+        Queues a match update. ack and nack are optional callables that are called when the update has finished or
+        failed. The update is traced with the correlation id, or a new one. Returns False if the message is a
+        redelivery of one that has already been handled, in which case it is acked right away. Blocks while the
+        maximum number of matches are pending.
+        """
+        with self.condition:
+            if message_id is not None and message_id in self.completed_message_ids:
+                self.duplicates += 1
+                logging.debug('Duplicate message %s for match %s ignored', message_id, match_id)
+                if ack is not None:
+                    ack()
+                return False
+
+            self.submitted += 1
+
+            while True:
+                pending_match = self.pending.get(match_id)
+
+                if pending_match is not None:
+                    self.coalesced += 1
+                    pending_match.coalesce(message_id, ack, nack, correlation_id)
+                    if finish and not pending_match.finish:
+                        pending_match.finish = True
+                        self.update_queue.remove(match_id)
+                        self.finish_queue.append(match_id)
+                    return True
+
+                if len(self.pending) < self.max_pending or self.stopped:
+                    break
+                self.condition.wait()
+
+            pending_match = PendingMatch(match_id, finish, time.monotonic(), correlation_id)
+            pending_match.messages.append((message_id, ack, nack))
+            self.pending[match_id] = pending_match
+            (self.finish_queue if finish else self.update_queue).append(match_id)
+            self.condition.notify()
+            return True
+
+    def _next(self):
+        """
+        Takes the next pending match that isn't already being updated, preferring finish updates. Must be called
+        with the condition held.
+        """
+        for queue in (self.finish_queue, self.update_queue):
+            for match_id in queue:
+                if match_id not in self.running:
+                    queue.remove(match_id)
+                    self.running[match_id] = self.pending.pop(match_id)
+                    return self.running[match_id]
+        return None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                pending_match = self._next()
+                while pending_match is None and not self.stopped:
+                    self.condition.wait()
+                    pending_match = self._next()
+                if self.stopped:
+                    if pending_match is not None:
+                        self.running.pop(pending_match.match_id, None)
+                    return
+
+                wait = time.monotonic() - pending_match.enqueued_at
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_wait += wait
+                self.condition.notify_all()
+
+            trace = pending_match.trace
+            trace.add_span("queue_wait", trace.started_at, wait)
+
+            start = time.monotonic()
+            try:
+                with trace.activate():
+                    self.update_match(pending_match.match_id, pending_match.finish)
+                succeeded = True
+            except Exception as e:
+                logging.exception(f"Error updating match {pending_match.match_id}: {e}")
+                succeeded = False
+
+            with self.condition:
+                self.running.pop(pending_match.match_id, None)
+                if succeeded:
+                    self.completed += 1
+                    for message_id, _, _ in pending_match.messages:
+                        if message_id is not None:
+                            self.completed_message_ids[message_id] = True
+                    while len(self.completed_message_ids) > SEEN_MESSAGE_IDS:
+                        self.completed_message_ids.popitem(last=False)
+                else:
+                    self.failed += 1
+                depth = len(self.pending)
+                # A newer update for this match may have been queued while it was running
+                self.condition.notify_all()
+
+            with trace.span("ack"):
+                for _, ack, nack in pending_match.messages:
+                    callback = ack if succeeded else nack
+                    if callback is not None:
+                        try:
+                            callback()
+                        except Exception as e:
+                            logging.error(f"Error acknowledging message for match {pending_match.match_id}: {e}")
+            pending_match.record_trace(succeeded)
+
+            logging.info('Match %s %s in %.2fs after waiting %.2fs (queue depth %d, correlation id %s)', pending_match.match_id,
+                         'updated' if succeeded else 'failed', time.monotonic() - start, wait, depth, trace.trace_id)
+
+    def get_state(self):
+        """
+        Gets pending and running matches with the ids of the messages they cover, and the ids of completed messages,
+        for a state snapshot.
+        """
+        with self.condition:
+            return {
+                "pending": get_pending_state(self.pending, self.running),
+                "completed_message_ids": list(self.completed_message_ids),
+            }
+
+    def restore_state(self, state):
+        """
+        Restores completed message ids, so redelivered messages are recognized, and requeues the matches that were
+        pending or running from a state snapshot along with the ids of the messages they covered.
+        """
+        # Restored before the workers start, so only as many as fit
+        pending = state["pending"][:self.max_pending]
+        with self.condition:
+            for message_id in state["completed_message_ids"]:
+                self.completed_message_ids[message_id] = True
+            for match_id, finish, message_ids in pending:
+                if match_id in self.pending:
+                    continue
+                pending_match = PendingMatch(match_id, finish, time.monotonic())
+                pending_match.restore_message_ids(message_ids)
+                self.pending[match_id] = pending_match
+                (self.finish_queue if finish else self.update_queue).append(match_id)
+            self.condition.notify_all()
+        logging.info('Restored %d pending match updates', len(pending))
+
+    def get_metrics(self):
+        """
+        Gets queue depth, wait time and throughput counters.
+        """
+        with self.condition:
+            started = self.completed + self.failed + len(self.running)
+            return {
+                "queue_depth": len(self.pending),
+                "running": len(self.running),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "duplicates": self.duplicates,
+                "completed": self.completed,
+                "failed": self.failed,
+                "last_wait_seconds": self.last_wait,
+                "max_wait_seconds": self.max_wait,
+                "average_wait_seconds": self.total_wait / started if started else 0.0,
+            }
@@ -0,0 +1,353 @@
+import json
+import time
+import random
+import logging
+
+from datetime import datetime, timezone
+
+from .d11_benchmark import D11Pipeline
+from .d11_mq_probe import percentile
+
+HALF_TIME_MINUTES = 15
+# Per-minute probabilities that give about 2.8 goals and 3.5 cards per match
+GOAL_PROBABILITY = 2.8 / 90
+CARD_PROBABILITY = 3.5 / 90
+RED_CARD_SHARE = 0.1
+SUBSTITUTIONS = 5
+# Event kinds as they are counted in UPDATE_MATCH messages
+EVENT_KINDS = ("goal", "card", "substitution")
+
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+
+class SimulatedMatch:
+    """
+    A synthesized live match whose clock runs speed times faster than real time from a kickoff time.monotonic()
+    timestamp. Goals, cards and substitutions are drawn up front and revealed in the Fotmob matchDetails payload as
+    the clock passes them, so the time an event became visible is known exactly.
+    """
+    def __init__(self, match_id, kickoff, speed, seed=None):
+        self.match_id = match_id
+        self.fotmob_id = 900000 + match_id
+        self.kickoff = kickoff
+        self.speed = speed
+        self.kickoff_utc = datetime.now(timezone.utc)
+
+        rng = random.Random(seed)
+        self.end_minute = 90 + rng.randint(2, 7)
+        self.teams = {
+            True: {"id": 2 * match_id, "name": f"Home {match_id}"},
+            False: {"id": 2 * match_id + 1, "name": f"Away {match_id}"},
+        }
+        # Starters and substitutes per team, keyed by home
+        self.lineups = {}
+        for home in (True, False):
+            base = self.fotmob_id * 100 + (0 if home else 50)
+            self.lineups[home] = {
+                "starters": [{"id": base + index, "name": f"Player {base + index}"} for index in range(11)],
+                "subs": [{"id": base + 11 + index, "name": f"Player {base + 11 + index}"} for index in range(9)],
+            }
+
+        self.events = []
+        carded = set()
+        for minute in range(1, 91):
+            if rng.random() < GOAL_PROBABILITY:
+                home = rng.random() < 0.55
+                scorer = rng.choice(self.lineups[home]["starters"][1:])
+                self.events.append({"kind": "goal", "minute": minute, "home": home, "player": scorer})
+            if rng.random() < CARD_PROBABILITY:
+                home = rng.random() < 0.5
+                # One card per player so every card shows up as its own player in the match data
+                candidates = [player for player in self.lineups[home]["starters"] if player["id"] not in carded]
+                if candidates:
+                    player = rng.choice(candidates)
+                    carded.add(player["id"])
+                    self.events.append({"kind": "card", "minute": minute, "home": home, "player": player,
+                                        "red": rng.random() < RED_CARD_SHARE})
+        for home in (True, False):
+            minutes = sorted(rng.sample(range(46, 89), SUBSTITUTIONS))
+            players_off = rng.sample(self.lineups[home]["starters"][1:], SUBSTITUTIONS)
+            for minute, player_off, player_on in zip(minutes, players_off, self.lineups[home]["subs"]):
+                self.events.append({"kind": "substitution", "minute": minute, "home": home, "player": player_off,
+                                    "player_on": player_on})
+        self.events.sort(key=lambda event: event["minute"])
+        for event in self.events:
+            event["visible_at"] = self.get_time(event["minute"])
+
+    def get_time(self, minute):
+        """
+        Gets the time.monotonic() timestamp at which the clock reaches a played minute.
+        """
+        clock_minute = minute if minute <= 45 else minute + HALF_TIME_MINUTES
+        return self.kickoff + clock_minute * 60 / self.speed
+
+    def get_minute(self, now):
+        """
+        Gets the played minute at a time.monotonic() timestamp, None before kickoff and "HT" at half time.
+        """
+        clock_minute = (now - self.kickoff) * self.speed / 60
+        if clock_minute < 0:
+            return None
+        if clock_minute < 45:
+            return int(clock_minute) + 1
+        if clock_minute < 45 + HALF_TIME_MINUTES:
+            return "HT"
+        return min(int(clock_minute) - HALF_TIME_MINUTES + 1, self.end_minute)
+
+    def is_live(self, now):
+        return now >= self.kickoff and not self.is_finished(now)
+
+    def is_finished(self, now):
+        return now >= self.get_time(self.end_minute)
+
+    def get_match(self):
+        """
+        Gets the D11 API match.
+        """
+        return {
+            "id": self.match_id,
+            "whoscoredId": self.fotmob_id,
+            "homeTeam": {"name": self.teams[True]["name"]},
+            "awayTeam": {"name": self.teams[False]["name"]},
+            "matchWeek": {"matchWeekNumber": 1, "season": {"name": "Simulation"}},
+        }
+
+    def get_match_details(self, now):
+        """
+        Gets the Fotmob matchDetails payload with the events that have happened by a time.monotonic() timestamp.
+        """
+        minute = self.get_minute(now)
+        finished = self.is_finished(now)
+        events = [event for event in self.events if event["visible_at"] <= now]
+
+        match_facts = []
+        performances = {}
+        for event in events:
+            player_id = event["player"]["id"]
+            if event["kind"] == "goal":
+                match_facts.append({"type": "Goal", "time": event["minute"], "isHome": event["home"],
+                                    "player": event["player"], "goalDescriptionKey": None})
+                performances.setdefault(player_id, {"events": [], "substitutionEvents": []})["events"].append({"type": "goal"})
+            elif event["kind"] == "card":
+                match_facts.append({"type": "Card", "time": event["minute"], "isHome": event["home"],
+                                    "player": event["player"], "card": "Red" if event["red"] else "Yellow"})
+            else:
+                performances.setdefault(player_id, {"events": [], "substitutionEvents": []})["substitutionEvents"].append(
+                    {"type": "subOut", "time": event["minute"]})
+                performances.setdefault(event["player_on"]["id"], {"events": [], "substitutionEvents": []})["substitutionEvents"].append(
+                    {"type": "subIn", "time": event["minute"]})
+
+        def get_players(players):
+            return [{**player, "performance": performances[player["id"]]} if player["id"] in performances else player
+                    for player in players]
+
+        return {
+            "general": {
+                "matchId": self.fotmob_id,
+                "homeTeam": self.teams[True],
+                "awayTeam": self.teams[False],
+                "matchTimeUTC": self.kickoff_utc.strftime("%a, %b %d, %Y, %H:%M UTC"),
+            },
+            "header": {
+                "status": {
+                    "cancelled": False,
+                    "started": minute is not None,
+                    "finished": finished,
+                    "liveTime": {"short": "HT" if minute == "HT" else f"{minute}’"},
+                },
+            },
+            "content": {
+                "matchFacts": {"events": {"events": match_facts}},
+                "playerStats": {},
+                "lineup": {
+                    "homeTeam": {"starters": get_players(self.lineups[True]["starters"]), "subs": get_players(self.lineups[True]["subs"])},
+                    "awayTeam": {"starters": get_players(self.lineups[False]["starters"]), "subs": get_players(self.lineups[False]["subs"])},
+                },
+            },
+        }
+
+
+def count_events(match_data):
+    """
+    Counts the goals, cards and substitutions in the match data of an UPDATE_MATCH message.
+    """
+    players = match_data.get("players", [])
+    return {
+        "goal": len(match_data.get("goals", [])),
+        "card": sum(1 for player in players if player.get("yellowCardTime") or player.get("redCardTime")),
+        "substitution": sum(1 for player in players if player.get("substitutionOnTime")),
+    }
+
+
+class D11MatchdaySimulator:
+    """
+    Simulates a matchday against the match update pipeline with stub APIs and a stub broker. Matches kick off
+    spread over kickoff_spread seconds and their clocks run speed times faster than real time, while ACTIVE_MATCH
+    messages are published for every live match every interval seconds, as the D11 app does, and with finish when
+    the match ends. Since the message cadence isn't sped up, the load is that of a real matchday with the same
+    number of matches and interval.
+
+    Staleness is the time from an event becoming visible in the stub Fotmob API until the first UPDATE_MATCH
+    message that includes it, and finish latency the time from the finish message until the final UPDATE_MATCH.
+    A matchday is sustainable if the staleness p95 is within the target and match updates don't wait in the queue
+    longer than the interval.
+    """
+    def __init__(self, speed=30.0, interval=10.0, kickoff_spread=30.0, workers=4, http_latency=0.05, http_jitter=0.02,
+                 error_rate=0.0, staleness_target=None, seed=None):
+        self.speed = speed
+        self.interval = interval
+        self.kickoff_spread = kickoff_spread
+        self.workers = workers
+        self.http_latency = http_latency
+        self.http_jitter = http_jitter
+        self.error_rate = error_rate
+        self.staleness_target = staleness_target if staleness_target is not None else 2 * interval
+        self.seed = seed
+
+    def run(self, match_count):
+        """
+        Simulates a matchday with match_count matches. Returns the report.
+        """
+        rng = random.Random(self.seed)
+        start = time.monotonic() + 1
+        matches = {}
+        for match_id in range(1, match_count + 1):
+            kickoff = start + rng.uniform(0, self.kickoff_spread)
+            matches[match_id] = SimulatedMatch(match_id, kickoff, self.speed, rng.random())
+        matches_by_fotmob_id = {match.fotmob_id: match for match in matches.values()}
+
+        staleness = []
+        finish_latencies = []
+        seen = {match_id: dict.fromkeys(EVENT_KINDS, 0) for match_id in matches}
+        finish_published = {}
+
+        def get_payload(source, resource_id):
+            kind, _, identifier = resource_id.partition("/")
+            if source == "d11" and kind == "match":
+                match = matches.get(int(identifier))
+                return json.dumps(match.get_match()).encode() if match else None
+            if source == "fotmob" and kind == "matchDetails":
+                match = matches_by_fotmob_id.get(int(identifier))
+                return json.dumps(match.get_match_details(time.monotonic())).encode() if match else None
+            return None
+
+        def on_update(correlation_id, update_match, received_at):
+            match_data = update_match.get("matchData") or {}
+            match = matches.get(match_data.get("matchId"))
+            if match is None:
+                return
+            # Only the pipeline's receiver thread calls this, so no lock is needed
+            counts = count_events(match_data)
+            for kind in EVENT_KINDS:
+                events = [event for event in match.events if event["kind"] == kind]
+                for event in events[seen[match.match_id][kind]:counts[kind]]:
+                    staleness.append(received_at - event["visible_at"])
+                seen[match.match_id][kind] = max(seen[match.match_id][kind], counts[kind])
+            if update_match.get("finish") and match.match_id in finish_published:
+                finish_latencies.append(received_at - finish_published.pop(match.match_id))
+
+        logging.info('Simulating a matchday with %d matches at %.0fx speed, ACTIVE_MATCH every %.1fs',
+                     match_count, self.speed, self.interval)
+        pipeline = D11Pipeline(get_payload, workers=self.workers, http_latency=self.http_latency,
+                               http_jitter=self.http_jitter, error_rate=self.error_rate, on_update=on_update)
+        pipeline.start()
+
+        published = 0
+        finished = set()
+        max_queue_depth = 0
+        active_match_queue = pipeline.active_match_queue
+        next_trigger = {match_id: match.kickoff + rng.uniform(0, self.interval) for match_id, match in matches.items()}
+        try:
+            while len(finished) < len(matches):
+                now = time.monotonic()
+                for match_id, match in matches.items():
+                    if match_id in finished:
+                        continue
+                    if match.is_finished(now):
+                        finish_published[match_id] = time.monotonic()
+                        pipeline.publish(match_id, finish=True)
+                        finished.add(match_id)
+                        published += 1
+                    elif match.is_live(now) and now >= next_trigger[match_id]:
+                        pipeline.publish(match_id)
+                        next_trigger[match_id] += self.interval
+                        published += 1
+                max_queue_depth = max(max_queue_depth, pipeline.stub_broker.get_metrics()["queues"].get(active_match_queue, 0))
+                time.sleep(0.1)
+
+            completed = pipeline.wait_until_handled(published, max(60, 10 * self.interval))
+            duration = time.monotonic() - start
+            # Give the last UPDATE_MATCH messages time to arrive
+            time.sleep(0.5)
+        finally:
+            pipeline_report = pipeline.stop()
+
+        staleness.sort()
+        finish_latencies.sort()
+        match_updates = (pipeline_report or {}).get("match_updates", {})
+        staleness_p95 = percentile(staleness, 0.95)
+        max_wait = match_updates.get("max_wait_seconds") or 0.0
+        sustainable = completed and staleness_p95 is not None and staleness_p95 <= self.staleness_target and max_wait < self.interval
+
+        return {
+            "matches": match_count,
+            "sustainable": sustainable,
+            "completed": completed,
+            "duration_seconds": round(duration, 1),
+            "messages": published,
+            "messages_per_second": round(match_count / self.interval, 2),
+            "updates": pipeline.updates,
+            "events": sum(len(match.events) for match in matches.values()),
+            "events_seen": len(staleness),
+            "staleness_seconds": {
+                "target": self.staleness_target,
+                "p50": _round(percentile(staleness, 0.5)),
+                "p95": _round(staleness_p95),
+                "p99": _round(percentile(staleness, 0.99)),
+                "max": _round(staleness[-1] if staleness else None),
+            },
+            "finish_latency_seconds": {
+                "p50": _round(percentile(finish_latencies, 0.5)),
+                "max": _round(finish_latencies[-1] if finish_latencies else None),
+            },
+            "saturation": {
+                "max_active_match_queue_depth": max_queue_depth,
+                "max_wait_seconds": _round(max_wait),
+                "average_wait_seconds": _round(match_updates.get("average_wait_seconds")),
+                "coalesced": match_updates.get("coalesced"),
+                "failed": match_updates.get("failed"),
+                "cpu_seconds": _round((pipeline_report or {}).get("cpu_user_seconds", 0) + (pipeline_report or {}).get("cpu_system_seconds", 0)),
+                "max_rss_mb": (pipeline_report or {}).get("max_rss_mb"),
+            },
+            "latency": pipeline.get_latency_metrics(),
+            "stub_api": pipeline.stub_api.get_metrics(),
+        }
+
+    def find_capacity(self, match_count, max_match_count):
+        """
+        Simulates matchdays with match_count matches, doubling up to max_match_count, until one isn't
+        sustainable. Returns the reports with the largest sustainable match count and the one it saturated at.
+        """
+        reports = []
+        sustainable_matches = None
+        saturated_at = None
+        while True:
+            report = self.run(match_count)
+            reports.append(report)
+            logging.info('%d matches: %s (staleness p95 %ss)', match_count,
+                         "sustainable" if report["sustainable"] else "saturated", report["staleness_seconds"]["p95"])
+            if not report["sustainable"]:
+                saturated_at = match_count
+                break
+            sustainable_matches = match_count
+            if match_count >= max_match_count:
+                break
+            match_count = min(2 * match_count, max_match_count)
+
+        return {
+            "sustainable_matches": sustainable_matches,
+            "saturated_at": saturated_at,
+            "runs": reports,
+        }
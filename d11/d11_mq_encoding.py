@@ -0,0 +1,89 @@
+import json
+import gzip
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+JSON_COMPACT = "json-compact"
+JSON_GZIP = "json-gzip"
+MSGPACK = "msgpack"
+
+ENCODINGS = [JSON, JSON_COMPACT, JSON_GZIP, MSGPACK]
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+def encode(message, encoding=JSON):
+    """
+    Encodes a message dict for the MQ. Returns the body and the STOMP headers that tell consumers how to decode it.
+    json is the pretty-printed format consumers have always received, the others have to be opted in to.
+    """
+    if encoding == JSON:
+        return json.dumps(message, ensure_ascii=False, indent=2), {"content-type": JSON_CONTENT_TYPE}
+    if encoding == JSON_COMPACT:
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":")), {"content-type": JSON_CONTENT_TYPE}
+    if encoding == JSON_GZIP:
+        body = json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return gzip.compress(body, compresslevel=6), {"content-type": JSON_CONTENT_TYPE, "content-encoding": "gzip"}
+    if encoding == MSGPACK:
+        if msgpack is None:
+            raise ValueError("The msgpack encoding requires the msgpack package")
+        return msgpack.packb(message), {"content-type": MSGPACK_CONTENT_TYPE}
+    raise ValueError(f"Unknown MQ encoding: {encoding}")
+
+
+def decode(body, headers):
+    """
+    Decodes a message body using its STOMP content-type and content-encoding headers.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if headers.get("content-encoding") == "gzip":
+        body = gzip.decompress(body)
+    if headers.get("content-type") == MSGPACK_CONTENT_TYPE:
+        if msgpack is None:
+            raise ValueError("The msgpack encoding requires the msgpack package")
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def compare_encodings(messages, iterations=20):
+    """
+    Measures average encoded size and encode/decode throughput per encoding over a list of message dicts. Encodings
+    that aren't available are skipped.
+    """
+    results = []
+
+    for encoding in ENCODINGS:
+        if encoding == MSGPACK and msgpack is None:
+            continue
+
+        encoded = [encode(message, encoding) for message in messages]
+        size = sum(len(body.encode("utf-8") if isinstance(body, str) else body) for body, _ in encoded)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                encode(message, encoding)
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            for body, headers in encoded:
+                decode(body, headers)
+        decode_time = time.perf_counter() - start
+
+        count = len(messages) * iterations
+        results.append({
+            "encoding": encoding,
+            "average_bytes": size // len(messages),
+            "encode_per_second": int(count / encode_time),
+            "decode_per_second": int(count / decode_time),
+        })
+
+    return results
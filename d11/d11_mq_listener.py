@@ -4,37 +4,98 @@ import logging
 from types import SimpleNamespace
 
 from artemis import artemis_connection_manager, ArtemisListener
+from metrics import CORRELATION_ID_HEADER
 
 from .d11_service import D11Service
+from .d11_match_worker_pool import D11MatchWorkerPool
 
 active_match_queue = os.getenv('D11_MQ_ACTIVE_MATCH_QUEUE', 'D11::ACTIVE_MATCH')
 ping_queue = os.getenv('D11_PING_QUEUE', 'D11::DOWNLOAD_WHOSCORED_MATCH')
 
+def create_artemis_listener(on_active_match, d11_cluster=None, d11_mq_probe=None):
+    """
+    Creates the MQ listener for D11 messages, with the cluster topic and instance queue when running in a cluster
+    and the probe queue when probing.
+    """
+    queues = [active_match_queue, ping_queue]
+    topics = []
+    handlers = {}
+
+    if d11_cluster is not None:
+        queues.append(d11_cluster.instance_queue)
+        topics.append(d11_cluster.topic)
+        handlers[d11_cluster.topic] = d11_cluster.on_message
+        handlers[d11_cluster.instance_queue] = on_active_match
+
+    if d11_mq_probe is not None:
+        queues.append(d11_mq_probe.queue)
+        handlers[d11_mq_probe.queue] = d11_mq_probe.on_message
+
+    artemis_listener = ArtemisListener(artemis_connection_manager=artemis_connection_manager, queues=queues,
+                                       on_active_match=on_active_match, topics=topics, handlers=handlers)
+    if d11_cluster is not None:
+        d11_cluster.attach(artemis_listener, on_active_match)
+    return artemis_listener
+
+def get_correlation_id_header(frame):
+    """
+    Gets the correlation id of an ACTIVE_MATCH message, the correlation-id header if the sender set one and
+    otherwise the message id.
+    """
+    return frame.headers.get(CORRELATION_ID_HEADER) or frame.headers.get('message-id')
+
 class D11MqListener:
     """
     Implements handling of D11 messages on MQ queues.
     """
-    def __init__(self):
+    def __init__(self, d11_cluster=None, d11_mq_probe=None):
         self.d11_service = D11Service()
         self.artemis_connection_manager = artemis_connection_manager
+        self.worker_pool = D11MatchWorkerPool(self.d11_service.update_match)
+        self.d11_cluster = d11_cluster
+        self.d11_mq_probe = d11_mq_probe
+        # Set on stop, after which new messages are left unacked for the broker to redeliver
+        self.stopped = False
 
     def start(self):
         """
-        Starts the MQ listener.
+        Starts the match update workers and the MQ listener.
         """
-        artemis_listener = ArtemisListener(artemis_connection_manager=self.artemis_connection_manager, queues=[active_match_queue, ping_queue], on_active_match=self.on_active_match)
-        self.artemis_connection_manager.set_listener(artemis_listener)
+        self.worker_pool.start()
+        self.artemis_connection_manager.set_listener(create_artemis_listener(self.on_active_match, self.d11_cluster, self.d11_mq_probe))
 
     def stop(self):
         """
-        Disconnects from the MQ.
+        Stops taking new messages, waits for the running match updates to finish and ack their messages and then
+        disconnects from the MQ.
         """
+        self.stopped = True
+        self.worker_pool.stop()
         self.artemis_connection_manager.disconnect()
 
     def on_active_match(self, frame):        
         """
-        Handles an active match messages by triggering a match update.
+        Handles an active match messages by queueing a match update. This runs on the MQ receiver thread so the
+        update itself is left to the worker pool, which acks the message once the update has been published. The
+        update is traced with the correlation id of the message.
         """
+        if self.stopped:
+            return
+
         active_match = json.loads(frame.body, object_hook=lambda d: SimpleNamespace(**d))
         logging.info('on_active_match: match_id %s, finish: %s', active_match.matchId, active_match.finish)
-        self.d11_service.update_match(active_match.matchId, active_match.finish)
+
+        generation = self.artemis_connection_manager.generation
+        if self.d11_cluster is not None and self.d11_cluster.route(frame, active_match.matchId, generation):
+            return
+
+        self.worker_pool.submit(active_match.matchId, active_match.finish, frame.headers.get('message-id'),
+                                ack=lambda: self.artemis_connection_manager.ack(frame, generation),
+                                nack=lambda: self.artemis_connection_manager.nack(frame, generation),
+                                correlation_id=get_correlation_id_header(frame))
+
+    def get_metrics(self):
+        """
+        Gets match update queue metrics.
+        """
+        return self.worker_pool.get_metrics()
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import itertools
+
+from collections import deque
+
+from artemis import artemis_connection_manager
+
+OK = "ok"
+DEGRADED = "degraded"
+DOWN = "down"
+
+# Consecutive lost pings after which the broker is considered down
+DOWN_AFTER_LOST = 3
+
+
+def percentile(sorted_values, fraction):
+    """
+    Gets a nearest-rank percentile from a sorted list.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+
+class D11MqProbe:
+    """
+    Measures MQ round-trip latency by sending sequence-numbered, timestamped pings to a queue only this instance
+    consumes and timing them when they come back. Keeps round-trip percentiles over the last D11_MQ_PROBE_WINDOW
+    pings and counts pings that don't come back within D11_MQ_PROBE_TIMEOUT_SECONDS as lost. The queue is named
+    after D11_INSTANCE_ID, or the host name when it isn't set, so a restart reuses the queue of the last run.
+    """
+    def __init__(self, artemis_connection_manager=artemis_connection_manager):
+        self.interval = float(os.getenv('D11_MQ_PROBE_INTERVAL_SECONDS', 10))
+        self.timeout = float(os.getenv('D11_MQ_PROBE_TIMEOUT_SECONDS', 30))
+        self.degraded_ms = float(os.getenv('D11_MQ_PROBE_DEGRADED_MS', 1000))
+        self.instance_id = os.getenv('D11_INSTANCE_ID') or socket.gethostname()
+        self.queue = f"{os.getenv('D11_MQ_PROBE_QUEUE', 'D11::PROBE')}.{self.instance_id}"
+        self.artemis_connection_manager = artemis_connection_manager
+
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        self.outstanding = {}
+        self.round_trips = deque(maxlen=int(os.getenv('D11_MQ_PROBE_WINDOW', 100)))
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.health = OK
+
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.consecutive_lost = 0
+
+    def start(self):
+        """
+        Starts sending pings. The listener must already be subscribed to the probe queue.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="mq-probe", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops sending pings.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self._expire()
+            self._update_health()
+
+            sequence = next(self.sequence)
+            with self.lock:
+                self.outstanding[sequence] = time.monotonic()
+                self.sent += 1
+            try:
+                self._send_ping(sequence)
+            except Exception as e:
+                logging.warning(f"Error sending MQ probe ping {sequence}: {e}")
+
+            self.stop_event.wait(self.interval)
+
+    def _send_ping(self, sequence):
+        body = json.dumps({"ping": True, "sequence": sequence, "instance": self.instance_id, "sentAt": time.time()})
+        # Sent directly rather than through the spool, which would add its own delay to the round trip
+        self.artemis_connection_manager.get_connection().send(destination=self.queue, body=body)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [sequence for sequence, sent_at in self.outstanding.items() if now - sent_at > self.timeout]
+            for sequence in expired:
+                del self.outstanding[sequence]
+            self.lost += len(expired)
+            self.consecutive_lost += len(expired)
+
+    def on_message(self, frame):
+        """
+        Handles a returning ping.
+        """
+        received_at = time.monotonic()
+        self.artemis_connection_manager.ack(frame, self.artemis_connection_manager.generation)
+        sequence = json.loads(frame.body).get("sequence")
+
+        with self.lock:
+            sent_at = self.outstanding.pop(sequence, None)
+            if sent_at is None:
+                # Already counted as lost
+                self.late += 1
+                return
+            self.received += 1
+            self.consecutive_lost = 0
+            self.round_trips.append((received_at - sent_at) * 1000)
+
+    def _update_health(self):
+        health = self.get_health()["status"]
+        if health != self.health:
+            log = logging.info if health == OK else logging.warning
+            log('MQ health changed from %s to %s', self.health, health)
+            self.health = health
+
+    def get_metrics(self):
+        """
+        Gets round-trip percentiles in milliseconds, ping counters and whether the MQ is healthy, 1 if it is ok and
+        0 if it is degraded or down.
+        """
+        with self.lock:
+            round_trips = sorted(self.round_trips)
+            p90 = percentile(round_trips, 0.9)
+            return {
+                "sent": self.sent,
+                "received": self.received,
+                "lost": self.lost,
+                "late": self.late,
+                "outstanding": len(self.outstanding),
+                "loss_ratio": self.lost / (self.received + self.lost) if self.received + self.lost else 0.0,
+                "last_ms": self.round_trips[-1] if self.round_trips else None,
+                "p50_ms": percentile(round_trips, 0.5),
+                "p90_ms": p90,
+                "p99_ms": percentile(round_trips, 0.99),
+                "max_ms": round_trips[-1] if round_trips else None,
+                "healthy": int(self._get_status(p90) == OK),
+            }
+
+    def _get_status(self, p90_ms):
+        if self.consecutive_lost >= DOWN_AFTER_LOST:
+            return DOWN
+        if self.consecutive_lost > 0 or (p90_ms is not None and p90_ms > self.degraded_ms):
+            return DEGRADED
+        return OK
+
+    def get_health(self):
+        """
+        Gets the MQ health: down after several pings in a row are lost, degraded if the last ping was lost or the
+        p90 round trip is above D11_MQ_PROBE_DEGRADED_MS.
+        """
+        with self.lock:
+            p90 = percentile(sorted(self.round_trips), 0.9)
+            return {"status": self._get_status(p90), "p90_ms": p90, "consecutive_lost": self.consecutive_lost}
@@ -1,13 +1,19 @@
 from artemis import artemis_sender
+from metrics import get_correlation_id, CORRELATION_ID_HEADER
 from .d11_mq_models import UpdateMatchMessage
+from .d11_mq_encoding import encode, JSON
 import os
 
 class D11MqSender:
     """
-    Sends D11 messages to whatever MQ is being used.
+    Sends D11 messages to whatever MQ is being used. Message bodies are encoded with D11_MQ_UPDATE_SQUAD_ENCODING and
+    D11_MQ_UPDATE_MATCH_ENCODING, both defaulting to D11_MQ_ENCODING, which defaults to pretty-printed json.
     """
     def __init__(self):
         self.artemis_sender = artemis_sender
+        default_encoding = os.getenv('D11_MQ_ENCODING', JSON)
+        self.update_squad_encoding = os.getenv('D11_MQ_UPDATE_SQUAD_ENCODING', default_encoding)
+        self.update_match_encoding = os.getenv('D11_MQ_UPDATE_MATCH_ENCODING', default_encoding)
 
     def send_ping(self):
         """
@@ -21,11 +27,25 @@ class D11MqSender:
         Sends a message containing data for updating a team squad.
         """
         destination = os.getenv('D11_MQ_UPDATE_SQUAD_QUEUE', 'D11::UPDATE_SQUAD')
-        self.artemis_sender.send_message(destination=destination, body=update_squad_message.to_json())
+        body, headers = encode(update_squad_message.to_dict(), self.update_squad_encoding)
+        self.artemis_sender.send_message(destination=destination, body=body, headers=headers)
 
-    def send_update_match_message(self, match_data, finish):
+    def send_update_squad_messages(self, update_squad_messages):
         """
-        Sends a message containing data for upodating a match.
+        Sends messages containing data for updating team squads in one transaction, so either all or none of the
+        squads are updated.
+        """
+        destination = os.getenv('D11_MQ_UPDATE_SQUAD_QUEUE', 'D11::UPDATE_SQUAD')
+        messages = []
+        for update_squad_message in update_squad_messages:
+            body, headers = encode(update_squad_message.to_dict(), self.update_squad_encoding)
+            messages.append((destination, body, headers))
+        self.artemis_sender.send_batch(messages)
+
+    def send_update_match_message(self, match_data, finish, correlation_id=None):
+        """
+        Sends a message containing data for upodating a match. The message carries the correlation id, by default
+        the one of the current trace, in a header.
         """
         destination = os.getenv('D11_MQ_MATCH_DATA_QUEUE', 'D11::UPDATE_MATCH')
 
@@ -33,6 +53,10 @@ class D11MqSender:
         update_match_message.match_data = match_data
         update_match_message.finish = finish
         
-        self.artemis_sender.send_message(destination=destination, body=update_match_message.to_json())
+        body, headers = encode(update_match_message.to_dict(), self.update_match_encoding)
+        correlation_id = correlation_id or get_correlation_id()
+        if correlation_id is not None:
+            headers = {**headers, CORRELATION_ID_HEADER: correlation_id}
+        self.artemis_sender.send_message(destination=destination, body=body, headers=headers)
 
 d11_mq_sender = D11MqSender()
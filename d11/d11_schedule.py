@@ -1,23 +1,28 @@
 import os
-import time
 import logging
-import schedule
-import random
 
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 
 from d11 import D11Service
 from fotmob import FotmobService
-
-UPDATE_FOTMOB_TOKEN_TAG = "update_fotmob_token"
+from archive import raw_payload_store, trace_store
+from .d11_scheduler import D11Scheduler
 
 class D11Schedule:
     """
     Schedules periodic tasks.
     """
-    def __init__(self):
+    def __init__(self, d11_cluster=None):
         self.d11_service = D11Service()
         self.fotmob_service = FotmobService()
+        self.scheduler = D11Scheduler()
+        self.d11_cluster = d11_cluster
+
+    def singleton(self, task):
+        """
+        Makes a task run on the cluster leader only, when running in a cluster.
+        """
+        return self.d11_cluster.run_if_leader(task) if self.d11_cluster is not None else task
 
     def task_update_squads(self):
         """
@@ -38,38 +43,52 @@ class D11Schedule:
 
         self.fotmob_service.get_fotmob_api_token()
 
-        # After running, schedule the next run with jitter
-        next_run = datetime.now() + timedelta(hours=2) + timedelta(minutes=random.randint(-5, 5))
-        if next_run.hour < 9:
-            next_run = next_run.replace(hour=9, minute=random.randint(0, 30))
-        elif next_run.hour >= 24:
-            # Push to next day's 9:00
-            next_run = (next_run + timedelta(days=1)).replace(hour=9, minute=random.randint(0, 59))
-
-        schedule.clear(UPDATE_FOTMOB_TOKEN_TAG)
-        schedule.every().day.at(next_run.strftime("%H:%M")).do(self.task_update_fotmob_token).tag(UPDATE_FOTMOB_TOKEN_TAG)
-        logging.info(f"Next run scheduled for {next_run.strftime('%Y-%m-%d %H:%M')}")
-
     def task_update_fotmob_cookies(self):
         """
         Triggers a Fotmob turnstile cookie update.
         """
         self.fotmob_service.get_fotmob_turnstile_cookie()
 
-    def start(self):
+    def task_prune_raw_archive(self):
         """
-        Starts the scheduler.
+        Removes raw payloads and match update traces older than their retention periods from the archive.
         """
-        schedule.every().day.at("10:00").do(self.task_update_squads)
-        schedule.every().minute.do(self.task_update_fotmob_token).tag(UPDATE_FOTMOB_TOKEN_TAG)
-        schedule.every().hour.do(self.task_update_fotmob_cookies)
+        raw_payload_store.prune()
+        trace_store.prune()
 
+    def add_jobs(self):
+        """
+        Adds the periodic tasks to the scheduler.
+        """
+        self.scheduler.daily("update_squads", self.singleton(self.task_update_squads), time(10, 0))
+        # Every two hours give or take five minutes between 09:00 and midnight, starting right away
+        self.scheduler.every("update_fotmob_token", self.singleton(self.task_update_fotmob_token), timedelta(hours=2),
+                             jitter=timedelta(minutes=5), window=(time(9, 0), None), window_jitter=timedelta(minutes=30),
+                             first_run=datetime.now())
+        self.scheduler.every("update_fotmob_cookies", self.singleton(self.task_update_fotmob_cookies), timedelta(hours=1))
+        self.scheduler.daily("prune_raw_archive", self.task_prune_raw_archive, time(4, 0))
 
+    def start(self):
+        """
+        Starts the scheduler, adding the periodic tasks unless that has already been done. Blocks until interrupted.
+        """
+        if not self.scheduler.jobs:
+            self.add_jobs()
         logging.info("D11 schedule started...")
 
         try:
-            while True:
-                schedule.run_pending()
-                time.sleep(1)
+            self.scheduler.run()
         except KeyboardInterrupt:
             logging.info("D11 schedule stopped")
+
+    def stop(self):
+        """
+        Stops the scheduler.
+        """
+        self.scheduler.stop()
+
+    def get_metrics(self):
+        """
+        Gets scheduler job metrics.
+        """
+        return self.scheduler.get_metrics()
@@ -0,0 +1,323 @@
+import os
+import heapq
+import asyncio
+import random
+import logging
+import itertools
+import threading
+
+from datetime import datetime, timedelta
+
+from metrics import metrics_registry, SamplingProfiler, track_threads
+
+# Upper limit for a single sleep so wall clock changes (DST, NTP corrections) are picked up
+MAX_SLEEP_SECONDS = 300
+
+
+class ScheduledJob:
+    """
+    A job in the scheduler. One-shot jobs have neither interval nor daily time, interval jobs run every interval with
+    optional jitter and daily jobs run at a time of day. A window (start time, end time or None for midnight) limits
+    the times of day the job may run at.
+    """
+    def __init__(self, name, function, next_run, interval=None, at=None, jitter=None, window=None, window_jitter=None):
+        self.name = name
+        self.function = function
+        self.next_run = next_run
+        self.interval = interval
+        self.at = at
+        self.jitter = jitter
+        self.window = window
+        self.window_jitter = window_jitter if window_jitter is not None else jitter
+        self.running = False
+        self.cancelled = False
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_run = None
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+
+    def get_next_run(self, due, now):
+        """
+        Gets the next run after a run that was due at due, or None if the job doesn't repeat.
+        """
+        if self.at is not None:
+            next_run = datetime.combine(due.date() + timedelta(days=1), self.at)
+            while next_run <= now:
+                next_run += timedelta(days=1)
+        elif self.interval is not None:
+            next_run = due + self.interval
+            if next_run <= now:
+                next_run = now + self.interval
+            next_run = self._jittered(next_run, self.jitter)
+        else:
+            return None
+
+        return self.apply_window(next_run)
+
+    def apply_window(self, next_run):
+        """
+        Moves a run time that is outside the window to the start of the next window.
+        """
+        if self.window is None:
+            return next_run
+
+        start, end = self.window
+        if next_run.time() < start:
+            window_start = datetime.combine(next_run.date(), start)
+        elif end is not None and next_run.time() >= end:
+            window_start = datetime.combine(next_run.date() + timedelta(days=1), start)
+        else:
+            return next_run
+
+        if self.window_jitter:
+            window_start += timedelta(seconds=random.uniform(0, self.window_jitter.total_seconds()))
+        return window_start
+
+    def _jittered(self, next_run, jitter):
+        if not jitter:
+            return next_run
+        return next_run + timedelta(seconds=random.uniform(-jitter.total_seconds(), jitter.total_seconds()))
+
+
+class D11Scheduler:
+    """
+    Runs jobs at precise times. Jobs are kept in a heap ordered by next run time and the scheduler sleeps until the
+    next job is due instead of polling. Every job runs on its own thread and a job that is still running when it is
+    due again is skipped, so a slow job neither delays other jobs nor overlaps itself. Lateness and run duration are
+    recorded per job, and runs of the jobs listed in D11_PROFILE_JOBS are profiled.
+    """
+    def __init__(self):
+        self.profile_jobs = {name.strip() for name in os.getenv('D11_PROFILE_JOBS', '').split(',') if name.strip()}
+        self.condition = threading.Condition()
+        self.heap = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.stopped = False
+        # Wakes run_async when jobs change, the asyncio counterpart of notifying the condition
+        self.wake_async = None
+
+    def _add(self, job):
+        with self.condition:
+            if job.name in self.jobs:
+                self.jobs[job.name].cancelled = True
+            self.jobs[job.name] = job
+            heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+            self._notify()
+        logging.info('Job %s scheduled for %s', job.name, job.next_run.strftime('%Y-%m-%d %H:%M:%S'))
+        return job
+
+    def once(self, name, function, at):
+        """
+        Schedules a job to run once at a datetime. Replaces any job with the same name.
+        """
+        return self._add(ScheduledJob(name, function, at))
+
+    def every(self, name, function, interval, jitter=None, window=None, window_jitter=None, first_run=None):
+        """
+        Schedules a job to run every interval, randomly moved up to jitter either way. The first run is after one
+        interval unless first_run is given. Runs are kept within window, with up to window_jitter added to the
+        window start. Replaces any job with the same name.
+        """
+        job = ScheduledJob(name, function, None, interval=interval, jitter=jitter, window=window, window_jitter=window_jitter)
+        job.next_run = job.apply_window(first_run if first_run is not None else job._jittered(datetime.now() + interval, jitter))
+        return self._add(job)
+
+    def daily(self, name, function, at):
+        """
+        Schedules a job to run every day at a time of day. Replaces any job with the same name.
+        """
+        now = datetime.now()
+        next_run = datetime.combine(now.date(), at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return self._add(ScheduledJob(name, function, next_run, at=at))
+
+    def cancel(self, name):
+        """
+        Cancels a job.
+        """
+        with self.condition:
+            job = self.jobs.pop(name, None)
+            if job is not None:
+                job.cancelled = True
+            self._notify()
+
+    def _notify(self):
+        """
+        Wakes the scheduler to recompute its sleep. Must be called with the condition held.
+        """
+        self.condition.notify_all()
+        if self.wake_async is not None:
+            self.wake_async()
+
+    def _pop_due(self):
+        """
+        Takes the jobs that are due and schedules their next runs. Returns the (job, due) runs to start and the
+        number of seconds to sleep until the next job is due. Must be called with the condition held.
+        """
+        runs = []
+        now = datetime.now()
+
+        while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] <= now):
+            due, _, job = heapq.heappop(self.heap)
+            if job.cancelled:
+                continue
+
+            if job.running:
+                job.skipped += 1
+                metrics_registry.increment("scheduler_job_skipped_total", job=job.name)
+                logging.warning('Job %s is still running, skipping run due at %s', job.name, due.strftime('%H:%M:%S'))
+            else:
+                job.running = True
+                runs.append((job, due))
+
+            job.next_run = job.get_next_run(due, now)
+            if job.next_run is not None:
+                heapq.heappush(self.heap, (job.next_run, next(self.counter), job))
+                logging.debug('Next run of job %s scheduled for %s', job.name, job.next_run.strftime('%Y-%m-%d %H:%M:%S'))
+            elif self.jobs.get(job.name) is job:
+                del self.jobs[job.name]
+
+        timeout = (self.heap[0][0] - now).total_seconds() if self.heap else MAX_SLEEP_SECONDS
+        return runs, min(timeout, MAX_SLEEP_SECONDS)
+
+    def run(self):
+        """
+        Runs due jobs until the scheduler is stopped. Returns right away if it was stopped before run was called.
+        """
+        with self.condition:
+            while not self.stopped:
+                runs, timeout = self._pop_due()
+                for job, due in runs:
+                    threading.Thread(target=self._run_job, args=(job, due), name=f"job-{job.name}", daemon=True).start()
+                if not runs:
+                    self.condition.wait(timeout)
+
+    async def run_async(self, executor=None):
+        """
+        Runs due jobs on an executor from an asyncio event loop until the task is cancelled. Adding or cancelling
+        a job wakes it, like with run.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        with self.condition:
+            # Jobs are added from other threads too
+            self.wake_async = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+        try:
+            while True:
+                wakeup.clear()
+                with self.condition:
+                    runs, timeout = self._pop_due()
+                for job, due in runs:
+                    loop.run_in_executor(executor, self._run_job, job, due)
+                if not runs:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self.condition:
+                self.wake_async = None
+
+    def _run_job(self, job, due):
+        start = datetime.now()
+        lateness = (start - due).total_seconds()
+
+        # Thread pool workers running tasks of the job are profiled along with it
+        with track_threads() as thread_ids:
+            profiler = SamplingProfiler(job.name, thread_ids) if self.is_profiled(job) else None
+            if profiler is not None:
+                profiler.start()
+
+            try:
+                job.function()
+                failed = False
+            except Exception as e:
+                logging.exception("Error running job %s: %s", job.name, e)
+                failed = True
+
+            if profiler is not None:
+                try:
+                    profiler.stop()
+                except Exception as e:
+                    logging.error("Error writing profile of job %s: %s", job.name, e)
+
+        duration = (datetime.now() - start).total_seconds()
+        metrics_registry.observe("scheduler_lag_seconds", max(lateness, 0.0), job=job.name)
+        metrics_registry.observe("scheduler_job_seconds", duration, job=job.name)
+        if failed:
+            metrics_registry.increment("scheduler_job_failures_total", job=job.name)
+
+        with self.condition:
+            job.running = False
+            job.runs += 1
+            job.failures += failed
+            job.last_run = start
+            job.last_lateness = lateness
+            job.max_lateness = max(job.max_lateness, lateness)
+            job.last_duration = duration
+            job.max_duration = max(job.max_duration, duration)
+
+        logging.info('Job %s %s in %.2fs (%.3fs late)', job.name, 'failed' if failed else 'ran', duration, lateness)
+
+    def is_profiled(self, job):
+        """
+        Tells if runs of a job are profiled, which they are when D11_PROFILE_JOBS lists the job name or is *.
+        """
+        return job.name in self.profile_jobs or "*" in self.profile_jobs
+
+    def stop(self):
+        """
+        Stops the scheduler. Jobs that are running are left to finish.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def get_state(self):
+        """
+        Gets the next run time of every job for a state snapshot.
+        """
+        with self.condition:
+            return {name: job.next_run.isoformat() for name, job in self.jobs.items() if job.next_run is not None}
+
+    def restore_state(self, state):
+        """
+        Restores next run times of jobs that have been added from a state snapshot. Runs that were due while the
+        daemon was down are run right away.
+        """
+        now = datetime.now()
+        with self.condition:
+            for name, next_run in state.items():
+                job = self.jobs.get(name)
+                if job is not None:
+                    job.next_run = max(datetime.fromisoformat(next_run), now)
+                    logging.info('Job %s restored to run at %s', name, job.next_run.strftime('%Y-%m-%d %H:%M:%S'))
+            self.heap = [(job.next_run, next(self.counter), job) for job in self.jobs.values() if job.next_run is not None]
+            heapq.heapify(self.heap)
+            self._notify()
+
+    def get_metrics(self):
+        """
+        Gets next run, run counts, lateness and duration per job.
+        """
+        with self.condition:
+            return {
+                name: {
+                    "next_run": job.next_run.isoformat() if job.next_run else None,
+                    "running": job.running,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "skipped": job.skipped,
+                    "last_lateness_seconds": job.last_lateness,
+                    "max_lateness_seconds": job.max_lateness,
+                    "last_duration_seconds": job.last_duration,
+                    "max_duration_seconds": job.max_duration,
+                } for name, job in self.jobs.items()
+            }
@@ -6,6 +6,8 @@ import logging
 import random
 
 from types import SimpleNamespace
+from archive import match_log, match_index, season_stats_store
+from metrics import metrics_registry, span
 from fotmob import FotmobService
 from premier_league import PremierLeagueService
 
@@ -46,11 +48,13 @@ class D11Service:
     def update_squads(self, competition_id, season):
         """
         Downloads squad data from the Premier League API for a competition and season and sends update squad data messages to the D11 MQ.
+        The messages are sent in one transaction once all squads have been downloaded.
         """
         teams = self.premier_league_service.get_teams(competition_id, season)
+        update_squad_messages = []
 
         for team in teams:
-            logging.info(f"Updating team squad for {team.name} ({team.stat_source_id})")
+            logging.info('Updating team squad for %s (%s)', team.name, team.stat_source_id)
 
             team_squad_data = TeamSquadData()
             team_squad_data.id = team.stat_source_id
@@ -84,20 +88,48 @@ class D11Service:
             with open(full_path, "w", encoding="utf-8") as f:
                 json.dump(update_squad_message.to_dict(), f, ensure_ascii=False, indent=2)
 
-            self.d11_mq_sender.send_update_squad_message(update_squad_message)
-            logging.info(f"Team squad data for {team.name} sent to MQ")
+            update_squad_messages.append(update_squad_message)
 
+        self.d11_mq_sender.send_update_squad_messages(update_squad_messages)
+        logging.info('Team squad data for %d teams sent to MQ', len(update_squad_messages))
 
-    def update_match(self, match_id, finish):
+
+    def update_match(self, match_id, finish, parse_match_details=None):
         """
         Downloads match data from the stat source, saves the json to a file and sends an update match message to the D11 MQ.
+        Each stage is timed as a span of the current trace, if there is one. parse_match_details replaces
+        FotmobService.parse_match_details for the parse stage, e.g. to parse in another process.
+        """
+        logging.info('Updating match %s (finish: %s)', match_id, finish)
+        parse_match_details = parse_match_details or self.fotmob_service.parse_match_details
+
+        with metrics_registry.timer("update_match_seconds", stage="total"):
+            with metrics_registry.timer("update_match_seconds", stage="d11_match"), span("d11_match"):
+                match = self.get_match(match_id)
+            with metrics_registry.timer("update_match_seconds", stage="fotmob_match_details"), span("fotmob_match_details"):
+                match_details = self.fotmob_service.api.get_match_details(match.whoscoredId)
+            if match_details is None:
+                raise RuntimeError(f"No Fotmob match details for {match.whoscoredId}")
+            with metrics_registry.timer("update_match_seconds", stage="parse"), span("parse"):
+                fotmob_match = parse_match_details(match_details)
+            with metrics_registry.timer("update_match_seconds", stage="archive"), span("archive"):
+                match_data = self.archive_match(match, fotmob_match, finish)
+            with metrics_registry.timer("update_match_seconds", stage="publish"), span("publish"):
+                self.d11_mq_sender.send_update_match_message(match_data, finish)
+        logging.info('Match data for %s sent to MQ', match_id)
+
+    def get_match(self, match_id):
+        """
+        Gets a match from the D11 API.
         """
-        logging.info(f"Updating match {match_id} (finish: {finish})")
-
         match_json = self.api.get_match(match_id)
-        match = json.loads(json.dumps(match_json), object_hook=lambda dictionary: SimpleNamespace(**dictionary))
-        
-        fotmob_match = self.fotmob_service.get_match(match.whoscoredId)
+        return json.loads(json.dumps(match_json), object_hook=lambda dictionary: SimpleNamespace(**dictionary))
+
+    def archive_match(self, match, fotmob_match, finish):
+        """
+        Appends Fotmob match data for a D11 match to the match log in the match data directory, updates the season
+        statistics and the match index and returns the match data.
+        """
         fotmob_match.match_id = match.id
         fotmob_match_json = fotmob_match.to_json(ensure_ascii=False)
 
@@ -108,18 +140,17 @@ class D11Service:
             match_week_number=f"{match.matchWeek.matchWeekNumber:02}"
         )
 
-        file_name = f"{match.homeTeam.name} vs {match.awayTeam.name} ({fotmob_match.elapsed.replace('/', '')}).json"
+        file_name = f"{match.homeTeam.name} vs {match.awayTeam.name}.log"
         full_path = os.path.join(directory, file_name)
 
-        os.makedirs(directory, exist_ok=True)
-        with open(full_path, "w", encoding="utf-8") as f:
-            json.dump({
-                "matchData": match_data,
-                "finish": finish
-        }, f, ensure_ascii=False, indent=2)
-        
-        self.d11_mq_sender.send_update_match_message(match_data, finish)
-        logging.info(f"Match data for {match_id} sent to MQ")
+        match_log.append(match.id, full_path, fotmob_match.elapsed, {
+            "matchData": match_data,
+            "finish": finish
+        })
+        season_stats_store.update(match.matchWeek.season.name, match.matchWeek.matchWeekNumber, match_data)
+        match_index.update(match.matchWeek.season.name, match.matchWeek.matchWeekNumber, full_path, match_data)
+
+        return match_data
 
 
     def update_player_photos(self, photo_directory, competition_id, season):
@@ -144,7 +175,7 @@ class D11Service:
         os.makedirs(unknown_directory)        
 
         for team in self.premier_league_service.get_teams(competition_id, season):
-            logging.info(f"{team.name}")
+            logging.info('%s', team.name)
 
             players = self.premier_league_service.get_players(competition_id, season, team.stat_source_id)
 
@@ -159,7 +190,7 @@ class D11Service:
 
                 if image is None:
                     # No photo was found on PremierLeague.com
-                    logging.info(f"    {player.name.display}: Photo not found")
+                    logging.info('    %s: Photo not found', player.name.display)
                 else:
                     # Download the file to the temp directory and name it with the Premier League player id
                     temp_file_name = photo_file_name_format.format(id = player.id)
@@ -172,7 +203,7 @@ class D11Service:
 
                     if d11_player_json is None:
                         # No player with the Premier League id was found in the D11 API
-                        logging.info(f"    {player.name.display}: Unknown")
+                        logging.info('    %s: Unknown', player.name.display)
                         os.rename(temp_directory + "/" + temp_file_name,
                                   unknown_directory + "/" + temp_file_name)
                     else:
@@ -190,19 +221,19 @@ class D11Service:
                             if temp_md5 == existing_md5:
                                 # The new photo is the same as the already existing photo. Delete the temp file
                                 os.remove(temp_directory + "/" + temp_file_name)
-                                logging.info(f"    {d11_player.name}: Delete")
+                                logging.info('    %s: Delete', d11_player.name)
                             else:
                                 # The new photo is not the same as the already existing photo.
                                 # Move the file to the updated directory
                                 os.rename(temp_directory + "/" + temp_file_name,
                                           updated_directory + "/" + file_name)
-                                logging.info(f"    {d11_player.name}: Update")
+                                logging.info('    %s: Update', d11_player.name)
                         else:
                             # A photo of the player does not already exist in the D11 application.
                             # Move the file to the new directory
                             os.rename(temp_directory + "/" + temp_file_name,
                                       new_directory + "/" + file_name)
-                            logging.info(f"    {d11_player.name}: New")
+                            logging.info('    %s: New', d11_player.name)
 
 
     def generate_d11_fixtures(self):
@@ -293,4 +324,4 @@ class D11Service:
         with open('d11_fixtures.sql', 'w') as file:
             file.write(output)
 
-        logging.info(f'Generated {matchCount} D11 matches')
\ No newline at end of file
+        logging.info('Generated %d D11 matches', matchCount)
\ No newline at end of file
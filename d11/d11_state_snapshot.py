@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import logging
+import threading
+
+
+class D11StateSnapshot:
+    """
+    Saves the runtime state of daemon components to a local file periodically and on shutdown, and restores it on
+    start so a restarted daemon picks up where the previous one stopped. Components are registered by name and
+    provide get_state() returning something json serializable and restore_state(state). Snapshots older than
+    D11_STATE_SNAPSHOT_MAX_AGE_SECONDS are ignored.
+    """
+    def __init__(self):
+        self.path = os.getenv('D11_STATE_SNAPSHOT_FILE', 'data/d11_state.json')
+        self.interval = float(os.getenv('D11_STATE_SNAPSHOT_INTERVAL_SECONDS', 60))
+        self.max_age = float(os.getenv('D11_STATE_SNAPSHOT_MAX_AGE_SECONDS', 3600))
+        self.components = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, component):
+        """
+        Registers a component to include in snapshots.
+        """
+        self.components[name] = component
+
+    def save(self):
+        """
+        Writes a snapshot of all components. The file is replaced atomically so a crash never leaves a partial
+        snapshot.
+        """
+        snapshot = {"savedAt": time.time(), "components": {}}
+        for name, component in self.components.items():
+            try:
+                snapshot["components"][name] = component.get_state()
+            except Exception as e:
+                logging.error(f"Error getting {name} state for snapshot: {e}")
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        logging.debug('State snapshot saved to %s', self.path)
+
+    def restore(self):
+        """
+        Restores all components from the snapshot, if there is a recent enough one. Returns True if a snapshot was
+        restored.
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logging.error(f"Error reading state snapshot {self.path}: {e}")
+            return False
+
+        age = time.time() - snapshot["savedAt"]
+        if age > self.max_age:
+            logging.info('Ignoring state snapshot from %.0fs ago', age)
+            return False
+
+        for name, state in snapshot["components"].items():
+            component = self.components.get(name)
+            if component is None:
+                continue
+            try:
+                component.restore_state(state)
+            except Exception as e:
+                logging.error(f"Error restoring {name} state from snapshot: {e}")
+
+        logging.info('Restored state snapshot from %.0fs ago', age)
+        return True
+
+    def start(self):
+        """
+        Starts saving snapshots periodically.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="state-snapshot", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the periodic snapshots and saves a final one.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.save()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                logging.error(f"Error saving state snapshot: {e}")
@@ -0,0 +1,122 @@
+import time
+import random
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class D11StubApi:
+    """
+    Local stand-in for the D11 and Fotmob APIs for benchmarks and simulations. GET /<source>/<resource id> is
+    answered with get_payload(source, resource id), using the resource ids of the raw payload archive, e.g.
+    /d11/match/123 or /fotmob/matchDetails/456. Every response is delayed by latency seconds, give or take
+    jitter, and error_rate of them are 500 errors.
+    """
+    def __init__(self, get_payload, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.get_payload = get_payload
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_server = None
+        self.thread = None
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.not_found = 0
+
+    def start(self):
+        """
+        Starts serving. Returns the port, which is picked by the OS if it was 0.
+        """
+        stub_api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub_api._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.http_server.daemon_threads = True
+        self.port = self.http_server.server_address[1]
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name="stub-api", daemon=True)
+        self.thread.start()
+        logging.info('Stub API listening on %s:%d', self.host, self.port)
+        return self.port
+
+    def stop(self):
+        """
+        Stops serving.
+        """
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+            self.thread.join()
+            self.thread = None
+
+    def get_environment(self):
+        """
+        Gets the environment variables that point the D11 and Fotmob APIs at the stub.
+        """
+        base_url = f"http://{self.host}:{self.port}"
+        return {
+            "D11_API_BASE_URL": f"{base_url}/d11",
+            "D11_API_MATCH_ENDPOINT": "/match/{match_id}",
+            "D11_API_TEAMS_ENDPOINT": "/teams",
+            "FOTMOB_API_BASE_URL": f"{base_url}/fotmob",
+            "FOTMOB_API_MATCH_DETAILS_ENDPOINT": "/matchDetails/{match_id}",
+        }
+
+    def _handle(self, request):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        source, _, resource_id = request.path.lstrip("/").partition("/")
+        with self.lock:
+            self.requests += 1
+
+        if random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            self._respond(request, 500, b'{"error": "injected"}')
+            return
+
+        try:
+            payload = self.get_payload(source, resource_id)
+        except Exception as e:
+            logging.error(f"Error getting stub payload for {request.path}: {e}")
+            payload = None
+
+        if payload is None:
+            with self.lock:
+                self.not_found += 1
+            self._respond(request, 404, b'{"error": "not found"}')
+        else:
+            self._respond(request, 200, payload)
+
+    def _respond(self, request, status, body):
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def get_metrics(self):
+        """
+        Gets request counters.
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "not_found": self.not_found,
+            }
@@ -4,6 +4,15 @@ from .fotmob_service import FotmobService
 from .fotmob_models import FotmobFixture, FotmobGoal, FotmobMatchData, FotmobPlayer, FotmobTeam
 from .fotmob_token_manager import FotmobTokenManager
 from .fotmob_cookie_manager import FotmobCookieManager
-from .fotmob_selenium import FotmobSelenium
+from .fotmob_selenium_executor import FotmobSeleniumExecutor
 
-__all__ = ["fotmob_service", "FotmobApi", "FotmobService", "FotmobFixture", "FotmobGoal", "FotmobMatchData", "FotmobPlayer", "FotmobTeam", "FotmobTokenManager", "FotmobCookieManager", "FotmobSelenium"]
+__all__ = ["fotmob_service", "FotmobApi", "FotmobService", "FotmobFixture", "FotmobGoal", "FotmobMatchData", "FotmobPlayer", "FotmobTeam", "FotmobTokenManager", "FotmobCookieManager", "FotmobSelenium", "FotmobSeleniumExecutor"]
+
+
+def __getattr__(name):
+    # Selenium and seleniumwire take long to import and are only used in the Selenium worker process, so they are
+    # loaded on first use
+    if name == "FotmobSelenium":
+        from .fotmob_selenium import FotmobSelenium
+        return FotmobSelenium
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,6 +3,9 @@ import time
 import requests
 import logging
 
+from archive import raw_payload_store
+from metrics import metrics_registry
+
 from .fotmob_token_manager import FotmobTokenManager
 from .fotmob_cookie_manager import FotmobCookieManager
 
@@ -28,8 +31,8 @@ class FotmobApi:
         self.session = requests.Session()
         self.session.headers.update(FOTMOB_API_HEADERS)
 
+        # The session is refreshed on first use, unless it is restored from a state snapshot before that
         self.last_refresh = 0
-        self._refresh_session()
 
         self.fotmob_token_manager = FotmobTokenManager()
         self.fotmob_cookie_manager = FotmobCookieManager()
@@ -60,7 +63,7 @@ class FotmobApi:
         """
         url_template = os.getenv("FOTMOB_API_BASE_URL") + os.getenv("FOTMOB_API_TABLE_ENDPOINT")
         url = url_template.format(league_id=league_id)
-        return self._call_api(url)
+        return self._call_api(url, f"table/{league_id}")
     
     def get_league(self, league_id):
         """
@@ -68,7 +71,7 @@ class FotmobApi:
         """
         url_template = os.getenv("FOTMOB_API_BASE_URL") + os.getenv("FOTMOB_API_LEAGUE_ENDPOINT")
         url = url_template.format(league_id=league_id)
-        return self._call_api(url)
+        return self._call_api(url, f"league/{league_id}")
 
     def get_team(self, team_id):
         """
@@ -76,7 +79,7 @@ class FotmobApi:
         """
         url_template = os.getenv("FOTMOB_API_BASE_URL") + os.getenv("FOTMOB_API_TEAM_ENDPOINT")
         url = url_template.format(team_id=team_id)
-        return self._call_api(url)
+        return self._call_api(url, f"team/{team_id}")
 
     def get_match_details(self, match_id):
         """
@@ -84,28 +87,48 @@ class FotmobApi:
         """
         url_template = os.getenv("FOTMOB_API_BASE_URL") + os.getenv("FOTMOB_API_MATCH_DETAILS_ENDPOINT")
         url = url_template.format(match_id=match_id)
-        return self._call_api(url)
+        return self._call_api(url, f"matchDetails/{match_id}")
 
-    def _call_api(self, url):
+    def _call_api(self, url, resource_id):
         """
-        Makes a GET request to the Fotmob API and returns the JSON response.
+        Makes a GET request to the Fotmob API, archives the raw response and returns the JSON response.
         If an error occurs, it logs the error and returns None.
         """
         try:
             if time.time() - self.last_refresh > SESSION_REFRESH_INTERVAL:
                 self._refresh_session()
 
-            response = self.session.get(
-                url,
-                timeout=15,
-                cookies=self.get_cookies(),
-            )
-            response.raise_for_status()
+            with metrics_registry.timer("api_request_seconds", api="fotmob", endpoint=resource_id.split("/")[0]):
+                response = self.session.get(
+                    url,
+                    timeout=15,
+                    cookies=self.get_cookies(),
+                )
+                response.raise_for_status()
+            raw_payload_store.store("fotmob", resource_id, response.content)
             return response.json()
         except Exception as e:
             logging.error(f"Error fetching Fotmob data from {url}: {e}")
             return None
 
+    def get_state(self):
+        """
+        Gets the session cookies and refresh time for a state snapshot.
+        """
+        return {
+            "last_refresh": self.last_refresh,
+            "cookies": [{"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path}
+                        for cookie in self.session.cookies],
+        }
+
+    def restore_state(self, state):
+        """
+        Restores the session from a state snapshot so it doesn't have to be refreshed on start.
+        """
+        for cookie in state["cookies"]:
+            self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+        self.last_refresh = state["last_refresh"]
+
     def _refresh_session(self):
         """
         Calls Footmob homepage to refresh session cookies.
@@ -37,7 +37,7 @@ class FotmobSelenium:
         if not self.matches_url:
             raise ValueError("FOTMOB_SELENIUM_MATCHES_URL environment variable is required")
 
-        logging.debug(f"Using Firefox profile: {self.profile_path}")
+        logging.debug('Using Firefox profile: %s', self.profile_path)
 
         self.options = Options()
         self.options.add_argument("-headless")
@@ -92,7 +92,7 @@ class FotmobSelenium:
                     return None
 
                 delay = random.uniform(3, 8)
-                logging.debug(f"Waiting {delay:.2f} seconds before navigating to match URL")
+                logging.debug('Waiting %.2f seconds before navigating to match URL', delay)
                 time.sleep(delay)
 
                 match_url = match_links[0].get_attribute("href")
@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import signal
+import logging
+import resource
+import threading
+import multiprocessing
+
+# How often the worker checks the memory use of itself and the browser
+MEMORY_CHECK_INTERVAL = 1
+
+
+def _peak_memory_mb():
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _process_group_memory_mb():
+    """
+    Gets the resident memory of every process in this process group, i.e. the worker, geckodriver and the Firefox
+    processes, from /proc. Falls back to the peak memory of the worker alone where there is no /proc.
+    """
+    if not os.path.isdir("/proc"):
+        return _peak_memory_mb()
+
+    process_group = os.getpgrp()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    resident = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The command name may contain spaces, the fields after it don't
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != process_group:
+                continue
+            with open(f"/proc/{pid}/statm") as f:
+                resident += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            # The process exited while being read
+            continue
+    return resident / (1024 * 1024)
+
+
+def _watch_memory(memory_limit_mb):
+    while True:
+        time.sleep(MEMORY_CHECK_INTERVAL)
+        if _process_group_memory_mb() > memory_limit_mb:
+            logging.error('Fotmob Selenium worker exceeded %d MB, killing it', memory_limit_mb)
+            os.killpg(os.getpgrp(), signal.SIGKILL)
+
+
+def _run_worker(connection, log_level, memory_limit_mb):
+    """
+    Worker process main loop. Runs FotmobSelenium methods requested over the pipe and sends back the results.
+    The worker leads its own process group so geckodriver and Firefox are killed along with it.
+    """
+    os.setsid()
+    logging.basicConfig(level=log_level, format="%(asctime)s [selenium] %(levelname)s %(message)s")
+
+    if memory_limit_mb:
+        threading.Thread(target=_watch_memory, args=(memory_limit_mb,), daemon=True).start()
+
+    try:
+        from .fotmob_selenium import FotmobSelenium
+        selenium = FotmobSelenium()
+        setup_error = None
+    except Exception as e:
+        logging.error(f"Error setting up Fotmob Selenium: {e}")
+        selenium = None
+        setup_error = str(e)
+
+    while True:
+        try:
+            method, args = connection.recv()
+        except EOFError:
+            return
+
+        if selenium is None:
+            result = ("error", setup_error)
+        else:
+            try:
+                result = ("ok", getattr(selenium, method)(*args))
+            except Exception as e:
+                logging.exception(f"Error in {method}: {e}")
+                result = ("error", str(e))
+
+        try:
+            connection.send(result)
+        except OSError:
+            # The executor has stopped
+            return
+
+
+class FotmobSeleniumExecutor:
+    """
+    Runs FotmobSelenium browser jobs in a separate worker process so the browser and the seleniumwire capture
+    buffers never live in the daemon. Each job has a wall-clock timeout, the worker is killed together with its
+    browser if it times out or exceeds FOTMOB_SELENIUM_MEMORY_LIMIT_MB, and it is restarted on the next job and
+    recycled after FOTMOB_SELENIUM_MAX_JOBS jobs. Jobs run one at a time and return None if they fail, like
+    FotmobSelenium.
+    """
+
+    def __init__(self):
+        self.timeout = float(os.getenv('FOTMOB_SELENIUM_TIMEOUT', 120))
+        self.memory_limit_mb = int(os.getenv('FOTMOB_SELENIUM_MEMORY_LIMIT_MB', 1024))
+        self.max_jobs = int(os.getenv('FOTMOB_SELENIUM_MAX_JOBS', 20))
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.process = None
+        self.connection = None
+        self.jobs = 0
+
+        self.restarts = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def get_api_token(self):
+        """
+        Gets a Fotmob API token with a browser in the worker process.
+        """
+        return self._call("get_api_token")
+
+    def get_api_data(self, url):
+        """
+        Gets Fotmob API data from a URL with a browser in the worker process.
+        """
+        return self._call("get_api_data", url)
+
+    def _start(self):
+        parent_connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(target=_run_worker, name="fotmob-selenium", daemon=True,
+                                            args=(child_connection, logging.getLogger().level, self.memory_limit_mb))
+        self.process.start()
+        child_connection.close()
+        self.connection = parent_connection
+        self.jobs = 0
+        logging.info('Started Fotmob Selenium worker process %d', self.process.pid)
+
+    def _kill(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    # Not a process group leader yet
+                    self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process = None
+        self.connection = None
+
+    def _call(self, method, *args):
+        with self.lock:
+            if self.process is None or not self.process.is_alive() or self.jobs >= self.max_jobs:
+                if self.process is not None:
+                    self.restarts += 1
+                self._kill()
+                self._start()
+
+            self.jobs += 1
+            start = time.monotonic()
+
+            try:
+                self.connection.send((method, args))
+                if not self.connection.poll(self.timeout):
+                    self.timeouts += 1
+                    logging.error('Fotmob Selenium %s timed out after %ds, killing worker', method, self.timeout)
+                    self._kill()
+                    return None
+                status, result = self.connection.recv()
+            except (EOFError, OSError) as e:
+                # The worker died, most likely killed for using too much memory
+                self.failures += 1
+                logging.error(f"Fotmob Selenium worker died during {method}: {e}")
+                self._kill()
+                return None
+
+            logging.debug('Fotmob Selenium %s took %.1fs', method, time.monotonic() - start)
+            if status != "ok":
+                self.failures += 1
+                return None
+            return result
+
+    def stop(self):
+        """
+        Stops the worker process.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+            if self.process is not None:
+                self.process.join(5)
+            self._kill()
+
+    def get_metrics(self):
+        """
+        Gets worker restart, timeout and failure counters.
+        """
+        return {
+            "alive": self.process is not None and self.process.is_alive(),
+            "jobs": self.jobs,
+            "restarts": self.restarts,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+        }
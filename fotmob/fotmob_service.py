@@ -11,7 +11,7 @@ from datetime import datetime, timedelta, timezone
 
 from .fotmob_api import FotmobApi
 from .fotmob_cookie_manager import FotmobCookieManager
-from .fotmob_selenium import FotmobSelenium
+from .fotmob_selenium_executor import FotmobSeleniumExecutor
 from .fotmob_models import FotmobMatchData, FotmobGoal, FotmobPlayer, FotmobTeam, FotmobFixture
 
 class FotmobService:
@@ -21,7 +21,7 @@ class FotmobService:
 
     def __init__(self):        
         self.api = FotmobApi()
-        self.selenium = FotmobSelenium()
+        self.selenium = FotmobSeleniumExecutor()
 
     def get_teams(self, league_id):
         """
@@ -98,7 +98,14 @@ class FotmobService:
         Fetches match data from Fotmob API and returns a MatchData object.
         """
         data = self.api.get_match_details(match_id)
+        return self.parse_match_details(data)
 
+    @staticmethod
+    def parse_match_details(data):
+        """
+        Parses a Fotmob matchDetails response and returns a MatchData object. This is static and doesn't touch
+        the API so it can be run in a worker process.
+        """
         data = json.loads(json.dumps(data), object_hook=lambda dictionary: SimpleNamespace(**dictionary))
 
         match_data = FotmobMatchData()
@@ -1,48 +1,267 @@
 import os
 import sys
+import json
+import time
+import atexit
 import argparse
 import subprocess
 
-import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    force=True
-)
-logging.getLogger("stomp").setLevel(logging.WARNING)
+from datetime import datetime
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from tkinter.filedialog import askdirectory, askopenfilename
+import logging
+from metrics.metrics_logging import configure_logging
+configure_logging()
+logging.getLogger("stomp").setLevel(logging.WARNING)
 
-from d11 import D11Service, D11Daemon
-from fotmob import FotmobService
+from metrics import metrics_registry, SamplingProfiler
+
+# Everything else is imported by the commands that use it, so e.g. hello or a command forwarded to the daemon
+# doesn't load Selenium, Tk, the MQ client and numpy. The imports of each command are listed in commands for the
+# import_times report.
 
 commands = [ 
-    { "name": "hello", "description": "Prints a greeting", "arguments": []},
-    { "name": "d11_daemon", "description": "Starts the D11 deamon that runs the scheduler and MQ listener", "arguments": []},
-    { "name": "update_squads", "description": "Triggers a team squad update", "arguments": [] }, 
-    { "name": "update_photos", "description": "Update player photos from PremierLeague.com", "arguments": [] }, 
-    { "name": "update_match", "description": "Triggers a match update", "arguments": [ 
+    { "name": "hello", "description": "Prints a greeting", "control": True, "imports": [], "arguments": []},
+    { "name": "d11_daemon", "description": "Starts the D11 deamon that runs the scheduler and MQ listener", "imports": ["d11.d11_daemon", "d11.d11_async_daemon"], "arguments": [
+            { "name": "--asyncio", "action": "store_true", "required": False, "help": "Run everything on one asyncio event loop"},
+    ]},
+    { "name": "update_squads", "description": "Triggers a team squad update", "control": True, "imports": ["d11.d11_service"], "arguments": [] }, 
+    { "name": "update_photos", "description": "Update player photos from PremierLeague.com", "imports": ["tkinter.filedialog", "d11.d11_service"], "arguments": [] }, 
+    { "name": "update_match", "description": "Triggers a match update", "control": True, "imports": ["d11.d11_service"], "arguments": [ 
             { "name": "--match_id", "type": int, "required": True, "help": "Match ID"},
             { "name": "--finish", "action": "store_true", "required": False, "help": "Finish the match"},
         ] 
     },
-    { "name": "export_fotmob_har", "description": "Runs the export_har.scpt to get a .har file that can be parsed", "arguments": [
+    { "name": "backfill_season", "description": "Regenerates archived match data for all matches in a season", "control": True, "imports": ["d11.d11_backfill"], "arguments": [
+            { "name": "--season_id", "type": int, "required": True, "help": "D11 season ID"},
+            { "name": "--concurrency", "type": int, "required": False, "help": "Maximum number of concurrent Fotmob requests"},
+            { "name": "--rate_limit", "type": float, "required": False, "help": "Maximum number of Fotmob requests per second"},
+            { "name": "--processes", "type": int, "required": False, "help": "Number of parser processes (defaults to CPU count)"},
+            { "name": "--publish", "action": "store_true", "required": False, "help": "Also send update match messages to the MQ"},
+            { "name": "--restart", "action": "store_true", "required": False, "help": "Ignore the checkpoint and start over"},
+            { "name": "--from_archive", "action": "store_true", "required": False, "help": "Read D11 and Fotmob data from the raw payload archive instead of fetching it"},
+        ]
+    },
+    { "name": "prune_raw_archive", "description": "Removes raw payloads older than the retention period from the archive", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--retention_days", "type": int, "required": False, "help": "Retention period in days (defaults to ARCHIVE_RAW_RETENTION_DAYS)"}
+    ]},
+    { "name": "migrate_match_files", "description": "Imports old per-minute match JSON files into match logs", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--directory", "type": str, "required": True, "help": "Directory to import match files from"},
+            { "name": "--delete", "action": "store_true", "required": False, "help": "Delete match files after importing them"},
+    ]},
+    { "name": "show_match_state", "description": "Prints the logged state of a match at a point in time", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--match_id", "type": int, "required": True, "help": "Match ID"},
+            { "name": "--elapsed", "type": str, "required": False, "help": "Elapsed time, e.g. 57, HT or FT (defaults to latest)"},
+    ]},
+    { "name": "show_match_traces", "description": "Prints the latency breakdown of traced match updates", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--match_id", "type": int, "required": False, "help": "Match ID"},
+            { "name": "--correlation_id", "type": str, "required": False, "help": "Correlation ID of an ACTIVE_MATCH or UPDATE_MATCH message"},
+            { "name": "--limit", "type": int, "required": False, "help": "Number of updates to print, newest first (defaults to 20)"},
+    ]},
+    { "name": "season_stats", "description": "Prints season statistics per player or team", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--season", "type": str, "required": True, "help": "Season name"},
+            { "name": "--teams", "action": "store_true", "required": False, "help": "Aggregate per team instead of per player"},
+            { "name": "--sort", "type": str, "required": False, "help": "Column to sort by (defaults to goals)"},
+            { "name": "--limit", "type": int, "required": False, "help": "Number of rows to print (defaults to 20)"},
+    ]},
+    { "name": "player_matches", "description": "Prints archived matches for a Fotmob player id", "control": True, "imports": ["archive"], "arguments": [
+            { "name": "--player_id", "type": int, "required": True, "help": "Fotmob player ID"},
+            { "name": "--season", "type": str, "required": False, "help": "Season name"},
+            { "name": "--date_from", "type": str, "required": False, "help": "Earliest match date (YYYY-MM-DD)"},
+            { "name": "--date_to", "type": str, "required": False, "help": "Latest match date (YYYY-MM-DD)"},
+    ]},
+    { "name": "stub_broker", "description": "Runs a local STOMP broker stand-in for Artemis MQ for testing", "imports": ["artemis"], "arguments": [
+            { "name": "--port", "type": int, "required": False, "help": "Port (defaults to 61616)"},
+            { "name": "--latency", "type": float, "required": False, "help": "Delivery latency in seconds (defaults to 0)"},
+    ]},
+    { "name": "benchmark_pipeline", "description": "Benchmarks the match update pipeline against stub APIs and a stub broker on archived payloads", "imports": ["d11.d11_benchmark"], "arguments": [
+            { "name": "--matches", "type": int, "required": False, "help": "Number of archived matches to use (defaults to 10)"},
+            { "name": "--messages", "type": int, "required": False, "help": "Number of ACTIVE_MATCH messages to publish (defaults to 200)"},
+            { "name": "--rate", "type": float, "required": False, "help": "ACTIVE_MATCH messages per second (defaults to 20)"},
+            { "name": "--workers", "type": int, "required": False, "help": "Number of match update workers (defaults to 4)"},
+            { "name": "--http_latency", "type": float, "required": False, "help": "Stub API latency in seconds (defaults to 0.05)"},
+            { "name": "--error_rate", "type": float, "required": False, "help": "Fraction of stub API requests that fail (defaults to 0)"},
+            { "name": "--broker_latency", "type": float, "required": False, "help": "Stub broker delivery latency in seconds (defaults to 0)"},
+        ]},
+    { "name": "simulate_matchday", "description": "Simulates matchdays against the match update pipeline to find how many live matches it sustains", "imports": ["d11.d11_matchday"], "arguments": [
+            { "name": "--matches", "type": int, "required": True, "help": "Number of simultaneous matches"},
+            { "name": "--max_matches", "type": int, "required": False, "help": "Double the number of matches up to this until updates can't keep up"},
+            { "name": "--speed", "type": float, "required": False, "help": "How many times faster than real time match clocks run (defaults to 30)"},
+            { "name": "--interval", "type": float, "required": False, "help": "Seconds between ACTIVE_MATCH messages for each live match (defaults to 10)"},
+            { "name": "--kickoff_spread", "type": float, "required": False, "help": "Seconds over which matches kick off (defaults to 30)"},
+            { "name": "--workers", "type": int, "required": False, "help": "Number of match update workers (defaults to 4)"},
+            { "name": "--http_latency", "type": float, "required": False, "help": "Stub API latency in seconds (defaults to 0.05)"},
+            { "name": "--error_rate", "type": float, "required": False, "help": "Fraction of stub API requests that fail (defaults to 0)"},
+            { "name": "--staleness_target", "type": float, "required": False, "help": "Sustainable staleness p95 in seconds (defaults to twice the interval)"},
+            { "name": "--seed", "type": int, "required": False, "help": "Random seed for match events"},
+        ]},
+    { "name": "import_times", "description": "Reports the cold start import time of commands", "imports": ["metrics.metrics_import_time"], "arguments": [
+            { "name": "--name", "type": str, "required": False, "help": "Command name (defaults to all commands)"},
+    ]},
+    { "name": "compare_mq_encodings", "description": "Compares size and throughput of MQ message encodings on logged match data", "control": True, "imports": ["archive", "d11.d11_mq_encoding"], "arguments": [
+            { "name": "--match_id", "type": int, "required": False, "help": "Match ID (defaults to all logged matches)"},
+    ]},
+    { "name": "export_fotmob_har", "description": "Runs the export_har.scpt to get a .har file that can be parsed", "imports": [], "arguments": [
             { "name": "--url", "type": str, "required": True, "help": "Output file path for the .har file"}
     ]},
-    { "name": "parse_fotmob_har", "description": "Parses a .har file from Fotmob and updates the token in .fotmob_api_token", "arguments": []},
-    { "name": "update_fotmob_token", "description": "Updates the Fotmob API token using Selenium", "arguments": []},
-    { "name": "update_fotmob_cookie", "description": "Updates the Fotmob turnstile cookie from Firefox profile cookie database", "arguments": []},
-    { "name": "update_fotmob_ids", "description": "Generates SQL for updating missing Fotmob player ids", "arguments": []},
-    { "name": "generate_pl_fixtures", "description": "Generates Premier League fixtures for the upcoming season", "arguments": []},
-    { "name": "generate_d11_fixtures", "description": "Generates D11 fixtures for the upcoming season", "arguments": []},    
+    { "name": "parse_fotmob_har", "description": "Parses a .har file from Fotmob and updates the token in .fotmob_api_token", "control": True, "imports": ["fotmob"], "arguments": []},
+    { "name": "update_fotmob_token", "description": "Updates the Fotmob API token using Selenium", "control": True, "imports": ["fotmob"], "arguments": []},
+    { "name": "update_fotmob_cookie", "description": "Updates the Fotmob turnstile cookie from Firefox profile cookie database", "control": True, "imports": ["fotmob"], "arguments": []},
+    { "name": "update_fotmob_ids", "description": "Generates SQL for updating missing Fotmob player ids", "imports": ["tkinter.filedialog", "fotmob"], "arguments": []},
+    { "name": "generate_pl_fixtures", "description": "Generates Premier League fixtures for the upcoming season", "control": True, "imports": ["fotmob"], "arguments": []},
+    { "name": "generate_d11_fixtures", "description": "Generates D11 fixtures for the upcoming season", "control": True, "imports": ["d11.d11_service"], "arguments": []},    
 ]
 
+def run_command(args, output, d11_service=None, fotmob_service=None):
+    """
+    Runs a command that can also be run by a daemon for a control socket client. Output lines are passed to output
+    and services that are given are used instead of new ones. Returns the exit code.
+    """
+    if args.command == "hello":
+        logging.info("Hello, World!")
+    elif args.command == "update_squads":
+        competition_id = os.getenv('PREMIER_LEAGUE_DEFAULT_COMPETITION_ID')
+        season = os.getenv('PREMIER_LEAGUE_DEFAULT_SEASON')
+
+        if competition_id is None or season is None:
+            logging.error("Competition id or season is not defined in .env")
+            return 1
+        from d11.d11_service import D11Service
+        d11_service = d11_service or D11Service()
+        d11_service.update_squads(competition_id, season)
+    elif args.command == "update_match":
+        from d11.d11_service import D11Service
+        d11_service = d11_service or D11Service()
+        d11_service.update_match(args.match_id, args.finish)
+    elif args.command == "backfill_season":
+        from d11.d11_backfill import D11Backfill
+        d11_backfill = D11Backfill()
+        d11_backfill.run(args.season_id,
+                         concurrency=args.concurrency,
+                         rate_limit=args.rate_limit,
+                         processes=args.processes,
+                         publish=args.publish,
+                         restart=args.restart,
+                         from_archive=args.from_archive)
+    elif args.command == "prune_raw_archive":
+        from archive import raw_payload_store
+        raw_payload_store.prune(args.retention_days)
+    elif args.command == "migrate_match_files":
+        from archive import match_log
+        match_log.migrate(args.directory, delete=args.delete)
+    elif args.command == "show_match_state":
+        from archive import match_log
+        state = match_log.get_state(args.match_id, elapsed=args.elapsed)
+
+        if state is None:
+            logging.error(f"No logged state for match {args.match_id}")
+            return 1
+        output(json.dumps(state, ensure_ascii=False, indent=2))
+    elif args.command == "show_match_traces":
+        from archive import trace_store
+        if args.correlation_id:
+            traces = trace_store.get_trace(args.correlation_id)
+        elif args.match_id:
+            traces = trace_store.get_match_traces(args.match_id, limit=args.limit or 20)
+        else:
+            logging.error("Either a match id or a correlation id is required")
+            return 1
+
+        for trace in traces:
+            breakdown = {}
+            for span in trace["spans"]:
+                breakdown[span["name"]] = round(breakdown.get(span["name"], 0.0) + span["duration"] * 1000, 1)
+            output(json.dumps({
+                "correlationId": trace["trace_id"],
+                "matchId": trace["match_id"],
+                "startedAt": datetime.fromtimestamp(trace["started_at"]).isoformat(timespec="milliseconds"),
+                "finish": trace["finish"],
+                "status": trace["status"],
+                "totalMs": round(trace["duration"] * 1000, 1),
+                "stagesMs": breakdown,
+                "coalesced": trace["coalesced"],
+            }))
+    elif args.command == "season_stats":
+        from archive import season_stats_store
+        totals = season_stats_store.totals(args.season, group_by="team_fotmob_id" if args.teams else "player_fotmob_id")
+        sort = args.sort or "goals"
+        if totals and sort not in totals[0]:
+            logging.error(f"Can't sort by {sort}, the columns are {', '.join(totals[0])}")
+            return 1
+        totals.sort(key=lambda row: row[sort], reverse=True)
+
+        for row in totals[:args.limit or 20]:
+            output(json.dumps(row, ensure_ascii=False))
+    elif args.command == "player_matches":
+        from archive import match_index
+        date_to = f"{args.date_to} 23:59" if args.date_to else None
+        for entry in match_index.get_player_matches(args.player_id, date_from=args.date_from, date_to=date_to, season=args.season):
+            output(json.dumps(entry, ensure_ascii=False))
+
+        last_start = match_index.get_last_start(args.player_id)
+        last_goal = match_index.get_last_goal(args.player_id)
+        logging.info("Last start: %s", last_start["datetime"] if last_start else "never")
+        logging.info("Last goal: %s", last_goal["datetime"] if last_goal else "never")
+    elif args.command == "compare_mq_encodings":
+        from archive import match_log
+        from d11.d11_mq_encoding import compare_encodings
+        match_ids = [args.match_id] if args.match_id else match_log.list_matches()
+        messages = [state for state in (match_log.get_state(match_id) for match_id in match_ids) if state is not None]
+
+        if not messages:
+            logging.error("No logged match data to compare encodings on")
+            return 1
+
+        logging.info(f"Comparing MQ encodings on {len(messages)} update match messages")
+        for result in compare_encodings(messages):
+            output(f"{result['encoding']:<14}{result['average_bytes']:>10} bytes{result['encode_per_second']:>10} enc/s{result['decode_per_second']:>10} dec/s")
+    elif args.command == "parse_fotmob_har":
+        file_path = os.getenv('FOTMOB_HAR_FILE_PATH')
+        from fotmob import FotmobService
+        fotmob_service = fotmob_service or FotmobService()
+        fotmob_service.parse_fotmob_har(file_path)
+    elif args.command == "update_fotmob_token": 
+        from fotmob import FotmobService
+        fotmob_service = fotmob_service or FotmobService()
+        fotmob_service.get_fotmob_api_token()
+    elif args.command == "update_fotmob_cookie": 
+        from fotmob import FotmobService
+        fotmob_service = fotmob_service or FotmobService()
+        fotmob_service.get_fotmob_turnstile_cookie()
+    elif args.command == "generate_d11_fixtures":
+        from d11.d11_service import D11Service
+        d11_service = d11_service or D11Service()
+        d11_service.generate_d11_fixtures()
+    elif args.command == "generate_pl_fixtures":
+        league_id = os.getenv('FOTMOB_DEFAULT_LEAGUE_ID')
+
+        if league_id is None:
+            logging.error("League id is not defined in .env")
+            return 1
+
+        from fotmob import FotmobService
+        fotmob_service = fotmob_service or FotmobService()
+        fotmob_service.generate_pl_fixtures(league_id)
+    else:
+        logging.error(f"Command {args.command} can't be run by the daemon")
+        return 2
+    return 0
+
+def start_profiler(name):
+    """
+    Profiles the rest of the run, writing the reports when the process exits.
+    """
+    profiler = SamplingProfiler(name)
+    profiler.start()
+    atexit.register(profiler.stop)
+
 def main():
 
     parser = argparse.ArgumentParser(description="D11 Python")
+    parser.add_argument("--profile", action="store_true", help="Profile the command, see PROFILE_DIRECTORY for the reports")
+    parser.add_argument("--metrics", action="store_true", help="Log a summary of API, MQ and task latencies when the command ends")
     subparsers = parser.add_subparsers(dest="command")
 
     for command in commands:
@@ -54,27 +273,33 @@ def main():
             else:
                 subparser.add_argument(argument["name"], type=argument["type"], required=argument["required"], help=argument["help"])
 
-    if len(sys.argv) <= 1 or sys.argv[1] not in [command["name"] for command in commands]:
+        if command.get("control"):
+            subparser.add_argument("--local", action="store_true", required=False, help="Run in this process even if a daemon is running")
+
+    args = parser.parse_args()
+
+    if args.command is None:
         parser.print_help()
         sys.exit(1)
-    
-    args = parser.parse_args()
+    command = next(command for command in commands if command["name"] == args.command)
 
-    if args.command == "hello":
-        logging.info("Hello, World!")
-    elif args.command == "d11_daemon":
-        d11_daemon = D11Daemon()
-        d11_daemon.start()
-    elif args.command == "update_squads":
-        competition_id = os.getenv('PREMIER_LEAGUE_DEFAULT_COMPETITION_ID')
-        season = os.getenv('PREMIER_LEAGUE_DEFAULT_SEASON')
+    if args.metrics:
+        atexit.register(lambda: logging.info("Metrics summary:\n%s", metrics_registry.summary()))
 
-        if competition_id is None or season is None:
-            logging.error("Competition id or season is not defined in .env")
-            sys.exit(1)
-        d11_service = D11Service()
-        d11_service.update_squads(competition_id, season)
+    # Commands forwarded to a daemon are profiled there
+    if args.profile and not command.get("control"):
+        start_profiler(args.command)
+
+    if args.command == "d11_daemon":
+        if args.asyncio:
+            from d11.d11_async_daemon import D11AsyncDaemon
+            d11_daemon = D11AsyncDaemon(run_command)
+        else:
+            from d11.d11_daemon import D11Daemon
+            d11_daemon = D11Daemon(run_command)
+        d11_daemon.start()
     elif args.command == "update_photos":
+        from tkinter.filedialog import askdirectory
         photo_directory = askdirectory(initialdir = '.')
 
         if photo_directory == "":
@@ -87,23 +312,44 @@ def main():
             logging.error("Competition id or season is not defined in .env")
             sys.exit(1)
         
+        from d11.d11_service import D11Service
         d11_service = D11Service()
         d11_service.update_player_photos(photo_directory=photo_directory, competition_id=competition_id, season=season)
-    elif args.command == "update_match":
-        d11_service = D11Service()
-        d11_service.update_match(args.match_id, args.finish)
+    elif args.command == "stub_broker":
+        from artemis import ArtemisStubBroker
+        stub_broker = ArtemisStubBroker(port=args.port or 61616, latency=args.latency or 0.0)
+        stub_broker.start()
+        try:
+            while True:
+                time.sleep(60)
+                logging.info("Stub broker: %s", stub_broker.get_metrics())
+        except KeyboardInterrupt:
+            stub_broker.stop()
+    elif args.command == "benchmark_pipeline":
+        from d11.d11_benchmark import D11Benchmark
+        d11_benchmark = D11Benchmark(matches=args.matches or 10, messages=args.messages or 200, rate=args.rate or 20.0,
+                                     workers=args.workers or 4,
+                                     http_latency=args.http_latency if args.http_latency is not None else 0.05,
+                                     error_rate=args.error_rate or 0.0, broker_latency=args.broker_latency or 0.0)
+        report = d11_benchmark.run()
+        if report is None:
+            sys.exit(1)
+        print(json.dumps(report, indent=2))
+    elif args.command == "simulate_matchday":
+        from d11.d11_matchday import D11MatchdaySimulator
+        d11_matchday_simulator = D11MatchdaySimulator(speed=args.speed or 30.0, interval=args.interval or 10.0,
+                                                      kickoff_spread=args.kickoff_spread if args.kickoff_spread is not None else 30.0,
+                                                      workers=args.workers or 4,
+                                                      http_latency=args.http_latency if args.http_latency is not None else 0.05,
+                                                      error_rate=args.error_rate or 0.0, staleness_target=args.staleness_target,
+                                                      seed=args.seed)
+        if args.max_matches:
+            report = d11_matchday_simulator.find_capacity(args.matches, args.max_matches)
+        else:
+            report = d11_matchday_simulator.run(args.matches)
+        print(json.dumps(report, indent=2))
     elif args.command == "export_fotmob_har":
         subprocess.run(["osascript", "./export_har/export-har.scpt", args.url])
-    elif args.command == "parse_fotmob_har":
-        file_path = os.getenv('FOTMOB_HAR_FILE_PATH')
-        fotmob_service = FotmobService()
-        fotmob_service.parse_fotmob_har(file_path)
-    elif args.command == "update_fotmob_token": 
-        fotmob_service = FotmobService()
-        fotmob_service.get_fotmob_api_token()
-    elif args.command == "update_fotmob_cookie": 
-        fotmob_service = FotmobService()
-        fotmob_service.get_fotmob_turnstile_cookie()
     elif args.command == "update_fotmob_ids":
         league_id = os.getenv('FOTMOB_DEFAULT_LEAGUE_ID')
 
@@ -111,25 +357,39 @@ def main():
             logging.error("League id is not defined in .env")
             sys.exit(1)
 
+        from tkinter.filedialog import askopenfilename
         id_file_name = askopenfilename(initialdir= '.')
 
         if id_file_name == "":
             sys.exit();
     
+        from fotmob import FotmobService
         fotmob_service = FotmobService()
         fotmob_service.generate_missing_player_ids(league_id, id_file_name)
-    elif args.command == "generate_d11_fixtures":
-        d11_service = D11Service()
-        d11_service.generate_d11_fixtures()
-    elif args.command == "generate_pl_fixtures":
-        league_id = os.getenv('FOTMOB_DEFAULT_LEAGUE_ID')
-
-        if league_id is None:
-            logging.error("League id is not defined in .env")
-            sys.exit(1)
-
-        fotmob_service = FotmobService()
-        fotmob_service.generate_pl_fixtures(league_id)
+    elif args.command == "import_times":
+        from metrics.metrics_import_time import measure_import_time
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for measured in commands:
+            if args.name and measured["name"] != args.name:
+                continue
+            # A command imports main, then the control client if it can be forwarded to a daemon, then its own modules
+            modules = ["main"] + (["d11.d11_control"] if measured.get("control") else []) + measured["imports"]
+            result = measure_import_time(modules, directory)
+            if not result["ok"]:
+                logging.error("Importing %s failed", ", ".join(modules))
+            slowest = ", ".join(f"{name} {ms:.0f}ms" for name, ms in result["slowest"][:3])
+            print(f"{measured['name']:<24}{result['import_ms']:>8.0f} ms import{result['wall_ms']:>8.0f} ms wall"
+                  f"{result['modules']:>6} modules  heavy: {', '.join(result['heavy']) or '-'}  slowest: {slowest}")
+    elif command.get("control"):
+        if not args.local:
+            from d11.d11_control import D11ControlClient
+            arguments = {key: value for key, value in vars(args).items() if key not in ("command", "local")}
+            exit_code = D11ControlClient().run(args.command, arguments)
+            if exit_code is not None:
+                sys.exit(exit_code)
+        if args.profile:
+            start_profiler(args.command)
+        sys.exit(run_command(args, print))
     else:
         parser.print_help()
 
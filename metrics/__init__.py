@@ -0,0 +1,10 @@
+from .metrics_registry import MetricsRegistry
+from .metrics_server import MetricsServer
+from .metrics_profiler import SamplingProfiler
+from .metrics_tracing import Trace, span, get_correlation_id, track_threads, in_context, CORRELATION_ID_HEADER
+from .metrics_logging import configure_logging, JsonFormatter
+from .metrics_import_time import measure_import_time
+
+metrics_registry = MetricsRegistry()
+
+__all__ = ["metrics_registry", "MetricsRegistry", "MetricsServer", "SamplingProfiler", "Trace", "span", "get_correlation_id", "track_threads", "in_context", "CORRELATION_ID_HEADER", "configure_logging", "JsonFormatter", "measure_import_time"]
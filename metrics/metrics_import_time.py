@@ -0,0 +1,47 @@
+import sys
+import time
+import subprocess
+
+# Packages that are slow to import and should only be loaded by the commands that use them
+HEAVY_PACKAGES = ("seleniumwire", "selenium", "tkinter", "stomp", "numpy", "requests")
+
+
+def parse_import_times(lines):
+    """
+    Parses python -X importtime output into (name, depth, self seconds, cumulative seconds) tuples in import order.
+    """
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|", 2)
+        if not self_time.strip().isdigit():
+            # The header line
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(self_time) / 1e6, int(cumulative_time) / 1e6))
+    return imports
+
+
+def measure_import_time(modules, directory=None):
+    """
+    Imports modules in a new interpreter under python -X importtime. Returns the total import time, the wall-clock
+    time of the interpreter run, the slowest top-level imports and which heavy packages were loaded.
+    """
+    code = "\n".join(f"import {module}" for module in modules) or "pass"
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=directory, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+
+    imports = parse_import_times(result.stderr.splitlines())
+    top_level = sorted((entry for entry in imports if entry[1] == 0), key=lambda entry: entry[3], reverse=True)
+    loaded = {name.split(".")[0] for name, _, _, _ in imports}
+
+    return {
+        "ok": result.returncode == 0,
+        "import_ms": round(sum(entry[3] for entry in top_level) * 1000, 1),
+        "wall_ms": round(wall_time * 1000, 1),
+        "modules": len(imports),
+        "slowest": [(name, round(cumulative * 1000, 1)) for name, _, _, cumulative in top_level[:5]],
+        "heavy": [package for package in HEAVY_PACKAGES if package in loaded],
+    }
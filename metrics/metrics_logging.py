@@ -0,0 +1,106 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics_tracing import current_trace, current_stage
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# Record attributes that are added to JSON log lines when they are set
+CONTEXT_FIELDS = ("correlation_id", "match_id", "stage")
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    Adds the correlation id and match id of the current trace and the current stage to log records. Values passed
+    in extra are kept.
+    """
+    def filter(self, record):
+        trace = current_trace.get()
+        if trace is not None:
+            if getattr(record, "correlation_id", None) is None:
+                record.correlation_id = trace.trace_id
+            if getattr(record, "match_id", None) is None:
+                record.match_id = trace.match_id
+        if getattr(record, "stage", None) is None:
+            record.stage = current_stage.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line, with the trace context fields when they are set.
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Puts log records on a queue for a background writer. The message is merged with its arguments and the
+    exception formatted on the calling thread, since they may change or go away before the record is written,
+    but the rest of the formatting is left to the writer.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging():
+    """
+    Configures the root logger. LOG_LEVEL sets the level and LOG_FORMAT is text or json. Unless LOG_ASYNC is false
+    records are written to stderr by a background thread, so logging never blocks on I/O in the calling thread.
+    Returns the queue listener, or None when logging is synchronous.
+    """
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(level)
+
+    if os.getenv('LOG_ASYNC', 'true').lower() != 'true':
+        stream_handler.addFilter(TraceContextFilter())
+        root.addHandler(stream_handler)
+        return None
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    # Filters run on the calling thread, where the trace context is
+    queue_handler.addFilter(TraceContextFilter())
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+
+from collections import Counter
+from datetime import datetime
+
+
+def format_frame(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Profiles a run of a command or task with low enough overhead to leave on in production. A background thread
+    samples the wall-clock stacks of the profiled threads every PROFILE_INTERVAL_SECONDS and counts them, and
+    with PROFILE_ALLOCATIONS tracemalloc tracks allocations with PROFILE_ALLOCATION_FRAMES frames. When the
+    profiler stops it writes the samples as collapsed stacks, which flamegraph.pl and speedscope read, and the
+    largest allocation sites to PROFILE_DIRECTORY. thread_ids limits sampling to some threads and may change while
+    profiling, like the set yielded by track_threads. By default all threads are sampled.
+    """
+    def __init__(self, name, thread_ids=None):
+        self.name = name
+        self.thread_ids = thread_ids
+        self.directory = os.getenv('PROFILE_DIRECTORY', 'data/profiles')
+        self.interval = float(os.getenv('PROFILE_INTERVAL_SECONDS', 0.01))
+        self.trace_allocations = os.getenv('PROFILE_ALLOCATIONS', 'false').lower() == 'true'
+        self.allocation_frames = int(os.getenv('PROFILE_ALLOCATION_FRAMES', 5))
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.started_tracemalloc = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Starts sampling. Allocation tracing is shared by the whole process, so when another profiler already has
+        it running this one reports on the allocations traced by both.
+        """
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(self.allocation_frames)
+            self.started_tracemalloc = True
+
+        self.started_at = time.perf_counter()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample, name=f"profiler-{self.name}", daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        """
+        Stops profiling and writes the reports. Returns the paths of the files written.
+        """
+        if self.thread is None:
+            return []
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        duration = time.perf_counter() - self.started_at
+
+        snapshot = None
+        peak = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+                self.started_tracemalloc = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+        paths = []
+
+        stack_path = base + ".collapsed"
+        with open(stack_path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        paths.append(stack_path)
+
+        if snapshot is not None:
+            allocation_path = base + ".allocations.txt"
+            with open(allocation_path, "w", encoding="utf-8") as f:
+                f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n")
+                for statistic in snapshot.statistics("traceback")[:25]:
+                    f.write(f"{statistic.size / 1024:.1f} KiB in {statistic.count} blocks\n")
+                    for line in statistic.traceback.format():
+                        f.write(f"{line}\n")
+                    f.write("\n")
+            paths.append(allocation_path)
+
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        logging.info('Profiled %s for %.2fs, %d samples. Top: %s. Written to %s', self.name, duration, self.samples,
+                     ", ".join(f"{leaf} {count * 100 / max(sum(leaves.values()), 1):.0f}%" for leaf, count in leaves.most_common(5)),
+                     ", ".join(paths))
+        return paths
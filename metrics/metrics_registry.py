@@ -0,0 +1,194 @@
+import math
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+
+# Latency histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(labels, extra=None):
+    """
+    Formats label pairs the way the Prometheus text format wants them.
+    """
+    pairs = list(labels) + list(extra or ())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def flatten(prefix, value):
+    """
+    Flattens a nested get_metrics() dict into (name, value) pairs of its numeric leaves.
+    """
+    if isinstance(value, bool):
+        yield prefix, int(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for key, child in value.items():
+            yield from flatten(f"{prefix}_{key}".replace("-", "_").replace(".", "_"), child)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction):
+        """
+        Estimates a quantile by interpolating within the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                return min(lower + (bound - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+            lower = bound
+        return self.max
+
+
+class MetricsRegistry:
+    """
+    Collects counters and latency histograms recorded at instrumentation points, plus gauges read from
+    registered collectors, which are functions returning get_metrics() style nested dicts. Everything can be
+    rendered in the Prometheus text format or as a summary for the end of a CLI run.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = {}
+        self.started_at = time.time()
+
+    def increment(self, name, value=1, **labels):
+        """
+        Adds to a counter.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration in a histogram.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Records the duration of a block in a histogram. A block that raises also counts in the <name>_errors_total
+        counter.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, name, collector):
+        """
+        Registers a function whose numeric get_metrics() values are exported as gauges prefixed by name.
+        """
+        self.collectors[name] = collector
+
+    def unregister_collector(self, name):
+        """
+        Removes a collector.
+        """
+        self.collectors.pop(name, None)
+
+    def collect_gauges(self):
+        """
+        Reads the current gauge values from all collectors.
+        """
+        gauges = []
+        for name, collector in list(self.collectors.items()):
+            try:
+                gauges.extend(flatten(name, collector()))
+            except Exception as e:
+                logging.warning(f"Error collecting {name} metrics: {e}")
+        return gauges
+
+    def render_prometheus(self):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for name, value in self.collect_gauges():
+            if math.isfinite(value):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+
+        lines.append("# TYPE process_uptime_seconds gauge")
+        lines.append(f"process_uptime_seconds {time.time() - self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Gets a readable summary of the counters and histograms recorded so far, one line per series.
+        """
+        lines = []
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                lines.append(f"{name}{format_labels(labels)}: {histogram.count} in {histogram.sum:.3f}s, "
+                             f"avg {histogram.sum / histogram.count * 1000:.1f}ms, "
+                             f"p50 {histogram.quantile(0.5) * 1000:.1f}ms, p90 {histogram.quantile(0.9) * 1000:.1f}ms, "
+                             f"max {histogram.max * 1000:.1f}ms")
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{format_labels(labels)}: {value}")
+        return "\n".join(lines) if lines else "No metrics recorded"
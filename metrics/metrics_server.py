@@ -0,0 +1,75 @@
+import os
+import json
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsServer:
+    """
+    Serves the metrics of a registry in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics.
+    Given a get_health() function returning a dict with a status, also serves it as JSON on /health, with status
+    503 unless the status is ok or unknown. METRICS_PORT 0 disables the server.
+    """
+    def __init__(self, metrics_registry, get_health=None):
+        self.metrics_registry = metrics_registry
+        self.get_health = get_health
+        self.host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.port = int(os.getenv('METRICS_PORT', 9464))
+        self.http_server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Starts serving metrics.
+        """
+        if not self.port:
+            return
+
+        metrics_registry = self.metrics_registry
+        get_health = self.get_health
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/metrics":
+                    self._respond(200, "text/plain; version=0.0.4; charset=utf-8", metrics_registry.render_prometheus())
+                elif path == "/health" and get_health is not None:
+                    health = get_health()
+                    code = 200 if health.get("status") in ("ok", "unknown") else 503
+                    self._respond(code, "application/json", json.dumps(health))
+                else:
+                    self.send_error(404)
+
+            def _respond(self, code, content_type, body):
+                body = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug('Metrics request: ' + format, *args)
+
+        try:
+            self.http_server = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            logging.error(f"Could not serve metrics on {self.host}:{self.port}: {e}")
+            return
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+        logging.info('Serving metrics on http://%s:%d/metrics', self.host, self.http_server.server_address[1])
+
+    def stop(self):
+        """
+        Stops serving metrics.
+        """
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,143 @@
+import time
+import uuid
+import threading
+import contextvars
+
+from contextlib import contextmanager
+
+CORRELATION_ID_HEADER = "correlation-id"
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_stage = contextvars.ContextVar("current_stage", default=None)
+current_threads = contextvars.ContextVar("current_threads", default=None)
+
+
+class Trace:
+    """
+    Timed spans of one unit of work, identified by a correlation id. Spans are recorded on the trace that is
+    current in the calling context, so code along the way only has to open spans and not pass the trace around.
+    """
+    def __init__(self, trace_id=None, match_id=None, finish=False):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.match_id = match_id
+        self.finish = finish
+        self.started_at = time.time()
+        self.duration = None
+        self.status = None
+        # Correlation ids of messages coalesced into this unit of work
+        self.coalesced = []
+        self.spans = []
+
+    def add_span(self, name, started_at, duration, status="ok"):
+        """
+        Adds a span that was timed elsewhere. started_at is a time.time() timestamp.
+        """
+        self.spans.append({"name": name, "offset": started_at - self.started_at, "duration": duration, "status": status})
+
+    @contextmanager
+    def span(self, name):
+        """
+        Times a block as a span. A block that raises gets the error status.
+        """
+        started_at = time.time()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.add_span(name, started_at, time.perf_counter() - start, status)
+
+    @contextmanager
+    def activate(self):
+        """
+        Makes this the current trace for a block.
+        """
+        token = current_trace.set(self)
+        try:
+            yield self
+        finally:
+            current_trace.reset(token)
+
+    def end(self, status):
+        """
+        Ends the trace, which lasts from its start until now.
+        """
+        self.status = status
+        self.duration = time.time() - self.started_at
+
+    def get_breakdown(self):
+        """
+        Gets the total duration of each span name in seconds.
+        """
+        breakdown = {}
+        for span in self.spans:
+            breakdown[span["name"]] = breakdown.get(span["name"], 0.0) + span["duration"]
+        return breakdown
+
+
+@contextmanager
+def span(name):
+    """
+    Times a block as a span of the current trace, if there is one. The span name is the current stage within the
+    block either way.
+    """
+    token = current_stage.set(name)
+    try:
+        trace = current_trace.get()
+        if trace is None:
+            yield
+        else:
+            with trace.span(name):
+                yield
+    finally:
+        current_stage.reset(token)
+
+
+def get_correlation_id():
+    """
+    Gets the correlation id of the current trace, or None.
+    """
+    trace = current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+@contextmanager
+def track_threads():
+    """
+    Tracks the threads working on a block, the calling thread and the threads running functions wrapped with
+    in_context within it. Yields the set of their ids, which changes as threads start and finish their work.
+    """
+    thread_ids = {threading.get_ident()}
+    token = current_threads.set(thread_ids)
+    try:
+        yield thread_ids
+    finally:
+        current_threads.reset(token)
+
+
+def in_context(function):
+    """
+    Wraps a function that is handed to another thread, e.g. submitted to a thread pool, so it runs in a copy of
+    the calling context: its spans go to the current trace and its thread is tracked while it runs. Wrap once per
+    submission, a context can only be entered by one thread at a time.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(_run_tracked, function, args, kwargs)
+    return run
+
+
+def _run_tracked(function, args, kwargs):
+    thread_ids = current_threads.get()
+    if thread_ids is None:
+        return function(*args, **kwargs)
+    thread_id = threading.get_ident()
+    thread_ids.add(thread_id)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        thread_ids.discard(thread_id)
@@ -2,6 +2,9 @@ import os
 import requests
 import logging
 
+from archive import raw_payload_store
+from metrics import metrics_registry
+
 class PremierLeagueApi:
     """
     Provides methods to interact with the Premier League API.
@@ -13,7 +16,7 @@ class PremierLeagueApi:
         """
         url_template = os.getenv("PREMIER_LEAGUE_API_V1_BASE_URL") + os.getenv("PREMIER_LEAGUE_CLUBS_ENDPOINT")
         url = url_template.format(competition_id=competition_id, season=season)
-        return self._call_api(url)
+        return self._call_api(url, f"clubs/{competition_id}/{season}")
 
     def get_squad(self, competition_id, season, team_id):
         """
@@ -21,16 +24,18 @@ class PremierLeagueApi:
         """
         url_template = os.getenv("PREMIER_LEAGUE_API_V2_BASE_URL") + os.getenv("PREMIER_LEAGUE_SQUAD_ENDPOINT")
         url = url_template.format(competition_id=competition_id, season=season, team_id=team_id)
-        return self._call_api(url)
+        return self._call_api(url, f"squad/{competition_id}/{season}/{team_id}")
 
-    def _call_api(self, url):
+    def _call_api(self, url, resource_id):
         """        
-        Makes a GET request to the Premier League API and returns the JSON response.
+        Makes a GET request to the Premier League API, archives the raw response and returns the JSON response.
         If an error occurs, it logs the error and returns None.
         """
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            with metrics_registry.timer("api_request_seconds", api="premier_league", endpoint=resource_id.split("/")[0]):
+                response = requests.get(url)
+                response.raise_for_status()
+            raw_payload_store.store("premier_league", resource_id, response.content)
             return response.json()
         except Exception as e:
             logging.error(f"Error fetching Premier League data from {url}: {e}")
@@ -4,6 +4,8 @@ import requests
 
 from types import SimpleNamespace
 
+from archive import raw_payload_store
+
 from .premier_league_api import PremierLeagueApi
 from .premier_league_models import PremierLeagueTeam, PremierLeaguePlayer, PremierLeaguePlayerCountry, PremierLeaguePlayerName, PremierLeaguePlayerDates
 
@@ -80,6 +82,7 @@ class PremierLeagueService:
         request = requests.get(self.premier_league_player_photo_url.format(id = image_id))
 
         if (request.status_code == 200):
+            raw_payload_store.store("premier_league", f"photo/{image_id}", request.content)
             return request.content
         else:
             return None
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import unittest
+
+from unittest import mock
+
+import stomp
+
+from artemis import ArtemisConnectionManager, ArtemisListener, ArtemisSender, ArtemisStubBroker
+from d11.d11_cluster import D11Cluster, rendezvous_owner
+
+ACTIVE_MATCH_QUEUE = "D11::ACTIVE_MATCH"
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class ClusterInstance:
+    """
+    A daemon instance reduced to its cluster membership and ACTIVE_MATCH handling, with its own MQ connections.
+    """
+    def __init__(self, instance_id, port, handled):
+        environment = {
+            "D11_INSTANCE_ID": instance_id,
+            "D11_MQ_HOST": "127.0.0.1",
+            "D11_MQ_PORT": str(port),
+            "D11_MQ_ACK_MODE": "client-individual",
+            "D11_MQ_ASYNC_PUBLISH": "false",
+            "D11_CLUSTER_HEARTBEAT_SECONDS": "0.2",
+            "D11_CLUSTER_MEMBER_TIMEOUT_SECONDS": "1",
+        }
+        with mock.patch.dict(os.environ, environment):
+            self.artemis_connection_manager = ArtemisConnectionManager()
+            self.d11_cluster = D11Cluster(self.artemis_connection_manager, ArtemisSender(self.artemis_connection_manager))
+        self.instance_id = instance_id
+        self.handled = handled
+        self.stopped = False
+
+        queues = [ACTIVE_MATCH_QUEUE, self.d11_cluster.instance_queue]
+        handlers = {self.d11_cluster.topic: self.d11_cluster.on_message, self.d11_cluster.instance_queue: self.on_active_match}
+        self.listener = ArtemisListener(self.artemis_connection_manager, queues, self.on_active_match,
+                                        topics=[self.d11_cluster.topic], handlers=handlers)
+        self.d11_cluster.attach(self.listener, self.on_active_match)
+
+    def start(self):
+        self.artemis_connection_manager.set_listener(self.listener)
+        self.d11_cluster.start()
+
+    def stop(self, leave=True):
+        # Like a process that is gone, messages still arriving while disconnecting are left unacked and redelivered
+        self.stopped = True
+        if leave:
+            self.d11_cluster.stop()
+        else:
+            # Crash: no leaving announcement, the others have to time the instance out
+            self.d11_cluster.stop_event.set()
+            self.d11_cluster.thread.join()
+        self.artemis_connection_manager.disconnect()
+
+    def on_active_match(self, frame):
+        if self.stopped:
+            return
+        match_id = json.loads(frame.body)["matchId"]
+        generation = self.artemis_connection_manager.generation
+        if self.d11_cluster.route(frame, match_id, generation):
+            return
+        self.handled.append((self.instance_id, match_id))
+        self.artemis_connection_manager.ack(frame, generation)
+
+
+class D11ClusterTest(unittest.TestCase):
+    """
+    Runs two cluster instances against the STOMP stub broker.
+    """
+    def setUp(self):
+        self.stub_broker = ArtemisStubBroker()
+        self.port = self.stub_broker.start()
+        self.handled = []
+        self.instances = [ClusterInstance(instance_id, self.port, self.handled) for instance_id in ("a", "b")]
+        for instance in self.instances:
+            instance.start()
+        self.publisher = stomp.Connection([("127.0.0.1", self.port)])
+        self.publisher.connect(wait=True)
+        self.assertTrue(wait_for(lambda: all(instance.d11_cluster.get_members() == ["a", "b"] for instance in self.instances)))
+
+    def tearDown(self):
+        self.publisher.disconnect()
+        for instance in self.instances:
+            if instance.artemis_connection_manager.connection is not None:
+                instance.stop()
+        self.stub_broker.stop()
+
+    def publish(self, match_ids):
+        for match_id in match_ids:
+            self.publisher.send(destination=ACTIVE_MATCH_QUEUE, body=json.dumps({"matchId": match_id, "finish": False}),
+                                headers={"content-type": "application/json"})
+
+    def test_each_match_is_handled_once_by_its_owner(self):
+        match_ids = list(range(1, 41))
+        self.publish(match_ids)
+
+        self.assertTrue(wait_for(lambda: len(self.handled) >= len(match_ids)))
+        time.sleep(0.2)
+        self.assertEqual(sorted(match_id for _, match_id in self.handled), match_ids)
+        for instance_id, match_id in self.handled:
+            self.assertEqual(instance_id, rendezvous_owner(match_id, ["a", "b"]))
+        self.assertEqual({instance_id for instance_id, _ in self.handled}, {"a", "b"})
+
+    def test_ownership_moves_when_an_instance_leaves(self):
+        self.instances[1].stop()
+        self.assertTrue(wait_for(lambda: self.instances[0].d11_cluster.get_members() == ["a"]))
+
+        match_ids = list(range(1, 21))
+        self.publish(match_ids)
+
+        self.assertTrue(wait_for(lambda: len(self.handled) >= len(match_ids)))
+        self.assertEqual(sorted(match_id for _, match_id in self.handled), match_ids)
+        self.assertEqual({instance_id for instance_id, _ in self.handled}, {"a"})
+
+    def test_messages_forwarded_to_a_crashed_instance_are_drained(self):
+        self.instances[1].stop(leave=False)
+
+        # Until b times out, a still forwards b's matches to b's instance queue
+        match_ids = list(range(1, 21))
+        self.publish(match_ids)
+
+        self.assertTrue(wait_for(lambda: len(self.handled) >= len(match_ids)))
+        time.sleep(0.2)
+        self.assertEqual(sorted(match_id for _, match_id in self.handled), match_ids)
+        self.assertEqual(self.instances[0].d11_cluster.get_metrics()["draining"], ["D11::ACTIVE_MATCH.b"])
+
+
+if __name__ == "__main__":
+    unittest.main()